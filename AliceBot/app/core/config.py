@@ -66,6 +66,14 @@ class Config:
 
     # --- Tool Settings ---
     MAX_SEARCH_RESULTS = 3
+    # 注入对话的工具结果最大字符数，超出部分截断
+    MAX_TOOL_RESULT_CHARS = int(os.getenv("MAX_TOOL_RESULT_CHARS", "32000"))
+
+    # --- Semantic Cache Settings ---
+    # 语义缓存：同一用户、同一情绪下语义相近的消息直接复用上次的回复，默认关闭
+    SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+    SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+    SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", "600"))
 
     # --- Emotion & Personality Settings ---
     # 初始情绪状态
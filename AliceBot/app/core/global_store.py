@@ -2,14 +2,13 @@
 
 import os
 from datetime import datetime
-from typing import Dict, Any, Optional
-from pydantic import BaseModel
+from typing import Dict, Any, NamedTuple, Optional
 
 
-# 定义情绪数据模型
-class EmotionSnapshot(BaseModel):
+# 定义情绪数据模型（只读快照，轻量元组，_asdict() 直接得到写入状态的字典）
+class EmotionSnapshot(NamedTuple):
     primary_emotion: str
-    secondary_emotion: Optional[str] = None
+    secondary_emotion: Optional[str]
     valence: float
     arousal: float
     stress: float
@@ -486,7 +486,7 @@ async def _fallback_contextual_retrieval(scene, emotion, relation, max_contextua
 
 
 
-async def build_prompt_with_persona(core_persona, context, scene, emotion=None, relation=None, max_extended_items=5, max_contextual_items=2):
+async def build_prompt_with_persona(core_persona, context, scene, emotion=None, relation=None, max_extended_items=5, max_contextual_items=2, contextual_info=None):
     """
     动态构建包含核心人设、扩展人设和说话风格的完整prompt，增强情绪对说话风格的影响
     
@@ -498,17 +498,21 @@ async def build_prompt_with_persona(core_persona, context, scene, emotion=None,
         relation (str): 当前关系
         max_extended_items (int): 最大加载的扩展人设项数
         max_contextual_items (int): 最大加载的说话风格信息数量
+        contextual_info (str): 已提前检索的说话风格信息，为None时在此处检索
         
     Returns:
         str: 完整的prompt
     """
     import asyncio
     
-    # 并行执行两个异步调用
-    extended_info, contextual_info = await asyncio.gather(
-        retrieve_extended_persona(context, max_extended_items),
-        retrieve_contextual_persona(scene, emotion, relation, max_contextual_items)
-    )
+    if contextual_info is None:
+        # 并行执行两个异步调用
+        extended_info, contextual_info = await asyncio.gather(
+            retrieve_extended_persona(context, max_extended_items),
+            retrieve_contextual_persona(scene, emotion, relation, max_contextual_items)
+        )
+    else:
+        extended_info = await retrieve_extended_persona(context, max_extended_items)
     
     # 组合完整prompt
     prompt = f"{core_persona}"
@@ -687,27 +691,14 @@ def generate_emotion_style_guide(emotion: str) -> str:
 
 
 # --- 4. 主动社交意愿 Prompt ---
-SOCIAL_VOLITION_PROMPT = """
+# 拆分为静态前缀（人设、行为规则、输出格式）和动态情境两部分：
+# 静态前缀在所有用户、所有调用间保持完全一致，便于模型服务端的前缀缓存命中
+SOCIAL_VOLITION_STATIC_PROMPT = """
 {alice_core_persona}
 
 你现在是Alice的**后台思考时间**。
 你并不是在回答用户的问题，而是在根据当前的情境判断是否要**主动**发起对话、接茬、或者结束话题。
 
-【当前环境】
-- 时间: {current_time} ({time_period})
-- 距离上次发言: {silence_duration}
-- 你的状态: 心情 {mood} (活力 {stamina:.1f})
-- 聊天类型: {chat_type}
-
-【对话对象】
-- 用户: {user_name}
-- 关系: 好感度 {intimacy}/100 | 熟悉度 {familiarity}/100 | 信任度 {trust}/100 | 兴趣匹配 {interest_match}/100 | 标签: {relation_tags} | 备注: {relation_notes}
-- 接收到的图片: {vision_desc}
-- 个性化信息: {personalized_info}
-
-【最近话题摘要】
-{conversation_summary}
-
 【行为逻辑库 (Strict Rules)】
 根据**聊天类型**、**好感度**和**当前情境**选择一种逻辑：
 
@@ -766,3 +757,22 @@ SOCIAL_VOLITION_PROMPT = """
 - 如果 silence_duration 极短（<1分钟）且没有新图片，通常选 `silent`，避免刷屏烦人。
 """
 
+SOCIAL_VOLITION_CONTEXT_PROMPT = """
+【当前环境】
+- 时间: {current_time} ({time_period})
+- 距离上次发言: {silence_duration}
+- 你的状态: 心情 {mood} (活力 {stamina:.1f})
+- 聊天类型: {chat_type}
+
+【对话对象】
+- 用户: {user_name}
+- 关系: 好感度 {intimacy}/100 | 熟悉度 {familiarity}/100 | 信任度 {trust}/100 | 兴趣匹配 {interest_match}/100 | 标签: {relation_tags} | 备注: {relation_notes}
+- 接收到的图片: {vision_desc}
+- 个性化信息: {personalized_info}
+
+【最近话题摘要】
+{conversation_summary}
+"""
+
+# 兼容旧接口的完整Prompt
+SOCIAL_VOLITION_PROMPT = SOCIAL_VOLITION_STATIC_PROMPT + SOCIAL_VOLITION_CONTEXT_PROMPT
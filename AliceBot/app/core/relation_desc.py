@@ -0,0 +1,74 @@
+# app/core/relation_desc.py
+
+from bisect import bisect_left, bisect_right
+from typing import Dict, Tuple
+
+# 好感度区间分界：<20, <40, <60, <80, 其余
+_INTIMACY_BOUNDS = (20, 40, 60, 80)
+# 熟悉度/信任度/兴趣匹配的等级分界：分别对应 >70, >80, >90
+_LEVEL_BOUNDS = (70, 80, 90)
+
+# 人设提示词使用的简化关系类型：按好感度与熟悉度中较低者划分，>10, >40, >70
+_PERSONA_BOUNDS = (10, 40, 70)
+PERSONA_RELATIONS = ("陌生人", "熟人", "普通朋友", "好朋友")
+
+# 低好感度区间的措辞因场景而异：(好感度<20, 好感度<40, 好感度<40且信任度<30)
+REPLY_LOW_LABELS = ("陌生人", "认识的人", "认识的人")
+PSYCHOLOGY_LOW_LABELS = ("讨厌的人", "普通路人", "不怎么信任的人")
+
+
+def _friend_desc(band: int, familiarity_level: int, trust_level: int, interest_level: int) -> str:
+    """好感度>=40 时的关系描述规则，仅用于生成查找表"""
+    if band == 2:
+        if familiarity_level >= 1:
+            return "熟悉的朋友"
+        if trust_level >= 1:
+            return "值得信任的朋友"
+        return "普通的朋友"
+    if band == 3:
+        if familiarity_level >= 2 and trust_level >= 2:
+            return "亲密的朋友"
+        if interest_level >= 2:
+            return "志同道合的朋友"
+        return "值得信赖的朋友"
+    if familiarity_level >= 3 and trust_level >= 3:
+        return "最亲密的朋友"
+    return "非常要好的朋友"
+
+
+# (好感度区间, 熟悉度等级, 信任度等级, 兴趣匹配等级) -> 关系描述，导入时一次性生成
+RELATION_TABLE: Dict[Tuple[int, int, int, int], str] = {
+    (band, f, t, im): _friend_desc(band, f, t, im)
+    for band in range(2, len(_INTIMACY_BOUNDS) + 1)
+    for f in range(len(_LEVEL_BOUNDS) + 1)
+    for t in range(len(_LEVEL_BOUNDS) + 1)
+    for im in range(len(_LEVEL_BOUNDS) + 1)
+}
+
+
+def describe(intimacy: float, familiarity: float, trust: float, interest_match: float,
+             low_labels: Tuple[str, str, str] = REPLY_LOW_LABELS) -> str:
+    """
+    根据关系的四个维度生成关系描述
+    :param low_labels: 好感度<40 时使用的措辞，见 REPLY_LOW_LABELS / PSYCHOLOGY_LOW_LABELS
+    :return: 关系描述
+    """
+    band = bisect_right(_INTIMACY_BOUNDS, intimacy)
+    if band == 0:
+        return low_labels[0]
+    if band == 1:
+        return low_labels[2] if trust < 30 else low_labels[1]
+    return RELATION_TABLE[(
+        band,
+        bisect_left(_LEVEL_BOUNDS, familiarity),
+        bisect_left(_LEVEL_BOUNDS, trust),
+        bisect_left(_LEVEL_BOUNDS, interest_match),
+    )]
+
+
+def persona_relation(intimacy: float, familiarity: float) -> str:
+    """
+    根据好感度和熟悉度确定人设提示词中的关系类型（两者都超过某档阈值才算该档）
+    :return: 关系类型
+    """
+    return PERSONA_RELATIONS[bisect_left(_PERSONA_BOUNDS, min(intimacy, familiarity))]
@@ -33,6 +33,7 @@ class AgentState(TypedDict):
 
     # [修改点] 视觉相关字段
     current_image_artifact: Optional[str]  # 只有"有意义的图片"才存这里(Base64)
+    current_image_data_url: Optional[str]  # current_image_artifact 对应的 data URL，感知阶段生成一次
     visual_input: Optional[str]
     visual_type: Optional[str]  # 新增: 'photo', 'sticker', 'icon', 'none'
 
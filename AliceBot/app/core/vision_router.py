@@ -1,6 +1,5 @@
 import json
 import logging
-from datetime import datetime
 from typing import List, Union
 
 # 配置日志
@@ -9,6 +8,7 @@ from langchain_openai import ChatOpenAI
 from langchain_core.messages import SystemMessage, HumanMessage, BaseMessage, AIMessage
 from app.core.config import config
 from app.utils.cache import cached_llm_invoke
+from app.utils.log_time import log_ts
 
 # --- 优化后的路由策略 (Few-Shot Context Aware) ---
 ROUTER_SYSTEM_PROMPT = """你是 AI 代理的“视觉皮层”。
@@ -81,12 +81,12 @@ class VisionRouter:
             last_query = recent_msgs[-1].content if recent_msgs else ""
             if len(str(last_query)) > 20: last_query = str(last_query)[:20] + "..."
 
-            ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            ts = log_ts()
             logger.info(f"[{ts}] --- [Router] Needs Vision? {result} (Context: {last_query}) ---")
             return result
 
         except Exception as e:
-            ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            ts = log_ts()
             logger.error(f"[{ts}] [Router Error] {e} -> Defaulting to TRUE (Safety Fallback)")
             return True
 
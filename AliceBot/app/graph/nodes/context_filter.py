@@ -5,7 +5,6 @@ import re
 import time
 import logging
 import random
-from datetime import datetime
 
 # 配置日志
 logger = logging.getLogger("ContextFilter")
@@ -15,6 +14,7 @@ from langchain_core.messages import SystemMessage, HumanMessage
 from app.core.state import AgentState
 from app.core.config import config
 from app.utils.cache import cached_llm_invoke
+from app.utils.log_time import log_ts
 
 # 导入表情包处理相关模块
 from app.plugins.emoji_plugin.emoji_service import get_emoji_service
@@ -148,27 +148,30 @@ def _build_context_history(msgs: list) -> str:
     构建上下文历史字符串
     """
     recent_msgs = msgs[-3:]
-    history_str = ""
+    last_idx = len(recent_msgs) - 1
+    parts = []
     
     for i, m in enumerate(recent_msgs):
         role = "AI(Alice)" if isinstance(m, (SystemMessage, dict)) or m.type == "ai" else "User"
         content = m.content
         
         if isinstance(content, list):
-            text_part = next((x['text'] for x in content if x.get('type') == 'text'), "")
-            if not text_part:
-                text_part = "[Image/RichMedia]"
-            content = text_part
+            text_part = ""
+            for x in content:
+                if x.get('type') == 'text':
+                    text_part = x['text']
+                    break
+            content = text_part or "[Image/RichMedia]"
 
         # 截断过长消息防止 Prompt 爆炸
         content_str = str(content)
         if len(content_str) > 100:
             content_str = content_str[:100] + "..."
 
-        prefix = ">> [LATEST MSG] " if i == len(recent_msgs) - 1 else ""
-        history_str += f"{prefix}[{role}]: {content_str}\n"
+        prefix = ">> [LATEST MSG] " if i == last_idx else ""
+        parts.append(f"{prefix}[{role}]: {content_str}\n")
     
-    return history_str
+    return "".join(parts)
 
 
 def _apply_heuristic_pre_filter(state: AgentState, last_content: str, has_img: bool) -> dict or None:
@@ -193,7 +196,7 @@ def _apply_heuristic_pre_filter(state: AgentState, last_content: str, has_img: b
 
 async def context_filter_node(state: AgentState):
     current_ts = time.time()
-    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    ts = log_ts()
     is_group = state.get("is_group", False)
     is_mentioned = state.get("is_mentioned", False)
     user_qq = state.get("sender_qq", "unknown")
@@ -223,7 +226,7 @@ async def context_filter_node(state: AgentState):
     # 处理纯表情包消息：只存储不回复或概率回复
     if is_emoji_only:
         # 概率回复：50%的概率不回复，50%的概率回复
-        if random.random() < 0.5:
+        if random.getrandbits(1):
             logger.info(f"[{ts}]🎲 [Filter] 纯表情包消息，不进行回复")
             return {
                 "should_reply": False,
@@ -1,6 +1,7 @@
 import json
 import logging
 from datetime import datetime
+from typing import Optional, Tuple
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.messages import SystemMessage
@@ -9,6 +10,7 @@ from app.core.config import config
 from app.memory.vector_store import vector_db
 from app.memory.combined_memory import combined_memory
 from app.utils.cache import cached_llm_invoke
+from app.utils.log_time import log_ts
 
 # ... Prompt 保持不变，篇幅原因省略，请确保保留原文件中的 MEMORY_SYSTEM_PROMPT ...
 MEMORY_SYSTEM_PROMPT = """
@@ -58,25 +60,20 @@ llm = ChatOpenAI(
 logger = logging.getLogger("MemorySaver")
 
 
-async def extract_and_save_memories(messages: list, real_user_id: str, user_nickname: str):
+def get_extraction_context(messages: list) -> Optional[Tuple[str, str, str]]:
     """
-    从对话消息中提取重要信息并保存到长期记忆
+    确定记忆提取的模式和输入（只看最后一轮对话）
     
     Args:
         messages: 对话消息列表
-        real_user_id: 真实用户ID
-        user_nickname: 用户昵称
         
     Returns:
-        dict: 包含提取的记忆信息的字典
+        (mode, user_text, ai_output)，无可提取内容时返回 None
     """
-    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    if not messages: return {"extracted_count": 0, "saved_count": 0}
+    if not messages: return None
 
     last_msg = messages[-1]
     ai_output = "N/A (AI remained silent)"
-    mode = "OBSERVATION"
-    user_text = ""
 
     if last_msg.type == 'ai':
         mode = "INTERACTIVE"
@@ -84,7 +81,7 @@ async def extract_and_save_memories(messages: list, real_user_id: str, user_nick
         if len(messages) >= 2:
             user_text = messages[-2].content
         else:
-            return {"extracted_count": 0, "saved_count": 0}
+            return None
     else:
         mode = "OBSERVATION"
         user_text = last_msg.content
@@ -92,6 +89,104 @@ async def extract_and_save_memories(messages: list, real_user_id: str, user_nick
     if isinstance(user_text, list):
         user_text = next((x['text'] for x in user_text if x['type'] == 'text'), "[Image]")
 
+    return mode, user_text, ai_output
+
+
+async def save_memory_operations(operations: list, mode: str, user_text: str, ai_output: str,
+                                 real_user_id: str, user_nickname: str) -> int:
+    """
+    过滤 LLM 给出的记忆操作并保存到长期记忆
+    
+    Args:
+        operations: LLM 输出的记忆操作列表
+        mode: 提取模式（INTERACTIVE / OBSERVATION）
+        user_text: 用户输入
+        ai_output: AI 回复
+        real_user_id: 真实用户ID
+        user_nickname: 用户昵称
+        
+    Returns:
+        int: 实际保存的记忆条数
+    """
+    ts = log_ts()
+    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    logger.info(f"[{ts}] 🧠 [Memory Debug] Extracted {len(operations)} operations from conversation")
+    logger.info(f"[{ts}] 🧠 [Memory Debug] Operations: {operations}")
+
+    facts_to_add = []
+    metadatas_to_add = []
+
+    for op in operations:
+        action = op.get("action")
+        content = op.get("content", "")
+        category = op.get("category", "event")
+        importance = op.get("importance", 1)
+
+        # 增强的重要性判断逻辑
+        # 1. 检查是否包含明确的指令性词汇
+        instruction_keywords = ["要记住", "记住", "重要", "关键", "一定要", "务必", "牢记"]
+        has_instruction = any(keyword in content for keyword in instruction_keywords)
+        has_instruction_in_input = any(keyword in user_text for keyword in instruction_keywords)
+        
+        # 2. 如果有明确指令，强制提高重要性
+        if has_instruction or has_instruction_in_input:
+            importance = max(importance, 5)  # 最高重要性
+        
+        # 3. 过滤不重要的信息
+        # 在任何模式下，重要性低于2的信息都不存储
+        if importance < 2:
+            continue
+            
+        # 4. 在OBSERVATION模式下，需要更高的重要性
+        if mode == "OBSERVATION" and importance < 4:
+            continue
+
+        if action == "add":
+            final_content = f"User {user_nickname} (ID:{real_user_id}): {content}"
+            full_text = f"[{current_time}] ({category.upper()}) {final_content}"
+
+            facts_to_add.append(full_text)
+            metadatas_to_add.append({
+                "source": "chat" if mode == "INTERACTIVE" else "observation",
+                "user_id": real_user_id, # 修改点：Metadata Key
+                "created_at": current_time,
+                "importance": importance,
+                "category": category
+            })
+
+            logger.info(f"[{ts}] 🧠 [Memory] Saved ({mode}): {content} (ID: {real_user_id}, Importance: {importance})")
+
+    if facts_to_add:
+        await vector_db.add_texts(facts_to_add, metadatas_to_add)
+        
+        # 同时更新组合内存管理器
+        try:
+            await combined_memory.update_memory(user_text, ai_output, real_user_id, user_nickname)
+            logger.info(f"[{ts}] 🧠 [CombinedMemory] Updated memories for user {real_user_id}")
+        except Exception as e:
+            logger.error(f"[{ts}] ❌ [CombinedMemory] Failed to update: {e}")
+
+    return len(facts_to_add)
+
+
+async def extract_and_save_memories(messages: list, real_user_id: str, user_nickname: str):
+    """
+    从对话消息中提取重要信息并保存到长期记忆
+    
+    Args:
+        messages: 对话消息列表
+        real_user_id: 真实用户ID
+        user_nickname: 用户昵称
+        
+    Returns:
+        dict: 包含提取的记忆信息的字典
+    """
+    ts = log_ts()
+    context = get_extraction_context(messages)
+    if context is None: return {"extracted_count": 0, "saved_count": 0}
+    mode, user_text, ai_output = context
+
     try:
         prompt = ChatPromptTemplate.from_template(MEMORY_SYSTEM_PROMPT)
         
@@ -116,67 +211,11 @@ async def extract_and_save_memories(messages: list, real_user_id: str, user_nick
         data = json.loads(raw_content)
 
         operations = data.get("operations", [])
-        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        logger.info(f"[{ts}] 🧠 [Memory Debug] Extracted {len(operations)} operations from conversation")
-        logger.info(f"[{ts}] 🧠 [Memory Debug] Operations: {operations}")
-
-        facts_to_add = []
-        metadatas_to_add = []
-
-        for op in operations:
-            action = op.get("action")
-            content = op.get("content", "")
-            category = op.get("category", "event")
-            importance = op.get("importance", 1)
-
-            # 增强的重要性判断逻辑
-            # 1. 检查是否包含明确的指令性词汇
-            instruction_keywords = ["要记住", "记住", "重要", "关键", "一定要", "务必", "牢记"]
-            has_instruction = any(keyword in content for keyword in instruction_keywords)
-            has_instruction_in_input = any(keyword in user_text for keyword in instruction_keywords)
-            
-            # 2. 如果有明确指令，强制提高重要性
-            if has_instruction or has_instruction_in_input:
-                importance = max(importance, 5)  # 最高重要性
-            
-            # 3. 过滤不重要的信息
-            # 在任何模式下，重要性低于2的信息都不存储
-            if importance < 2:
-                continue
-                
-            # 4. 在OBSERVATION模式下，需要更高的重要性
-            if mode == "OBSERVATION" and importance < 4:
-                continue
-
-            if action == "add":
-                final_content = f"User {user_nickname} (ID:{real_user_id}): {content}"
-                full_text = f"[{current_time}] ({category.upper()}) {final_content}"
-
-                facts_to_add.append(full_text)
-                metadatas_to_add.append({
-                    "source": "chat" if mode == "INTERACTIVE" else "observation",
-                    "user_id": real_user_id, # 修改点：Metadata Key
-                    "created_at": current_time,
-                    "importance": importance,
-                    "category": category
-                })
-
-                logger.info(f"[{ts}] 🧠 [Memory] Saved ({mode}): {content} (ID: {real_user_id}, Importance: {importance})")
-
-        if facts_to_add:
-            await vector_db.add_texts(facts_to_add, metadatas_to_add)
-            
-            # 同时更新组合内存管理器
-            try:
-                await combined_memory.update_memory(user_text, ai_output, real_user_id, user_nickname)
-                logger.info(f"[{ts}] 🧠 [CombinedMemory] Updated memories for user {real_user_id}")
-            except Exception as e:
-                logger.error(f"[{ts}] ❌ [CombinedMemory] Failed to update: {e}")
+        saved_count = await save_memory_operations(operations, mode, user_text, ai_output, real_user_id, user_nickname)
 
         return {
             "extracted_count": len(operations),
-            "saved_count": len(facts_to_add)
+            "saved_count": saved_count
         }
 
     except Exception as e:
@@ -72,7 +72,8 @@ async def parallel_processing_node(state: AgentState) -> dict:
         # 如果没运行视觉，显式重置视觉状态，防止上一轮的残留干扰
         merged_update.update({
             "visual_type": "none",
-            "current_image_artifact": None
+            "current_image_artifact": None,
+            "current_image_data_url": None
         })
 
     return merged_update
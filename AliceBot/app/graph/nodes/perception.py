@@ -1,16 +1,21 @@
+import asyncio
 import base64
 import httpx
 import io
-import re  # <--- 新增
 import logging
+import numpy as np
+from collections import OrderedDict
 from PIL import Image
 from langchain_core.messages import HumanMessage, SystemMessage
 from app.core.state import AgentState
 from app.core.config import config
 from app.plugins.emoji_plugin.emoji_manager import get_emoji_manager
 from app.utils.cache import cached_llm_invoke
+from app.utils.json_extract import find_json_array, find_json_object
+from app.utils import fastjson
 from langchain_openai import ChatOpenAI
 from typing import List, Optional, Dict, Tuple, Any
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
 
 # 初始化LLM实例
 llm = ChatOpenAI(
@@ -26,53 +31,222 @@ logger = logging.getLogger("Perception")
 # 用于在内存中临时缓存已处理的图片尺寸信息，避免重复下载
 _IMG_CACHE = {}
 
+# 图片下载共享的HTTP客户端，复用连接池，避免每张图片都重新建立连接和TLS握手
+_HTTP_CLIENT = httpx.AsyncClient(
+    timeout=httpx.Timeout(10.0, connect=3.0),
+    limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+)
+
+# 直接发送给大模型的原始图片大小上限，超出时重新压缩
+_LLM_IMAGE_MAX_BYTES = 4 * 1024 * 1024
+
+# 合法图片URL前缀
+_URL_PREFIXES = ("http://", "https://")
+
+# 感知哈希 -> LLM分析结果缓存，轻微重压缩的同一表情包可以复用分析结果
+_PHASH_CACHE: "OrderedDict[int, tuple[bool, dict]]" = OrderedDict()
+_PHASH_CACHE_MAX_SIZE = 512
+_PHASH_MAX_DISTANCE = 4  # 汉明距离不超过该值视为同一张图片
+
+# 感知哈希使用的DCT变换矩阵（32x32灰度图，取左上角8x8低频分量）
+_PHASH_IMG_SIZE = 32
+_PHASH_HASH_SIZE = 8
+_DCT_MATRIX = np.cos(
+    np.pi / (2 * _PHASH_IMG_SIZE)
+    * np.outer(np.arange(_PHASH_IMG_SIZE), 2 * np.arange(_PHASH_IMG_SIZE) + 1)
+)
+
+
+def _compute_phash(image: Image.Image) -> Optional[int]:
+    """
+    计算图片的64位感知哈希（pHash）
+    
+    Returns:
+        int: 感知哈希值，计算失败时返回None
+    """
+    try:
+        gray = image.convert("L").resize((_PHASH_IMG_SIZE, _PHASH_IMG_SIZE), Image.Resampling.LANCZOS)
+        pixels = np.asarray(gray, dtype=np.float64)
+        low_freq = (_DCT_MATRIX @ pixels @ _DCT_MATRIX.T)[:_PHASH_HASH_SIZE, :_PHASH_HASH_SIZE]
+        bits = (low_freq > np.median(low_freq)).flatten()
+        return int.from_bytes(np.packbits(bits).tobytes(), "big")
+    except Exception as e:
+        logger.debug(f"感知哈希计算失败: {e}")
+        return None
+
+
+def _phash_cache_lookup(phash: int) -> Optional[tuple[bool, dict]]:
+    """查找汉明距离足够小的已缓存分析结果"""
+    for cached_phash, result in reversed(_PHASH_CACHE.items()):
+        if (phash ^ cached_phash).bit_count() <= _PHASH_MAX_DISTANCE:
+            _PHASH_CACHE.move_to_end(cached_phash)
+            return result
+    return None
+
+
+def _phash_cache_store(phash: int, result: tuple[bool, dict]) -> None:
+    """写入感知哈希缓存，超出容量时淘汰最久未使用的条目"""
+    _PHASH_CACHE[phash] = result
+    _PHASH_CACHE.move_to_end(phash)
+    if len(_PHASH_CACHE) > _PHASH_CACHE_MAX_SIZE:
+        _PHASH_CACHE.popitem(last=False)
+
+
+def _is_analysis_json(data: Any) -> bool:
+    """解析结果是否像图片分析结果：单个对象，或至少包含一个对象的数组（排除正文中的 "[1]" 之类）"""
+    if isinstance(data, dict):
+        return True
+    return isinstance(data, list) and any(isinstance(item, dict) for item in data)
 
-async def _process_image_with_llm(base64_data: str) -> tuple[bool, dict]:
+
+def _iter_json_candidates(text: str):
+    """
+    按优先级依次给出可能的JSON子串：每个 "[" 处开始的配平数组（跳过正文里的 "[图片1]" 之类）、
+    第一个配平对象、首尾括号之间的切片；Markdown 代码块无需单独处理
+    """
+    pos = text.find("[")
+    while pos != -1:
+        span = find_json_array(text, pos)
+        if span is not None:
+            yield span
+        pos = text.find("[", pos + 1)
+    span = find_json_object(text)
+    if span is not None:
+        yield span
+    for open_ch, close_ch in (("[", "]"), ("{", "}")):
+        start = text.find(open_ch)
+        end = text.rfind(close_ch)
+        if start != -1 and end > start:
+            yield text[start: end + 1]
+
+
+def _parse_analysis_json(text: str) -> Any:
     """
-    使用大模型同时完成图片是否为表情包的判断和分析
+    从LLM响应中解析图片分析结果的JSON（对象数组或单个对象）
+    
+    Returns:
+        第一个能解析且结构相符的列表或字典，都不符合时返回None
+    """
+    for candidate in _iter_json_candidates(text):
+        try:
+            data = fastjson.loads(candidate)
+        except fastjson.JSONDecodeError:
+            continue
+        if _is_analysis_json(data):
+            return data
+    return None
+
+
+def _default_analysis() -> dict:
+    """分析失败时使用的默认结果"""
+    return {
+        "emotions": ["未知"],
+        "description": "",
+        "category": "其他"
+    }
+
+
+# 表情包分类选项
+_ALLOWED_CATEGORIES = frozenset(["表情符号", "人物形象", "动物植物", "场景生活", "文字梗图", "其他"])
+
+# 图片判断与分析的系统提示词 - 整合判断和分析功能
+_SYSTEM_PROMPT_CLASSIFY = ("你是一个专业的表情包分析专家，具有丰富的网络文化知识和情感分析能力。\n" 
+                           "用户会按顺序发送一张或多张图片，请逐张仔细观察图片内容，完成以下任务：\n" 
+                           "\n" 
+                           "1. 首先判断每张图片是否为表情包（sticker）\n" 
+                           "   - 表情包的定义：\n" 
+                           "     * 通常是具有夸张表情、动作或文字的图片\n" 
+                           "     * 用于在聊天中表达情感或调侃\n" 
+                           "     * 通常具有卡通风格或经过特殊处理\n" 
+                           "     * 尺寸通常较小，比例接近正方形\n" 
+                           "   - 普通图片的定义：\n" 
+                           "     * 真实的照片（如风景、人物、食物等）\n" 
+                           "     * 没有明显的夸张表情或动作\n" 
+                           "     * 通常用于记录真实场景\n" 
+                           "\n" 
+                           "2. 如果是表情包，请从以下几个方面分析：\n" 
+                           "   - 情绪标签：精确识别表情包传达的核心情绪，使用中文关键词，最多5个，按情绪强度排序\n" 
+                           "   - 描述：简洁明了地描述表情包的视觉内容和核心元素，不超过50字\n" 
+                           "   - 分类：从以下选项中选择唯一最合适的：表情符号、人物形象、动物植物、场景生活、文字梗图、其他\n" 
+                           "\n" 
+                           "请严格按照以下JSON数组格式输出，数组中第i个元素对应第i张图片，元素数量必须与图片数量一致，不要添加任何额外内容、解释或说明：\n" 
+                           "[{\"is_emoji\": true/false, \"emotions\": [\"情绪标签1\", \"情绪标签2\"], \"description\": \"描述内容\", \"category\": \"分类名称\"}]")
+
+# 系统消息内容固定，所有调用共享同一个对象
+_SYSTEM_MESSAGE_CLASSIFY = SystemMessage(content=_SYSTEM_PROMPT_CLASSIFY)
+
+
+class EmojiAnalysis(BaseModel):
+    """
+    大模型返回的单张图片分析结果
+    
+    只有 is_emoji 做结构校验；其余字段格式经常不规范（如 emotions 给成字符串），
+    放在 _validate_analysis 里逐项清理，某个字段不对时只重置该字段
+    """
+    is_emoji: bool = False
+    emotions: Any = Field(default_factory=list)
+    description: Any = ""
+    category: Any = "其他"
+
+
+# 逐张图片做结构校验，is_emoji 格式不对或不是对象时只影响这一张
+_ANALYSIS_ADAPTER = TypeAdapter(EmojiAnalysis)
+
+
+def _validate_analysis(analysis: EmojiAnalysis) -> tuple[bool, dict]:
+    """
+    清理单张图片的LLM分析结果
     
     Args:
-        base64_data: 图片的base64编码数据
+        analysis: 已通过结构校验的分析结果
         
     Returns:
-        tuple[bool, dict]: (是否为表情包, 分析结果)
-        分析结果包含: emotions (情绪标签), description (描述), category (分类)
+        tuple[bool, dict]: (是否为表情包, 已验证的分析结果)
     """
-    try:
-        logger.info(f"🎨 [Perception] 开始使用大模型判断和分析图片")
+    # 非表情包不需要分析结果
+    if not analysis.is_emoji:
+        return False, {}
+    
+    emotions = analysis.emotions
+    description = analysis.description
+    category = analysis.category
+    return True, {
+        # 过滤空标签并确保是字符串类型，限制最多5个标签
+        "emotions": [str(e).strip() for e in emotions if e and isinstance(e, (str, int, float))][:5]
+                    if isinstance(emotions, list) and emotions else ["未知"],
+        # 限制50字
+        "description": description.strip()[:50] if isinstance(description, str) else "",
+        "category": category if isinstance(category, str) and category in _ALLOWED_CATEGORIES else "其他"
+    }
+
+
+async def _query_images_with_llm(batch: list[str]) -> list[Optional[tuple[bool, dict]]]:
+    """
+    使用一次多模态大模型调用，批量完成多张图片的表情包判断和分析
+    
+    N张图片只需一次网络往返，系统提示词也只需发送一次
+    
+    Args:
+        batch: 图片的base64编码数据列表
         
-        # 构造系统提示词 - 整合判断和分析功能
-        system_prompt = ("你是一个专业的表情包分析专家，具有丰富的网络文化知识和情感分析能力。\n" 
-                        "请仔细观察图片内容，完成以下任务：\n" 
-                        "\n" 
-                        "1. 首先判断这张图片是否为表情包（sticker）\n" 
-                        "   - 表情包的定义：\n" 
-                        "     * 通常是具有夸张表情、动作或文字的图片\n" 
-                        "     * 用于在聊天中表达情感或调侃\n" 
-                        "     * 通常具有卡通风格或经过特殊处理\n" 
-                        "     * 尺寸通常较小，比例接近正方形\n" 
-                        "   - 普通图片的定义：\n" 
-                        "     * 真实的照片（如风景、人物、食物等）\n" 
-                        "     * 没有明显的夸张表情或动作\n" 
-                        "     * 通常用于记录真实场景\n" 
-                        "\n" 
-                        "2. 如果是表情包，请从以下几个方面分析：\n" 
-                        "   - 情绪标签：精确识别表情包传达的核心情绪，使用中文关键词，最多5个，按情绪强度排序\n" 
-                        "   - 描述：简洁明了地描述表情包的视觉内容和核心元素，不超过50字\n" 
-                        "   - 分类：从以下选项中选择唯一最合适的：表情符号、人物形象、动物植物、场景生活、文字梗图、其他\n" 
-                        "\n" 
-                        "请严格按照以下JSON格式输出，不要添加任何额外内容、解释或说明：\n" 
-                        "{\"is_emoji\": true/false, \"emotions\": [\"情绪标签1\", \"情绪标签2\"], \"description\": \"描述内容\", \"category\": \"分类名称\"}")
+    Returns:
+        list: 与输入顺序一致的 (是否为表情包, 分析结果) 列表，调用或解析失败的图片为None
+    """
+    try:
+        logger.info(f"🎨 [Perception] 开始使用大模型批量判断和分析 {len(batch)} 张图片")
         
-        # 构造用户消息，使用正确的多模态格式
+        # 构造用户消息，使用正确的多模态格式（一条消息携带全部图片）
         message_content: list[str | dict[str, Any]] = [
-            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_data}"}},
-            {"type": "text", "text": "请判断这张图片是否为表情包，如果是，请生成情绪标签、描述和分类信息。"}
+            {"type": "text", "text": f"以下共{len(batch)}张图片，请按顺序判断每张图片是否为表情包，如果是，请生成情绪标签、描述和分类信息。"}
         ]
+        message_content.extend(
+            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_data}"}}
+            for base64_data in batch
+        )
         
         # 构造消息列表
         messages = [
-            SystemMessage(content=system_prompt),
+            _SYSTEM_MESSAGE_CLASSIFY,
             HumanMessage(content=message_content)
         ]
         
@@ -94,80 +268,92 @@ async def _process_image_with_llm(base64_data: str) -> tuple[bool, dict]:
         logger.info(f"🎨 [Perception] LLM响应: {response_content[:150]}...")
         
         # 解析JSON响应
-        import json
-        import re
+        data = _parse_analysis_json(response_content)
+        if data is None:
+            logger.error(f"❌ [Perception] JSON解析失败, 响应内容: {response_content[:100]}...")
+            return [None] * len(batch)
         
-        # 提取Markdown JSON
-        match = re.search(r"```(?:json)?\s*(\{.*?\})\s*```", response_content, re.DOTALL)
-        if match:
-            json_content = match.group(1)
-        else:
-            # 尝试找到JSON的开始和结束位置
-            start = response_content.find("{")
-            end = response_content.rfind("}")
-            if start != -1 and end != -1:
-                json_content = response_content[start: end + 1]
-            else:
-                json_content = response_content
+        # 兼容模型只返回单个对象的情况
+        if isinstance(data, dict):
+            data = [data]
         
-        try:
-            result = json.loads(json_content)
-            
-            # 验证并清理结果
-            is_emoji = result.get("is_emoji", False)
-            valid_result: dict[str, Any] = {}
-            
-            # 如果是表情包，验证情绪标签、描述和分类
-            if is_emoji:
-                allowed_categories = ["表情符号", "人物形象", "动物植物", "场景生活", "文字梗图", "其他"]
-                
-                # 处理情绪标签
-                emotions = result.get("emotions", [])
-                if isinstance(emotions, list) and emotions:
-                    # 过滤空标签并确保是字符串类型
-                    valid_emotions = [str(e).strip() for e in emotions if e and isinstance(e, (str, int, float))]
-                    # 限制最多5个标签
-                    valid_result["emotions"] = valid_emotions[:5]
-                else:
-                    valid_result["emotions"] = ["未知"]
-                
-                # 处理描述
-                description = result.get("description", "")
-                if isinstance(description, str) and description.strip():
-                    valid_result["description"] = description.strip()[:50]  # 限制50字
-                else:
-                    valid_result["description"] = ""
-                
-                # 处理分类
-                category = result.get("category", "其他")
-                if isinstance(category, str) and category in allowed_categories:
-                    valid_result["category"] = category
-                else:
-                    valid_result["category"] = "其他"
-            
-            logger.info(f"🎨 [Perception] LLM判断结果: {'是表情包' if is_emoji else '不是表情包'}")
+        if len(data) != len(batch):
+            logger.warning(f"⚠️ [Perception] LLM返回结果数量({len(data)})与图片数量({len(batch)})不一致")
+        
+        results: list[Optional[tuple[bool, dict]]] = []
+        for i in range(len(batch)):
+            if i >= len(data):
+                results.append(None)
+                continue
+            try:
+                analysis = _ANALYSIS_ADAPTER.validate_python(data[i])
+            except ValidationError as e:
+                logger.warning(f"⚠️ [Perception] 第 {i+1} 张图片的分析结果结构不符: {e}")
+                results.append(None)
+                continue
+            is_emoji, valid_result = _validate_analysis(analysis)
+            logger.info(f"🎨 [Perception] LLM判断结果 #{i+1}: {'是表情包' if is_emoji else '不是表情包'}")
             if is_emoji:
-                logger.info(f"🎨 [Perception] LLM分析结果 (已验证): {valid_result}")
-            
-            return is_emoji, valid_result
-            
-        except json.JSONDecodeError as e:
-            logger.error(f"❌ [Perception] JSON解析失败: {e}, 处理后的内容: {json_content[:100]}...")
-            # 失败时返回默认值
-            return False, {
-                "emotions": ["未知"],
-                "description": "",
-                "category": "其他"
-            }
+                logger.info(f"🎨 [Perception] LLM分析结果 #{i+1} (已验证): {valid_result}")
+            results.append((is_emoji, valid_result))
+        
+        return results
             
     except Exception as e:
         logger.error(f"❌ [Perception] LLM判断和分析图片失败: {e}")
-        # 失败时返回默认值
-        return False, {
-            "emotions": ["未知"],
-            "description": "",
-            "category": "其他"
-        }
+        return [None] * len(batch)
+
+
+async def _process_images_with_llm(batch: list[str], phashes: Optional[list[Optional[int]]] = None) -> list[tuple[bool, dict]]:
+    """
+    批量完成图片的表情包判断和分析，感知哈希相近的图片直接复用已有分析结果
+    
+    Args:
+        batch: 图片的base64编码数据列表
+        phashes: 与batch对应的感知哈希列表（可选），None表示不使用感知哈希缓存
+        
+    Returns:
+        list[tuple[bool, dict]]: 与输入顺序一致的 (是否为表情包, 分析结果) 列表
+        分析结果包含: emotions (情绪标签), description (描述), category (分类)
+    """
+    if not batch:
+        return []
+    
+    results: list[Optional[tuple[bool, dict]]] = [None] * len(batch)
+    if phashes:
+        for i, phash in enumerate(phashes):
+            if phash is not None:
+                results[i] = _phash_cache_lookup(phash)
+    
+    pending = [i for i, result in enumerate(results) if result is None]
+    if len(pending) < len(batch):
+        logger.info(f"⚡ [Perception] 感知哈希缓存命中 {len(batch) - len(pending)}/{len(batch)} 张图片")
+    
+    if pending:
+        llm_results = await _query_images_with_llm([batch[i] for i in pending])
+        for i, result in zip(pending, llm_results):
+            results[i] = result
+            if result is not None and phashes and phashes[i] is not None:
+                _phash_cache_store(phashes[i], result)
+    
+    # 失败时返回默认值
+    return [result if result is not None else (False, _default_analysis()) for result in results]
+
+
+async def _process_image_with_llm(base64_data: str, phash: Optional[int] = None) -> tuple[bool, dict]:
+    """
+    使用大模型同时完成图片是否为表情包的判断和分析（单张图片的批量接口包装）
+    
+    Args:
+        base64_data: 图片的base64编码数据
+        phash: 图片的感知哈希（可选），用于复用相近图片的分析结果
+        
+    Returns:
+        tuple[bool, dict]: (是否为表情包, 分析结果)
+        分析结果包含: emotions (情绪标签), description (描述), category (分类)
+    """
+    results = await _process_images_with_llm([base64_data], [phash])
+    return results[0]
 
 
 # 保留原有函数作为兼容层
@@ -223,116 +409,182 @@ def _find_image_urls(state: AgentState) -> list:
     if image_urls:
         return image_urls
     
-    # 历史回溯
+    # 历史回溯：找到最近一条带图片的用户消息
     msgs = state.get("messages", [])
-    for m in reversed(msgs):
-        if isinstance(m, HumanMessage):
-            hist_urls = m.additional_kwargs.get("image_urls", [])
-            if hist_urls:
-                return hist_urls
-    
-    return []
+    return next(
+        (urls for m in reversed(msgs) if isinstance(m, HumanMessage)
+         for urls in [m.additional_kwargs.get("image_urls")] if urls),
+        []
+    )
 
 
 
-async def _classify_image(image: Image.Image, file_size_kb: float) -> str:
+def _classify_with_local_rule(image: Image.Image, file_size_kb: float) -> str:
     """
-    对图片进行分类：sticker、icon 或 photo
+    本地备份分类规则，在大模型不可用时使用
+    """
+    width, height = image.size
+    ratio = width / height if height > 0 else 0
+    try:
+        has_transparency = image.mode in ('RGBA', 'LA') or ('transparency' in image.info)
+        is_square_ish = 0.5 < ratio < 1.6
+        is_small_to_medium = 100 <= width <= 1024 and 100 <= height <= 1024
+        is_small_file = file_size_kb < 1024  # 小于1MB
+        has_sticker_characteristics = (is_square_ish and (has_transparency or is_small_file or is_small_to_medium))
+        
+        if has_sticker_characteristics:
+            logger.info(f"👁️ -> Backup Rule Classified as STICKER ({width}x{height}, {file_size_kb:.1f}KB, ratio: {ratio:.2f})")
+            return "sticker"
+        else:
+            logger.info(f"👁️ -> Backup Rule Classified as PHOTO ({width}x{height}, {file_size_kb:.1f}KB, ratio: {ratio:.2f})")
+            return "photo"
+    except Exception as backup_e:
+        logger.error(f"❌ 本地备份规则也失败: {backup_e}")
+        return "photo"
+
+
+def _classify_with_confident_rule(image: Image.Image, file_size_kb: float) -> Optional[str]:
+    """
+    高置信度的本地分类规则，明显的照片或表情包无需调用大模型
     
-    使用大模型API进行判断，提高分类准确率
+    Returns:
+        str: 分类结果，无法确定时返回None（交给大模型判断）
     """
     width, height = image.size
     ratio = width / height if height > 0 else 0
+    has_transparency = image.mode in ('RGBA', 'LA') or ('transparency' in image.info)
     
-    # 小图标判断 - 仍然使用本地规则，因为小图标明显不是表情包
-    if width < 50 or height < 50:
-        logger.info(f"👁️ -> Classified as ICON ({width}x{height}, {file_size_kb:.1f}KB)")
-        return "icon"
+    # 大尺寸或大文件且没有透明通道，基本是照片
+    if (width > 1200 or height > 1200 or file_size_kb > 800) and not has_transparency:
+        logger.info(f"👁️ -> Rule Classified as PHOTO ({width}x{height}, {file_size_kb:.1f}KB, ratio: {ratio:.2f})")
+        return "photo"
     
-    # 将图片转换为base64，用于大模型判断
-    try:
-        import io
-        import base64
+    # 带透明通道的小尺寸方图，基本是表情包
+    if has_transparency and 0.5 < ratio < 1.6 and file_size_kb < 300 and width <= 512:
+        logger.info(f"👁️ -> Rule Classified as STICKER ({width}x{height}, {file_size_kb:.1f}KB, ratio: {ratio:.2f})")
+        return "sticker"
+    
+    return None
+
+
+def _encode_image_for_llm(image: Image.Image, img_bytes: Optional[bytes] = None) -> str:
+    """
+    将图片编码为base64，用于大模型判断
+    
+    优先直接编码下载得到的原始字节，避免重新编码图片
+    """
+    if img_bytes is not None:
+        if len(img_bytes) <= _LLM_IMAGE_MAX_BYTES:
+            return base64.b64encode(img_bytes).decode('ascii')
+        # 原始数据超出大模型的图片大小限制，重新压缩为JPEG
+        return _compress_image(image)
+    
+    # 保存图片到字节流
+    buffer = io.BytesIO()
+    image_format = image.format or "JPEG"
+    if image.mode in ('RGBA', 'LA'):
+        # 对于有透明通道的图片，使用PNG格式
+        image_format = "PNG"
+    image.save(buffer, format=image_format)
+    buffer.seek(0)
+    
+    # 转换为base64
+    return base64.b64encode(buffer.read()).decode('utf-8')
+
+
+async def _classify_images(images: list[tuple[Image.Image, float, Optional[bytes]]]) -> list[str]:
+    """
+    批量对图片进行分类：sticker、icon 或 photo
+    
+    小图标和特征明显的图片使用本地规则判断，其余图片合并为一次大模型调用
+    
+    Args:
+        images: (PIL Image对象, 文件大小KB, 原始图片字节或None) 列表
         
-        # 保存图片到字节流
-        buffer = io.BytesIO()
-        image_format = image.format or "JPEG"
-        if image.mode in ('RGBA', 'LA'):
-            # 对于有透明通道的图片，使用PNG格式
-            image_format = "PNG"
-        image.save(buffer, format=image_format)
-        buffer.seek(0)
+    Returns:
+        list[str]: 与输入顺序一致的分类结果
+    """
+    results: list[Optional[str]] = [None] * len(images)
+    pending: list[int] = []
+    batch: list[str] = []
+    phashes: list[Optional[int]] = []
+    
+    for i, (image, file_size_kb, img_bytes) in enumerate(images):
+        width, height = image.size
         
-        # 转换为base64
-        base64_data = base64.b64encode(buffer.read()).decode('utf-8')
+        # 小图标判断 - 仍然使用本地规则，因为小图标明显不是表情包
+        if width < 50 or height < 50:
+            logger.info(f"👁️ -> Classified as ICON ({width}x{height}, {file_size_kb:.1f}KB)")
+            results[i] = "icon"
+            continue
         
-        # 使用大模型同时进行判断和分析
-        is_emoji, _ = await _process_image_with_llm(base64_data)
+        # 高置信度的情况直接使用本地规则，只有不确定的图片才调用大模型
+        confident_type = _classify_with_confident_rule(image, file_size_kb)
+        if confident_type:
+            results[i] = confident_type
+            continue
         
-        if is_emoji:
-            logger.info(f"👁️ -> LLM Classified as STICKER ({width}x{height}, {file_size_kb:.1f}KB, ratio: {ratio:.2f})")
-            return "sticker"
-        else:
-            logger.info(f"👁️ -> LLM Classified as PHOTO ({width}x{height}, {file_size_kb:.1f}KB, ratio: {ratio:.2f})")
-            return "photo"
-            
-    except Exception as e:
-        logger.error(f"❌ 大模型分类失败，使用本地备份规则: {e}")
-        # 出错时使用本地备份逻辑
         try:
-            has_transparency = image.mode in ('RGBA', 'LA') or ('transparency' in image.info)
-            is_square_ish = 0.5 < ratio < 1.6
-            is_small_to_medium = 100 <= width <= 1024 and 100 <= height <= 1024
-            is_small_file = file_size_kb < 1024  # 小于1MB
-            has_sticker_characteristics = (is_square_ish and (has_transparency or is_small_file or is_small_to_medium))
-            
-            if has_sticker_characteristics:
-                logger.info(f"👁️ -> Backup Rule Classified as STICKER ({width}x{height}, {file_size_kb:.1f}KB, ratio: {ratio:.2f})")
-                return "sticker"
-            else:
-                logger.info(f"👁️ -> Backup Rule Classified as PHOTO ({width}x{height}, {file_size_kb:.1f}KB, ratio: {ratio:.2f})")
-                return "photo"
-        except Exception as backup_e:
-            logger.error(f"❌ 本地备份规则也失败: {backup_e}")
-            return "photo"
+            batch.append(_encode_image_for_llm(image, img_bytes))
+            phashes.append(_compute_phash(image))
+            pending.append(i)
+        except Exception as e:
+            logger.error(f"❌ 图片编码失败，使用本地备份规则: {e}")
+            results[i] = _classify_with_local_rule(image, file_size_kb)
+    
+    if batch:
+        try:
+            # 使用大模型同时进行判断和分析（一次调用处理全部待定图片）
+            llm_results = await _process_images_with_llm(batch, phashes)
+            for i, (is_emoji, _) in zip(pending, llm_results):
+                image, file_size_kb, _ = images[i]
+                width, height = image.size
+                ratio = width / height if height > 0 else 0
+                if is_emoji:
+                    logger.info(f"👁️ -> LLM Classified as STICKER ({width}x{height}, {file_size_kb:.1f}KB, ratio: {ratio:.2f})")
+                    results[i] = "sticker"
+                else:
+                    logger.info(f"👁️ -> LLM Classified as PHOTO ({width}x{height}, {file_size_kb:.1f}KB, ratio: {ratio:.2f})")
+                    results[i] = "photo"
+        except Exception as e:
+            logger.error(f"❌ 大模型分类失败，使用本地备份规则: {e}")
+            # 出错时使用本地备份逻辑
+            for i in pending:
+                image, file_size_kb, _ = images[i]
+                results[i] = _classify_with_local_rule(image, file_size_kb)
+    
+    return [r or "photo" for r in results]
+
 
+async def _classify_image(image: Image.Image, file_size_kb: float, img_bytes: Optional[bytes] = None) -> str:
+    """
+    对图片进行分类：sticker、icon 或 photo
+    
+    使用大模型API进行判断，提高分类准确率；传入原始图片字节时直接编码，无需重新编码图片
+    """
+    results = await _classify_images([(image, file_size_kb, img_bytes)])
+    return results[0]
 
 
-async def _download_and_process_image(target_url: str) -> tuple:
+
+async def _download_image(target_url: str) -> tuple[str, Optional[bytes]]:
     """
-    下载并处理图片
+    下载图片原始数据
+    
+    Returns:
+        tuple: (状态, 图片字节数据)，状态为 ok / failed / timeout / error
     """
     logger.info(f"👁️ [Perception] Downloading: {target_url[:50]}...")
     
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(target_url, timeout=(3.0, 10.0))
-            
-            if resp.status_code == 200:
-                try:
-                    img_bytes = resp.content
-                    image = Image.open(io.BytesIO(img_bytes))
-                    width, height = image.size
-                    file_size_kb = len(img_bytes) / 1024
-                    
-                    visual_type = await _classify_image(image, file_size_kb)
-                    
-                    # 只对照片进行压缩
-                    final_image_data = _compress_image(image) if visual_type == "photo" else None
-                    
-                    # 更新缓存
-                    _IMG_CACHE[target_url] = (visual_type, width, height, file_size_kb)
-                    
-                    return visual_type, final_image_data
-                    
-                except Exception as img_err:
-                    logger.warning(f"⚠️ [Perception] Image processing error: {img_err}")
-                    _IMG_CACHE[target_url] = ("failed", 0, 0, 0)
-                    return "error", None
-            else:
-                logger.warning(f"⚠️ [Perception] Download Failed: HTTP {resp.status_code}.")
-                _IMG_CACHE[target_url] = ("failed", 0, 0, 0)
-                return "failed", None
+        resp = await _HTTP_CLIENT.get(target_url)
+        
+        if resp.status_code == 200:
+            return "ok", resp.content
+        else:
+            logger.warning(f"⚠️ [Perception] Download Failed: HTTP {resp.status_code}.")
+            _IMG_CACHE[target_url] = ("failed", 0, 0, 0)
+            return "failed", None
                 
     except httpx.TimeoutException:
         logger.warning("⚠️ [Perception] Download TIMEOUT. Skipping.")
@@ -344,6 +596,78 @@ async def _download_and_process_image(target_url: str) -> tuple:
 
 
 
+async def _download_and_process_images(target_urls: list[str]) -> list[tuple[str, Optional[str]]]:
+    """
+    并发下载多张图片，并通过一次大模型调用完成分类
+    
+    Returns:
+        list[tuple]: 与输入顺序一致的 (visual_type, final_image_data) 列表
+    """
+    downloads = await asyncio.gather(*(_download_image(url) for url in target_urls))
+    
+    results: list[tuple[str, Optional[str]]] = [("error", None)] * len(target_urls)
+    decoded: list[tuple[int, Image.Image, bytes]] = []
+    
+    for i, (target_url, (status, img_bytes)) in enumerate(zip(target_urls, downloads)):
+        if status != "ok":
+            results[i] = (status, None)
+            continue
+        try:
+            image = Image.open(io.BytesIO(img_bytes))
+            decoded.append((i, image, img_bytes))
+        except Exception as img_err:
+            logger.warning(f"⚠️ [Perception] Image processing error: {img_err}")
+            _IMG_CACHE[target_url] = ("failed", 0, 0, 0)
+    
+    visual_types = await _classify_images([(image, len(img_bytes) / 1024, img_bytes) for _, image, img_bytes in decoded])
+    
+    for (i, image, img_bytes), visual_type in zip(decoded, visual_types):
+        target_url = target_urls[i]
+        file_size_kb = len(img_bytes) / 1024
+        try:
+            width, height = image.size
+            
+            # 只对照片进行压缩
+            final_image_data = _compress_image(image) if visual_type == "photo" else None
+            
+            # 更新缓存
+            _IMG_CACHE[target_url] = (visual_type, width, height, file_size_kb)
+            
+            results[i] = (visual_type, final_image_data)
+        except Exception as img_err:
+            logger.warning(f"⚠️ [Perception] Image processing error: {img_err}")
+            _IMG_CACHE[target_url] = ("failed", 0, 0, 0)
+    
+    return results
+
+
+
+async def _download_and_process_image(target_url: str) -> tuple:
+    """
+    下载并处理图片
+    """
+    results = await _download_and_process_images([target_url])
+    return results[0]
+
+
+
+async def _load_cached_photo(target_url: str) -> tuple[str, Optional[str]]:
+    """
+    重新下载已缓存分类结果的照片并压缩（分类结果直接复用缓存，不再调用大模型）
+    """
+    status, img_bytes = await _download_image(target_url)
+    if status != "ok":
+        return status, None
+    try:
+        image = Image.open(io.BytesIO(img_bytes))
+        return "photo", _compress_image(image)
+    except Exception as img_err:
+        logger.warning(f"⚠️ [Perception] Image processing error: {img_err}")
+        _IMG_CACHE[target_url] = ("failed", 0, 0, 0)
+        return "error", None
+
+
+
 async def perception_node(state: AgentState) -> dict:
     """
     感知节点：增加缓存与超时优化，支持智能处理多张图片
@@ -351,94 +675,77 @@ async def perception_node(state: AgentState) -> dict:
     # 查找图片URLs
     image_urls = _find_image_urls(state)
     if not image_urls:
-        return {"visual_type": "none", "current_image_artifact": None}
+        return {"visual_type": "none", "current_image_artifact": None, "current_image_data_url": None}
     
     # 过滤非法URL
-    valid_image_urls = [url for url in image_urls if url.startswith("http")]
+    valid_image_urls = [url for url in image_urls if url.startswith(_URL_PREFIXES)]
     if not valid_image_urls:
-        return {"visual_type": "none", "current_image_artifact": None}
+        return {"visual_type": "none", "current_image_artifact": None, "current_image_data_url": None}
+    
+    # 一次性完成所有图片的下载与分类：
+    # 未缓存的图片并发下载，并合并为一次大模型调用完成分类；
+    # 已缓存的照片只需重新下载压缩，无需再次分类
+    unique_urls = list(dict.fromkeys(valid_image_urls))
+    uncached_urls = [url for url in unique_urls if url not in _IMG_CACHE]
+    # 最终最多处理5张照片，因此只需加载前5张已缓存的照片
+    cached_photo_urls = [url for url in unique_urls if url in _IMG_CACHE and _IMG_CACHE[url][0] == "photo"][:5]
+    
+    uncached_results, cached_photo_results = await asyncio.gather(
+        _download_and_process_images(uncached_urls),
+        asyncio.gather(*(_load_cached_photo(url) for url in cached_photo_urls))
+    )
+    results = dict(zip(uncached_urls, uncached_results))
+    results.update(zip(cached_photo_urls, cached_photo_results))
     
     # 智能选择需要处理的图片
-    processed_images = []
     photos = []
     stickers = []
-    
-    # 首先对所有图片进行初步分类（使用缓存或快速分类）
-    for url in valid_image_urls:
-        if url in _IMG_CACHE:
-            cached_type, w, h, size = _IMG_CACHE[url]
-            if cached_type == "photo":
-                photos.append((url, cached_type))
-            elif cached_type == "sticker":
-                stickers.append((url, cached_type))
+    for i, url in enumerate(unique_urls):
+        if url in results:
+            visual_type, final_image_data = results[url]
         else:
-            # 对于未缓存的图片，先快速下载并分类
-            visual_type, _ = await _download_and_process_image(url)
-            if visual_type == "photo":
-                photos.append((url, visual_type))
-            elif visual_type == "sticker":
-                stickers.append((url, visual_type))
+            cached_type, w, h, size = _IMG_CACHE[url]
+            logger.info(f"⚡ [Perception] Cache Hit: {cached_type} ({w}x{h}) - Image {i+1}/{len(unique_urls)}")
+            visual_type, final_image_data = cached_type, None
+        if visual_type == "photo":
+            photos.append((url, final_image_data))
+        elif visual_type == "sticker":
+            stickers.append((url, final_image_data))
     
     # 决定处理哪些图片
     # 1. 优先处理所有照片类型的图片（通常包含重要信息）
     # 2. 对于表情包，最多处理2张代表性的
     # 3. 总处理图片数不超过5张，避免性能问题
-    target_images = []
+    target_images = ([(url, "photo", data) for url, data in photos]
+                     + [(url, "sticker", data) for url, data in stickers[:2]])[:5]
     
-    # 添加所有照片
-    for photo_url, _ in photos:
-        target_images.append(photo_url)
-    
-    # 添加最多2张表情包
-    for sticker_url, _ in stickers[:2]:
-        target_images.append(sticker_url)
-    
-    # 限制总数量
-    target_images = target_images[:5]
-    
-    # 处理选中的图片
-    processed_image_data: list[dict[str, Any]] = []
+    # 直接使用已经得到的处理结果，无需再次下载和分类
+    processed_images = []
     main_visual_type = "none"
     main_image_artifact = None
+    main_image_data_url = None
     all_image_artifacts = []
     
-    for i, target_url in enumerate(target_images):
-        # 缓存检查
-        if target_url in _IMG_CACHE:
-            cached_type, w, h, size = _IMG_CACHE[target_url]
-            logger.info(f"⚡ [Perception] Cache Hit: {cached_type} ({w}x{h}) - Image {i+1}/{len(target_images)}")
-            if cached_type == "photo":
-                # 下载并处理照片，获取完整的image_artifact
-                _, final_image_data = await _download_and_process_image(target_url)
-                all_image_artifacts.append({
-                    "type": cached_type,
-                    "data": final_image_data
-                })
-                if not main_image_artifact:
-                    main_image_artifact = final_image_data
-                    main_visual_type = cached_type
-            elif cached_type == "sticker":
-                if not main_visual_type:
-                    main_visual_type = cached_type
-        else:
-            # 下载并处理图片
-            visual_type, final_image_data = await _download_and_process_image(target_url)
-            
-            if visual_type == "photo":
-                all_image_artifacts.append({
-                    "type": visual_type,
-                    "data": final_image_data
-                })
-                if not main_image_artifact:
-                    main_image_artifact = final_image_data
-                    main_visual_type = visual_type
-            elif visual_type == "sticker" and not main_visual_type:
+    for target_url, visual_type, final_image_data in target_images:
+        if visual_type == "photo":
+            # 预先拼好多模态输入所需的 data URL，下游直接引用，避免重复拼接大字符串
+            data_url = f"data:image/jpeg;base64,{final_image_data}" if final_image_data else None
+            all_image_artifacts.append({
+                "type": visual_type,
+                "data": final_image_data,
+                "data_url": data_url
+            })
+            if not main_image_artifact:
+                main_image_artifact = final_image_data
+                main_image_data_url = data_url
                 main_visual_type = visual_type
+        elif visual_type == "sticker" and not main_visual_type:
+            main_visual_type = visual_type
         
         # 记录处理的图片
         processed_images.append({
             "url": target_url,
-            "type": visual_type if 'visual_type' in locals() else _IMG_CACHE.get(target_url, ("unknown",))[0]
+            "type": visual_type
         })
     
     # 记录处理信息
@@ -448,6 +755,7 @@ async def perception_node(state: AgentState) -> dict:
     updates = {
         "visual_type": main_visual_type,
         "current_image_artifact": main_image_artifact,
+        "current_image_data_url": main_image_data_url,
         "all_image_artifacts": all_image_artifacts,  # 包含所有处理过的图片数据
         "processed_images": processed_images  # 记录所有处理过的图片信息
     }
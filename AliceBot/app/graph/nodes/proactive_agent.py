@@ -1,43 +1,70 @@
+import asyncio
 import json
 import time
 import logging
 import random
+import re
+import string
+from collections import OrderedDict
+from functools import lru_cache
+from itertools import islice
 from datetime import datetime
-from typing import List, Any, Dict
+from typing import List, Any, Dict, NamedTuple, Optional, Tuple
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
 from app.core.state import AgentState
 from app.core.config import config
 from app.core.global_store import global_store
-from app.memory.relation_db import relation_db
-from app.core.prompts import ALICE_CORE_PERSONA, SOCIAL_VOLITION_PROMPT
-from app.utils.cache import cached_llm_invoke
+from app.memory.relation_db import relation_db, UserProfile
+from app.core.prompts import ALICE_CORE_PERSONA, SOCIAL_VOLITION_STATIC_PROMPT, SOCIAL_VOLITION_CONTEXT_PROMPT, retrieve_contextual_persona
+from app.utils.cache import cached_llm_invoke, cached_context_get, cached_context_set
 from app.memory.vector_store import vector_db as vector_store
 
 # 配置日志
 logger = logging.getLogger("ProactiveAgent")
 
-# 主动交互配置
-PROACTIVE_CONFIG = {
+# 模块内共享的随机数生成器
+_RNG = random.Random()
+
+# 主动交互配置（只读，字段访问比字典查找更快）
+class ProactiveConfig(NamedTuple):
     # 活跃时间窗口（小时）
-    "active_time_windows": [
+    active_time_windows: Tuple[Tuple[int, int], ...] = (
         (9, 12),    # 上午
         (14, 17),   # 下午
         (19, 22)    # 晚上
-    ],
+    )
     # 最小沉默时长（小时）
-    "min_silence_hours": 1,
+    min_silence_hours: float = 1
     # 最大沉默时长（小时）
-    "max_silence_hours": 24,
+    max_silence_hours: float = 24
     # 基础触发概率
-    "base_chance": 0.3,
+    base_chance: float = 0.3
     # 用户反馈影响因子
-    "feedback_factor": 0.2,
+    feedback_factor: float = 0.2
+    # 反馈分数的指数滑动平均系数（新反馈的权重）
+    feedback_ewma_alpha: float = 0.3
+    # 反馈记录的最大用户数和过期时间（秒）
+    feedback_max_users: int = 10000
+    feedback_ttl: float = 86400 * 7
     # 个性化话题权重
-    "topic_relevance_weight": 0.7,
+    topic_relevance_weight: float = 0.7
     # 人设一致性过滤阈值
-    "persona_consistency_threshold": 0.8
-}
+    persona_consistency_threshold: float = 0.8
+
+PROACTIVE_CONFIG = ProactiveConfig()
+
+# 按亲密度（0-100）预先计算的基础触发概率，已包含关系阶段调整：
+# 低亲密度（<30）降低触发概率，高亲密度（>70）适当提高触发概率
+_STAGE_BASE_PROBABILITY = tuple(
+    PROACTIVE_CONFIG.base_chance * (0.7 if intimacy < 30 else 1.2 if intimacy > 70 else 1.0)
+    for intimacy in range(101)
+)
+
+# 活跃小时位图：第i位为1表示i点处于活跃时间窗口内，模块加载时根据配置计算一次
+ACTIVE_HOURS_MASK = 0
+for _start, _end in PROACTIVE_CONFIG.active_time_windows:
+    ACTIVE_HOURS_MASK |= ((1 << _end) - 1) ^ ((1 << _start) - 1)
 
 # 建议使用逻辑能力较强的模型
 llm = ChatOpenAI(
@@ -47,23 +74,93 @@ llm = ChatOpenAI(
     base_url=config.MODEL_URL
 )
 
+# 主动交互决策的静态前缀（人设 + 行为规则 + 输出格式），所有调用共享，便于服务端前缀缓存
+_SOCIAL_VOLITION_STATIC_MESSAGE = SystemMessage(
+    content=SOCIAL_VOLITION_STATIC_PROMPT.format(alice_core_persona=ALICE_CORE_PERSONA)
+)
+
+# 预先解析动态情境模板的字面量片段和占位符，每次调用只需按顺序填值，无需重新解析模板
+_CONTEXT_PROMPT_PARTS = tuple(
+    (literal, field, spec)
+    for literal, field, spec, _ in string.Formatter().parse(SOCIAL_VOLITION_CONTEXT_PROMPT)
+)
+
+def _render_context_prompt(values: Dict[str, Any]) -> str:
+    """按预解析的片段填充动态情境模板，结果与SOCIAL_VOLITION_CONTEXT_PROMPT.format(**values)一致"""
+    return "".join([
+        literal + (format(values[field], spec) if field is not None else "")
+        for literal, field, spec in _CONTEXT_PROMPT_PARTS
+    ])
+
+# LLM响应首尾的Markdown代码块标记
+_JSON_FENCE_RE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$")
+
+# 相同情境下的重复触发在该时间内直接复用已生成的内容（秒）
+PROACTIVE_DECISION_TTL = 30
+
+# 个性化话题列表的缓存时间（秒），话题来源变化缓慢，无需每次都重新检索
+PROACTIVE_TOPICS_TTL = 600
+
+# 人设扩展部分（扩展人设、场景表现、情绪风格）的缓存，按用户和相近情境复用
+# (user_id, chat_type, 亲密度分段, 情绪, 话题) -> (扩展内容, 生成时间)
+_PERSONA_SUFFIX_CACHE: "OrderedDict[tuple, tuple]" = OrderedDict()
+_PERSONA_SUFFIX_CACHE_MAX_SIZE = 1024
+PERSONA_SUFFIX_TTL = 300
+
+def _invalidate_persona_suffix(user_id: str):
+    """用户关系或反馈变化后，丢弃该用户缓存的人设扩展内容"""
+    for key in [key for key in _PERSONA_SUFFIX_CACHE if key[0] == user_id]:
+        del _PERSONA_SUFFIX_CACHE[key]
+
+# 可作为主动话题来源的记忆分类
+_TOPIC_MEMORY_CATEGORIES = frozenset(("兴趣爱好", "共同经历", "日常话题"))
+
+@lru_cache(maxsize=8192)
+def _parse_memory_point(memory_point: str) -> Optional[tuple]:
+    """解析"category:content:weight"格式的记忆点，返回(分类, 内容, 权重)，格式不正确时返回None"""
+    parts = memory_point.split(":")
+    if len(parts) < 3:
+        return None
+    try:
+        weight = float(parts[-1])
+    except ValueError:
+        return None
+    return parts[0], ":".join(parts[1:-1]).strip(), weight
+
+# 话题不足时使用的默认话题
+_DEFAULT_TOPICS = (
+    "最近有没有读到什么有意思的书？",
+    "附近新开了家咖啡馆，环境挺安静的...",
+    "旧书店打折，你有想去看看吗？",
+    "今天天气不错，适合出门散步呢",
+    "最近总是睡不够，你也这样吗？",
+    "听说有部老电影重映了，好像还不错",
+    "昨天在咖啡馆看到一只很可爱的猫",
+    "最近在听一些老歌，突然觉得以前的歌更有味道",
+    "你平时喜欢去哪些安静的地方？",
+    "今天尝试做了手冲咖啡，虽然味道一般..."
+)
+
 class ProactiveInteractionManager:
     def __init__(self):
         self.logger = logger
-        self.feedback_store = {}
-        
-    def is_in_active_time_window(self) -> bool:
-        """检查当前时间是否在活跃窗口内"""
-        current_hour = datetime.now().hour
-        for start, end in PROACTIVE_CONFIG["active_time_windows"]:
-            if start <= current_hour < end:
-                return True
-        return False
+        # user_id -> (反馈分数, 过期时间)，按最近更新排序，超出容量或过期时淘汰
+        self.feedback_store: "OrderedDict[str, tuple]" = OrderedDict()
+        
+    def is_in_active_time_window(self, current_hour: Optional[int] = None) -> bool:
+        """检查当前时间是否在活跃窗口内（可传入已获取的当前小时）"""
+        if current_hour is None:
+            current_hour = datetime.now().hour
+        return bool((ACTIVE_HOURS_MASK >> current_hour) & 1)
     
-    def should_initiate_interaction(self, user_id: str, last_interaction_time: float, user_feedback_score: float, intimacy: int, familiarity: int, trust: int, interest_match: int, stamina: float, interaction_patterns: Dict[str, Any]) -> bool:
-        """判断是否应该发起主动交互"""
+    def should_initiate_interaction(self, user_id: str, last_interaction_time: float, user_feedback_score: float, intimacy: int, familiarity: int, trust: int, interest_match: int, stamina: float, interaction_patterns: Dict[str, Any], now: Optional[float] = None) -> bool:
+        """判断是否应该发起主动交互（now为本次判断使用的时间戳，默认取当前时间）"""
+        if now is None:
+            now = time.time()
+        current_hour = datetime.fromtimestamp(now).hour
+        
         # 1. 检查当前时间是否在活跃窗口内
-        if not self.is_in_active_time_window():
+        if not self.is_in_active_time_window(current_hour):
             self.logger.debug("不在活跃时间窗口内，跳过主动交互")
             return False
         
@@ -73,16 +170,15 @@ class ProactiveInteractionManager:
             return False
         
         # 3. 计算沉默时长
-        silence_hours = (time.time() - last_interaction_time) / 3600
+        silence_hours = (now - last_interaction_time) / 3600
         
         # 4. 检查沉默时长是否在合理范围内
-        if silence_hours < PROACTIVE_CONFIG["min_silence_hours"] or silence_hours > PROACTIVE_CONFIG["max_silence_hours"]:
+        if silence_hours < PROACTIVE_CONFIG.min_silence_hours or silence_hours > PROACTIVE_CONFIG.max_silence_hours:
             self.logger.debug(f"沉默时长 ({silence_hours:.1f}小时) 不在合理范围，跳过主动交互")
             return False
         
         # 5. 获取用户交互模式偏好
         preferred_response_time = interaction_patterns.get("preferred_response_time", None)
-        current_hour = datetime.now().hour
         
         # 检查是否在用户偏好的回复时间段内
         if preferred_response_time:
@@ -92,95 +188,90 @@ class ProactiveInteractionManager:
                 return False
         
         # 6. 计算触发概率
-        base_probability = PROACTIVE_CONFIG["base_chance"]
-        
         # 基于关系亲密度的调整
         intimacy_factor = 0.5 + (intimacy / 100)  # 0.5-1.5
         
-        # 基于熟悉度的调整
-        familiarity_factor = 0.8 + (familiarity / 500)  # 0.8-1.0
-        
-        # 基于信任度的调整
-        trust_factor = 0.8 + (trust / 500)  # 0.8-1.0
-        
         # 基于兴趣匹配度的调整
         interest_factor = 0.5 + (interest_match / 100)  # 0.5-1.5
         
         # 基于沉默时长的概率调整（更智能的曲线）
         if silence_hours < 6:
             # 短时间沉默：概率随时间线性增加，但受亲密度影响
-            silence_factor = min(1.5, (silence_hours / PROACTIVE_CONFIG["min_silence_hours"]) * intimacy_factor)
+            silence_factor = min(1.5, (silence_hours / PROACTIVE_CONFIG.min_silence_hours) * intimacy_factor)
         elif silence_hours < 12:
             # 中等时间沉默：保持较高概率
             silence_factor = 1.2 * intimacy_factor
         else:
             # 长时间沉默：概率逐渐降低，但受熟悉度和信任度影响
-            silence_factor = max(0.5, (1 - (silence_hours - 12) / 24) * (familiarity_factor + trust_factor) / 2)
+            # 熟悉度、信任度的调整（各为0.8-1.0）只在该分支用到，取平均后为 0.8 + (familiarity + trust) / 1000
+            familiarity_trust_factor = 0.8 + (familiarity + trust) / 1000
+            silence_factor = max(0.5, (1 - (silence_hours - 12) / 24) * familiarity_trust_factor)
         
         # 用户反馈调整，权重更高
-        feedback_factor = 1 + (user_feedback_score * PROACTIVE_CONFIG["feedback_factor"] * 1.5)
-        
-        # 综合所有因子
-        final_probability = base_probability * silence_factor * feedback_factor * interest_factor
+        feedback_factor = 1 + (user_feedback_score * PROACTIVE_CONFIG.feedback_factor * 1.5)
         
-        # 根据关系阶段调整最终概率
-        if intimacy < 30:
-            # 低亲密度用户：降低触发概率
-            final_probability *= 0.7
-        elif intimacy > 70:
-            # 高亲密度用户：适当提高触发概率
-            final_probability *= 1.2
+        # 综合所有因子，基础概率和关系阶段调整通过按亲密度预先计算的表一次取得
+        final_probability = _STAGE_BASE_PROBABILITY[intimacy] * silence_factor * feedback_factor * interest_factor
         
         # 限制概率范围
         final_probability = max(0.03, min(0.85, final_probability))
         
         # 7. 随机判断是否触发
-        if random.random() < final_probability:
+        if _RNG.random() < final_probability:
             self.logger.debug(f"触发主动交互，概率: {final_probability:.2f}")
             return True
         
         return False
     
-    def _check_topic_relevance(self, topic: str, favorite_topics: List[str], avoid_topics: List[str]) -> bool:
-        """检查话题相关性和是否为避免话题"""
-        # 1. 检查是否为避免话题
-        if avoid_topics:
-            for avoid_topic in avoid_topics:
-                if avoid_topic in topic:
-                    return False
-        
-        # 2. 检查是否与兴趣话题相关
-        if favorite_topics:
-            for fav_topic in favorite_topics:
-                if fav_topic in topic:
-                    return True
-        
-        # 3. 默认返回True（允许使用）
-        return True
+    def _build_topic_scorer(self, favorite_topics: List[str], memory_topics: List[str], avoid_topics: List[str]):
+        """
+        根据本次的兴趣话题、记忆点和避免话题构建打分函数，所有候选话题共用
+        
+        Returns:
+            打分函数：命中避免话题时返回None，否则返回0.5~1.0的相关性分数
+            （每命中一个兴趣话题加0.3，每命中一个记忆点加0.2）
+        """
+        # 避免话题合并为一个预编译正则，每个候选话题只需一次search
+        avoid_patterns = [re.escape(topic) for topic in avoid_topics if topic]
+        avoid_re = re.compile("|".join(avoid_patterns)) if avoid_patterns else None
+        favorite_tuple = tuple(favorite_topics)
+        memory_tuple = tuple(memory_topics)
+        
+        if not favorite_tuple and not memory_tuple:
+            # 没有兴趣话题和记忆点时（如新用户）所有话题都是基础分，无需逐个匹配
+            def score(topic: str) -> Optional[float]:
+                if avoid_re is not None and avoid_re.search(topic):
+                    return None
+                return 0.5
+            return score
+        
+        def score(topic: str) -> Optional[float]:
+            if avoid_re is not None and avoid_re.search(topic):
+                return None
+            favorite_hits = sum(map(topic.__contains__, favorite_tuple))
+            memory_hits = sum(map(topic.__contains__, memory_tuple))
+            return min(1.0, 0.5 + 0.3 * favorite_hits + 0.2 * memory_hits)
+        
+        return score
     
-    def _score_topic_relevance(self, topic: str, favorite_topics: List[str], memory_topics: List[str]) -> float:
-        """为话题打分，评估其相关性"""
-        score = 0.5  # 基础分数
-        
-        # 与兴趣话题匹配度
-        if favorite_topics:
-            for fav_topic in favorite_topics:
-                if fav_topic in topic:
-                    score += 0.3
-        
-        # 与记忆点匹配度
-        if memory_topics:
-            for mem_topic in memory_topics:
-                if mem_topic in topic:
-                    score += 0.2
-        
-        return min(1.0, score)
+    async def get_personalized_topics(self, user_id: str, limit: int = 5, profile: Optional[UserProfile] = None) -> List[str]:
+        """获取个性化话题列表（可传入已获取的用户资料，避免重复查询），结果按用户短期缓存"""
+        cache_key = f"proactive_topics:{user_id}:{limit}"
+        cached_topics = await cached_context_get(cache_key)
+        if cached_topics:
+            return cached_topics
+        
+        topics = await self._build_personalized_topics(user_id, limit, profile)
+        if topics:
+            await cached_context_set(cache_key, topics, ttl=PROACTIVE_TOPICS_TTL)
+        return topics
     
-    async def get_personalized_topics(self, user_id: str, limit: int = 5) -> List[str]:
-        """获取个性化话题列表"""
+    async def _build_personalized_topics(self, user_id: str, limit: int, profile: Optional[UserProfile]) -> List[str]:
+        """从用户兴趣、记忆点、向量记忆和默认话题中挑选个性化话题"""
         try:
             # 获取用户关系数据
-            profile = await relation_db.get_user_profile(user_id)
+            if profile is None:
+                profile = await relation_db.get_user_profile(user_id)
             rel = profile.relationship
             
             # 优先使用用户感兴趣的话题
@@ -191,15 +282,15 @@ class ProactiveInteractionManager:
             memory_points = rel.memory_points
             memory_topics = []
             
-            # 解析记忆点，过滤出兴趣爱好和日常话题相关的内容
+            # 解析记忆点（相同记忆点只解析一次），过滤出兴趣爱好和日常话题相关的内容
             for mp in memory_points:
                 if isinstance(mp, str):
-                    parts = mp.split(":")
-                    if len(parts) >= 3:
-                        category, content, weight = parts[0], ":".join(parts[1:-1]), float(parts[-1])
+                    parsed = _parse_memory_point(mp)
+                    if parsed is not None:
+                        category, content, weight = parsed
                         # 只保留高权重的记忆点
-                        if weight > 0.5 and category in ["兴趣爱好", "共同经历", "日常话题"]:
-                            memory_topics.append((content.strip(), weight))
+                        if weight > 0.5 and category in _TOPIC_MEMORY_CATEGORIES:
+                            memory_topics.append((content, weight))
             
             # 对记忆点按权重排序
             memory_topics.sort(key=lambda x: x[1], reverse=True)
@@ -210,74 +301,35 @@ class ProactiveInteractionManager:
             vector_memories = await vector_store.search(
                 query=vector_query,
                 k=10,
-                categories=["兴趣爱好", "共同经历", "日常话题"]
+                categories=list(_TOPIC_MEMORY_CATEGORIES)
             )
             
-            vector_topics = []
-            if vector_memories:
-                for memory in vector_memories:
-                    if memory.content and len(memory.content) > 5:
-                        vector_topics.append(memory.content)
-            
-            # 合并所有话题源并打分
-            all_topic_candidates = []
-            
-            # 1. 优先添加用户感兴趣的话题
-            for topic in favorite_topics:
-                if topic and self._check_topic_relevance(topic, favorite_topics, avoid_topics):
-                    relevance_score = self._score_topic_relevance(topic, favorite_topics, memory_topic_texts)
-                    all_topic_candidates.append((topic, relevance_score, "favorite"))
+            # search返回的是记忆文本列表
+            vector_topics = [memory for memory in vector_memories if memory and len(memory) > 5] if vector_memories else []
             
-            # 2. 添加记忆点话题
-            for topic in memory_topic_texts:
-                if topic and self._check_topic_relevance(topic, favorite_topics, avoid_topics):
-                    relevance_score = self._score_topic_relevance(topic, favorite_topics, memory_topic_texts)
-                    all_topic_candidates.append((topic, relevance_score, "memory"))
-            
-            # 3. 添加向量存储话题
-            for topic in vector_topics:
-                if topic and self._check_topic_relevance(topic, favorite_topics, avoid_topics):
-                    relevance_score = self._score_topic_relevance(topic, favorite_topics, memory_topic_texts)
-                    all_topic_candidates.append((topic, relevance_score, "vector"))
-            
-            # 4. 如果话题不够，使用默认话题（经过避免话题过滤）
-            default_topics = [
-                "最近有没有读到什么有意思的书？",
-                "附近新开了家咖啡馆，环境挺安静的...",
-                "旧书店打折，你有想去看看吗？",
-                "今天天气不错，适合出门散步呢",
-                "最近总是睡不够，你也这样吗？",
-                "听说有部老电影重映了，好像还不错",
-                "昨天在咖啡馆看到一只很可爱的猫",
-                "最近在听一些老歌，突然觉得以前的歌更有味道",
-                "你平时喜欢去哪些安静的地方？",
-                "今天尝试做了手冲咖啡，虽然味道一般..."
-            ]
-            
-            # 过滤默认话题，避免使用用户不喜欢的话题
-            filtered_defaults = []
-            for topic in default_topics:
-                if self._check_topic_relevance(topic, favorite_topics, avoid_topics):
-                    relevance_score = self._score_topic_relevance(topic, favorite_topics, memory_topic_texts)
-                    filtered_defaults.append((topic, relevance_score, "default"))
-            
-            # 添加默认话题候选
-            all_topic_candidates.extend(filtered_defaults)
-            
-            # 去重
-            seen_topics = set()
+            # 合并所有话题源并打分（过滤避免话题）
+            score_topic = self._build_topic_scorer(favorite_topics, memory_topic_texts, avoid_topics)
             unique_candidates = []
-            for topic, score, source in all_topic_candidates:
-                if topic not in seen_topics:
-                    seen_topics.add(topic)
-                    unique_candidates.append((topic, score, source))
+            seen_topics = set()
+            
+            # 依次为：用户感兴趣的话题、记忆点话题、向量存储话题、默认话题（话题不够时补充）
+            # 同一话题只保留最先出现的来源，重复的话题无需再打分
+            for source, source_topics in (
+                ("favorite", favorite_topics),
+                ("memory", memory_topic_texts),
+                ("vector", vector_topics),
+                ("default", _DEFAULT_TOPICS)
+            ):
+                for topic in source_topics:
+                    if topic and topic not in seen_topics:
+                        seen_topics.add(topic)
+                        relevance_score = score_topic(topic)
+                        if relevance_score is not None:
+                            unique_candidates.append((topic, relevance_score, source))
             
             # 按相关性分数排序
             unique_candidates.sort(key=lambda x: x[1], reverse=True)
             
-            # 选择前limit个话题
-            result_topics = [topic for topic, score, source in unique_candidates[:limit]]
-            
             # 确保多样性：最多允许2个相同来源的话题
             source_count = {}
             diverse_topics = []
@@ -288,10 +340,11 @@ class ProactiveInteractionManager:
                     if len(diverse_topics) >= limit:
                         break
             
-            # 如果多样性话题不足，使用原始排序的话题补充
+            # 如果多样性话题不足，使用排序靠前的话题补充
             if len(diverse_topics) < limit:
-                for topic in result_topics:
-                    if topic not in diverse_topics:
+                chosen_topics = set(diverse_topics)
+                for topic, score, source in unique_candidates[:limit]:
+                    if topic not in chosen_topics:
                         diverse_topics.append(topic)
                         if len(diverse_topics) >= limit:
                             break
@@ -303,105 +356,166 @@ class ProactiveInteractionManager:
     
     def update_user_feedback(self, user_id: str, feedback_type: str):
         """更新用户反馈（positive/negative）"""
-        if user_id not in self.feedback_store:
-            self.feedback_store[user_id] = {"positive": 0, "negative": 0, "last_updated": time.time()}
-        
-        # 更新反馈计数
         if feedback_type == "positive":
-            self.feedback_store[user_id]["positive"] += 1
+            signal = 1.0
         elif feedback_type == "negative":
-            self.feedback_store[user_id]["negative"] += 1
-        
-        self.feedback_store[user_id]["last_updated"] = time.time()
-    
-    def get_user_feedback_score(self, user_id: str) -> float:
-        """获取用户反馈分数（-1到1之间）"""
-        if user_id not in self.feedback_store:
+            signal = -1.0
+        else:
+            return
+        
+        # 以指数滑动平均维护反馈分数，每个用户只需保存一个浮点数
+        # 整个更新过程没有await，在事件循环中是原子的
+        # 分数在写入时计算好，读取时无需再做任何运算
+        now = time.time()
+        alpha = PROACTIVE_CONFIG.feedback_ewma_alpha
+        score = self.get_user_feedback_score(user_id, now)
+        self.feedback_store[user_id] = ((1 - alpha) * score + alpha * signal, now + PROACTIVE_CONFIG.feedback_ttl)
+        self.feedback_store.move_to_end(user_id)
+        _invalidate_persona_suffix(user_id)
+        
+        # 超出容量时淘汰最久未更新的用户
+        while len(self.feedback_store) > PROACTIVE_CONFIG.feedback_max_users:
+            self.feedback_store.popitem(last=False)
+    
+    def get_user_feedback_score(self, user_id: str, now: Optional[float] = None) -> float:
+        """获取用户反馈分数（-1到1之间，可传入已获取的当前时间戳）"""
+        entry = self.feedback_store.get(user_id)
+        if entry is None:
             return 0.0
         
-        feedback = self.feedback_store[user_id]
-        total = feedback["positive"] + feedback["negative"]
-        if total == 0:
+        score, expires_at = entry
+        if (time.time() if now is None else now) > expires_at:
+            # 反馈已过期，视为没有反馈
+            del self.feedback_store[user_id]
             return 0.0
-        
-        # 计算反馈分数（positive - negative）/ total
-        score = (feedback["positive"] - feedback["negative"]) / total
         return score
 
 # 初始化主动交互管理器
 interaction_manager = ProactiveInteractionManager()
 
-def _filter_unnatural_responses(content: str) -> str:
-    """过滤不符合Alice人设的不自然回应"""
-    # Alice的核心性格：云淡风轻、波澜不惊、不刻意、不讨好
-    
-    # 1. 移除过于正式的表达
-    formal_phrases = [
-        "很高兴认识你", "乐意效劳", "根据我的知识", "我认为", "我觉得",
-        "你好", "在吗", "请问", "感谢", "谢谢", "对不起", "抱歉",
-        "请问有什么可以帮助你的", "随时为你服务", "我来帮你",
-        "我明白了", "我理解", "你说得对", "确实如此"
-    ]
-    
-    filtered_content = content
-    for phrase in formal_phrases:
-        if phrase in filtered_content:
-            filtered_content = filtered_content.replace(phrase, "")
-    
-    # 2. 移除过于亲密的表达
-    intimate_phrases = [
-        "亲爱的", "宝贝", "老公", "老婆", "哥哥", "姐姐", "弟弟", "妹妹",
-        "我爱你", "我想你", "思念你", "喜欢你", "抱抱", "亲亲",
-        "想你啦", "爱你", "我的", "专属", "唯一"
-    ]
-    
-    for phrase in intimate_phrases:
-        if phrase in filtered_content:
-            filtered_content = filtered_content.replace(phrase, "")
-    
-    # 3. 移除刻意引导对话的表达
-    guiding_phrases = [
-        "那你呢", "你觉得呢", "有什么想法", "分享给我听听",
-        "有什么感受", "觉得怎么样", "随时来找我聊聊哦",
-        "对吧", "是不是", "对吗", "好不好", "可以吗",
-        "怎么样", "呢",  # 注意：只移除作为疑问词的"呢"，保留作为语气词的"呢"
-    ]
-    
-    for phrase in guiding_phrases:
-        if filtered_content.endswith(phrase):
-            filtered_content = filtered_content[:-len(phrase)]
-        elif f"{phrase}" in filtered_content:
-            filtered_content = filtered_content.replace(f" {phrase}", "")
-    
-    # 4. 移除感叹号和问号（Alice很少用强烈的标点）
-    filtered_content = filtered_content.replace("!", "...")
-    filtered_content = filtered_content.replace("?", "...")
-    
+# 过于正式的表达
+_FORMAL_PHRASES = (
+    "很高兴认识你", "乐意效劳", "根据我的知识", "我认为", "我觉得",
+    "你好", "在吗", "请问", "感谢", "谢谢", "对不起", "抱歉",
+    "请问有什么可以帮助你的", "随时为你服务", "我来帮你",
+    "我明白了", "我理解", "你说得对", "确实如此"
+)
+
+# 过于亲密的表达
+_INTIMATE_PHRASES = (
+    "亲爱的", "宝贝", "老公", "老婆", "哥哥", "姐姐", "弟弟", "妹妹",
+    "我爱你", "我想你", "思念你", "喜欢你", "抱抱", "亲亲",
+    "想你啦", "爱你", "我的", "专属", "唯一"
+)
+
+# 刻意引导对话的表达
+_GUIDING_PHRASES = (
+    "那你呢", "你觉得呢", "有什么想法", "分享给我听听",
+    "有什么感受", "觉得怎么样", "随时来找我聊聊哦",
+    "对吧", "是不是", "对吗", "好不好", "可以吗",
+    "怎么样", "呢",  # 注意：只移除作为疑问词的"呢"，保留作为语气词的"呢"
+)
+
+def _phrase_alternation(phrases) -> str:
+    """构造短语的正则分支，长短语优先匹配，避免只移除其前缀"""
+    return "|".join(map(re.escape, sorted(phrases, key=len, reverse=True)))
+
+# 三类短语和强烈标点合并为一个预编译正则，单次扫描完成：
+# 正式/亲密短语任意位置移除；引导短语只移除句中以空格分隔的部分（句尾的单独处理）；感叹号和问号替换为省略号
+_UNNATURAL_PHRASES_RE = re.compile(
+    _phrase_alternation(_FORMAL_PHRASES + _INTIMATE_PHRASES)
+    + "| (?:" + _phrase_alternation(_GUIDING_PHRASES) + ")"
+    + r"|[!?]"
+)
+
+# 匹配到的标点替换为省略号，其余匹配（不自然的短语）直接移除
+_UNNATURAL_REPLACEMENTS = {"!": "...", "?": "..."}
+
+def _replace_unnatural(match: "re.Match") -> str:
+    return _UNNATURAL_REPLACEMENTS.get(match.group(), "")
+
+# 符合Alice风格的句尾及补充用的语气词
+_VALID_ENDINGS = ("...", "呢", "呀", "哦", "嗯", "")
+_FALLBACK_ENDINGS = ("...", "哦", "")
+
+# 高亲密度下允许的亲昵句尾
+_INTIMATE_ENDINGS = ("~", "哦~", "呢")
+
+# 带有提问或引导意味的句尾
+_QUESTION_ENDINGS = ("...?", "?", "呢", "吗", "吧")
+
+# Alice特有的说话习惯（偶尔的口语化省略）
+# 应用说话习惯的概率
+_MANNERISM_CHANCE = 0.3
+
+# 每项为(原词, 替换词)，None表示不修改
+_ALICE_MANNERISMS = (
+    ("什么", "啥"),
+    ("怎么", "咋"),
+    ("没有", "没"),
+    ("是不是", "是不"),
+    None
+)
+
+def _strip_guiding_suffix(content: str) -> str:
+    """移除句尾刻意引导对话的表达"""
+    for phrase in _GUIDING_PHRASES:
+        if content.endswith(phrase):
+            content = content[:-len(phrase)]
+    return content
+
+def _limit_sentences(content: str) -> str:
+    """只保留简短的句子，补充语气词并限制总长度，内容为空时返回空字符串"""
     # 5. 移除过长的句子（保持简短）
-    sentences = filtered_content.split("。")
-    short_sentences = []
-    for sentence in sentences:
-        sentence = sentence.strip()
-        if sentence and len(sentence) < 25:  # 更严格的长度限制
-            short_sentences.append(sentence)
-    
-    filtered_content = "。".join(short_sentences)
+    # 更严格的长度限制：只保留25字以内的句子，各句已去除首尾空白，拼接后无需再strip
+    content = "。".join(
+        sentence for sentence in map(str.strip, content.split("。"))
+        if sentence and len(sentence) < 25
+    )
     
     # 6. 确保内容符合Alice的说话风格
-    filtered_content = filtered_content.strip()
-    if not filtered_content:
+    if not content:
         return ""
     
     # 7. 添加适当的语气词（符合云淡风轻的风格）
-    valid_endings = ["...", "呢", "呀", "哦", "嗯", ""]
-    if not any(filtered_content.endswith(ending) for ending in valid_endings):
-        filtered_content += random.choice(["...", "哦", ""])
+    # 空字符串结尾恒成立，这里与原逻辑保持一致
+    if not content.endswith(_VALID_ENDINGS):
+        content += _RNG.choice(_FALLBACK_ENDINGS)
     
     # 8. 确保句子简短（最多25字）
-    if len(filtered_content) > 25:
-        filtered_content = filtered_content[:25] + "..."
+    if len(content) > 25:
+        content = content[:25] + "..."
     
-    return filtered_content
+    return content
+
+def _filter_unnatural_responses(content: str) -> str:
+    """过滤不符合Alice人设的不自然回应"""
+    # Alice的核心性格：云淡风轻、波澜不惊、不刻意、不讨好
+    
+    # 1. 移除过于正式的表达
+    # 2. 移除过于亲密的表达
+    # 3. 移除句中刻意引导对话的表达
+    # 4. 将感叹号和问号替换为省略号（Alice很少用强烈的标点）
+    # 以上合并为一个预编译的正则，单次扫描完成
+    filtered_content = _UNNATURAL_PHRASES_RE.sub(_replace_unnatural, content)
+    
+    # 移除句尾刻意引导对话的表达
+    filtered_content = _strip_guiding_suffix(filtered_content)
+    
+    return _limit_sentences(filtered_content)
+
+def _make_replacer(table: Dict[str, str]):
+    """将多组字符串替换合并为一个预编译正则，单次扫描完成全部替换"""
+    pattern = re.compile("|".join(map(re.escape, sorted(table, key=len, reverse=True))))
+    return lambda text: pattern.sub(lambda m: table[m.group()], text)
+
+# 按亲密度调整语气的替换表（与原先依次调用replace的结果一致）
+_HIGH_INTIMACY_REPLACER = _make_replacer({"...": "~", "哦": "哦~"})
+_LOW_INTIMACY_REPLACER = _make_replacer({"~": "...", "呀": "哦", "哈": "", "嘿": ""})
+_VERY_LOW_INTIMACY_REPLACER = _make_replacer({"~": "...", "呀": ""})
+
+# 以句号分隔的句子
+_SENTENCE_RE = re.compile(r"[^。]+")
 
 def _ensure_alice_persona(content: str, intimacy: int) -> str:
     """确保内容符合Alice的人设"""
@@ -412,101 +526,112 @@ def _ensure_alice_persona(content: str, intimacy: int) -> str:
     if not filtered_content:
         return ""
     
-    # 2. 保持句子数量限制（最多两句话）
-    lines = filtered_content.split("。")
-    filtered_lines = []
-    
-    for line in lines:
-        line = line.strip()
-        if line:
-            filtered_lines.append(line)
-    
-    if not filtered_lines:
+    # 2. 保持句子数量限制（最多两句话），取到两句即停止扫描
+    sentences = (m.group().strip() for m in _SENTENCE_RE.finditer(filtered_content))
+    result = "。".join(islice(filter(None, sentences), 2))
+    if not result:
         return ""
     
-    # 最多两句话
-    result = "。".join(filtered_lines[:2])
-    
     # 3. 根据亲密度调整语气（更细腻的调整）
     if intimacy > 85:
         # 极高亲密度：可以稍微随意一点，但仍然保持云淡风轻
-        result = result.replace("...", "~").replace("哦", "哦~")
+        result = _HIGH_INTIMACY_REPLACER(result)
         # 可以添加一些轻微的亲昵语气词
-        if not any(result.endswith(ending) for ending in ["~", "哦~", "呢"]):
+        if not result.endswith(_INTIMATE_ENDINGS):
             result += "~"
     elif intimacy > 70:
         # 高亲密度：保持自然，略微随意
-        result = result.replace("...", "~").replace("哦", "哦~")
-    elif intimacy < 35:
-        # 低亲密度：保持距离感，更冷淡
-        result = result.replace("~", "...").replace("呀", "哦").replace("哦~", "哦")
-        # 移除过于活泼的语气词
-        result = result.replace("哈", "").replace("嘿", "")
+        result = _HIGH_INTIMACY_REPLACER(result)
     elif intimacy < 20:
-        # 极低亲密度：非常冷淡，尽量简短
-        result = result.replace("~", "...").replace("呀", "").replace("哦~", "")
+        # 极低亲密度：非常冷淡，尽量简短（需先于低亲密度判断，否则永远不会命中）
+        result = _VERY_LOW_INTIMACY_REPLACER(result)
         # 只保留最核心的内容
         if len(result) > 15:
             result = result[:15] + "..."
+    elif intimacy < 35:
+        # 低亲密度：保持距离感，更冷淡，并移除过于活泼的语气词
+        result = _LOW_INTIMACY_REPLACER(result)
     
     # 4. 最终过滤，确保符合Alice的核心风格
-    final_content = _filter_unnatural_responses(result)
+    # 短语和强烈标点已在初步过滤中处理，只有低亲密度删除字符后才可能拼出新的短语，需要重新扫描；
+    # 截取句子和调整语气会改变句尾和长度，句尾引导和长度限制始终需要重新检查
+    if intimacy < 35:
+        final_content = _filter_unnatural_responses(result)
+    else:
+        final_content = _limit_sentences(_strip_guiding_suffix(result))
     
     # 5. 确保内容不是刻意的提问或引导
-    if any(final_content.endswith(ending) for ending in ["...?", "?", "呢", "吗", "吧"]):
+    if final_content.endswith(_QUESTION_ENDINGS):
         # 转换为陈述句
         final_content = final_content[:-1] + "..."
     
     # 6. 添加一些Alice特有的说话习惯（偶尔的错别字或省略）
-    alice_mannerisms = [
-        lambda x: x.replace("什么", "啥"),
-        lambda x: x.replace("怎么", "咋"),
-        lambda x: x.replace("没有", "没"),
-        lambda x: x.replace("是不是", "是不"),
-        lambda x: x  # 不修改
-    ]
-    
     # 随机应用一个说话习惯（30%概率）
-    if random.random() < 0.3:
-        final_content = random.choice(alice_mannerisms)(final_content)
+    # 命中时roll在[0, 0.3)内均匀分布，直接缩放为习惯的下标，一次随机数完成两次决策
+    roll = _RNG.random()
+    if roll < _MANNERISM_CHANCE:
+        mannerism = _ALICE_MANNERISMS[int(roll * len(_ALICE_MANNERISMS) / _MANNERISM_CHANCE)]
+        if mannerism is not None:
+            final_content = final_content.replace(*mannerism)
     
     return final_content
 
-async def _generate_proactive_content(user_id: str, topics: List[str], intimacy: int, current_time: str, silence_duration: str, stamina: float, chat_type: str, user_name: str, familiarity: int, trust: int, interest_match: int, communication_style: str) -> str:
-    """生成符合人设的主动交互内容"""
+# 按小时（0-23）预先展开的时间段标签：9-11点为上午，12-17点为下午，其余为晚上
+_TIME_PERIOD_BY_HOUR = ("晚上",) * 9 + ("上午",) * 3 + ("下午",) * 6 + ("晚上",) * 6
+
+def _get_time_period(current_time: str) -> str:
+    """根据"HH:MM"格式的时间返回时间段描述"""
+    return _TIME_PERIOD_BY_HOUR[int(current_time[:2])]
+
+def _get_current_mood(rel) -> str:
+    """根据用户最近的情感趋势推断当前情绪状态"""
+    sentiment_trends = rel.sentiment_trends
+    current_mood = "平静"
+    
+    # 分析最近的情感趋势
+    if sentiment_trends:
+        # 获取最近5条情感记录
+        recent_sentiments = sentiment_trends[-5:]
+        # 计算积极/消极情感的比例
+        positive_count = sum(1 for trend in recent_sentiments if trend.get("sentiment") in ["开心", "愉快", "兴高采烈"])
+        negative_count = sum(1 for trend in recent_sentiments if trend.get("sentiment") in ["低落", "沮丧", "烦躁"])
+        
+        if positive_count > negative_count:
+            current_mood = "愉快"
+        elif negative_count > positive_count:
+            current_mood = "低落"
+    
+    return current_mood
+
+async def _generate_proactive_content(user_id: str, topics: List[str], intimacy: int, current_time: str, silence_duration: str, stamina: float, chat_type: str, user_name: str, familiarity: int, trust: int, interest_match: int, communication_style: str, profile: Optional[UserProfile] = None, current_mood: Optional[str] = None, contextual_info: Optional[str] = None) -> str:
+    """生成符合人设的主动交互内容（可传入已获取的用户资料、情绪和说话风格信息，避免重复查询）"""
     if not topics:
         return ""
     
     try:
         # 随机选择一个话题，但基于话题的相关性和多样性
-        selected_topic = random.choice(topics)
+        selected_topic = _RNG.choice(topics)
+        
+        # 相同用户、相近情境的重复触发直接复用短期缓存的结果
+        decision_key = f"proactive:{user_id}:{chat_type}:{intimacy // 5}:{silence_duration}:{selected_topic}"
+        cached_decision = await cached_context_get(decision_key)
+        if cached_decision is not None:
+            logger.debug(f"主动交互决策缓存命中: {decision_key}")
+            return cached_decision
         
         # 获取用户关系数据，用于构建更个性化的prompt
-        profile = await relation_db.get_user_profile(user_id)
+        if profile is None:
+            profile = await relation_db.get_user_profile(user_id)
         rel = profile.relationship
         
         # 生成当前情绪状态，基于用户的情感趋势
-        sentiment_trends = rel.sentiment_trends
-        current_mood = "平静"
-        
-        # 分析最近的情感趋势
-        if sentiment_trends:
-            # 获取最近5条情感记录
-            recent_sentiments = sentiment_trends[-5:]
-            # 计算积极/消极情感的比例
-            positive_count = sum(1 for trend in recent_sentiments if trend.get("sentiment") in ["开心", "愉快", "兴高采烈"])
-            negative_count = sum(1 for trend in recent_sentiments if trend.get("sentiment") in ["低落", "沮丧", "烦躁"])
-            
-            if positive_count > negative_count:
-                current_mood = "愉快"
-            elif negative_count > positive_count:
-                current_mood = "低落"
-        
-        # 填充SOCIAL_VOLITION_PROMPT所需的参数
-        prompt = SOCIAL_VOLITION_PROMPT.format(
-            alice_core_persona=ALICE_CORE_PERSONA,
+        if current_mood is None:
+            current_mood = _get_current_mood(rel)
+        
+        # 填充动态情境部分所需的参数（静态前缀已在模块加载时构建）
+        context_prompt = _render_context_prompt(dict(
             current_time=current_time,
-            time_period="上午" if 9 <= int(current_time.split(":")[0]) < 12 else "下午" if 12 <= int(current_time.split(":")[0]) < 18 else "晚上",
+            time_period=_get_time_period(current_time),
             silence_duration=silence_duration,
             mood=current_mood,
             stamina=stamina,
@@ -519,21 +644,33 @@ async def _generate_proactive_content(user_id: str, topics: List[str], intimacy:
             relation_tags=", ".join(rel.tags) if rel.tags else "",
             relation_notes=rel.notes if rel.notes else "",
             vision_desc="无",  # 主动发起时通常没有图片
-            personalized_info=f"感兴趣的话题: {selected_topic}，用户沟通风格: {communication_style}",
-            conversation_summary=f"最近的话题: {selected_topic}"
-        )
+            personalized_info=f"用户沟通风格: {communication_style}",
+            conversation_summary="见下方话题点"
+        ))
         
         # 使用动态人设管理系统构建更丰富的prompt
-        from app.core.prompts import build_prompt_with_persona
-        contextual_prompt = await build_prompt_with_persona(
-            core_persona=prompt,
-            context=f"当前正在与{user_name}进行主动交互，话题是{selected_topic}",
-            scene=chat_type,
-            emotion=current_mood,
-            relation=f"好感度{intimacy}/100",
-            max_extended_items=3,
-            max_contextual_items=2
-        )
+        # 扩展部分只依赖用户、场景、亲密度、情绪和话题，短时间内直接复用，每次只拼接动态情境
+        suffix_key = (user_id, chat_type, intimacy // 10, current_mood, selected_topic)
+        cached_suffix = _PERSONA_SUFFIX_CACHE.get(suffix_key)
+        if cached_suffix is not None and time.time() - cached_suffix[1] < PERSONA_SUFFIX_TTL:
+            persona_suffix = cached_suffix[0]
+        else:
+            from app.core.prompts import build_prompt_with_persona
+            persona_suffix = await build_prompt_with_persona(
+                core_persona="",
+                context=f"当前正在与{user_name}进行主动交互，话题是{selected_topic}",
+                scene=chat_type,
+                emotion=current_mood,
+                relation=f"好感度{intimacy}/100",
+                max_extended_items=3,
+                max_contextual_items=2,
+                contextual_info=contextual_info
+            )
+            _PERSONA_SUFFIX_CACHE[suffix_key] = (persona_suffix, time.time())
+            _PERSONA_SUFFIX_CACHE.move_to_end(suffix_key)
+            while len(_PERSONA_SUFFIX_CACHE) > _PERSONA_SUFFIX_CACHE_MAX_SIZE:
+                _PERSONA_SUFFIX_CACHE.popitem(last=False)
+        contextual_prompt = context_prompt + persona_suffix
         
         # 根据沟通风格调整temperature
         temperature = 0.5
@@ -542,36 +679,96 @@ async def _generate_proactive_content(user_id: str, topics: List[str], intimacy:
         elif communication_style == "formal":
             temperature = 0.3
         
+        # 话题放在末尾的用户消息中，使前面的人设和情境部分在不同话题间保持一致，便于前缀缓存命中
         response = await cached_llm_invoke(
             llm, 
-            [SystemMessage(content=contextual_prompt)],
+            [
+                _SOCIAL_VOLITION_STATIC_MESSAGE,
+                SystemMessage(content=contextual_prompt),
+                HumanMessage(content=f"话题点：{selected_topic}")
+            ],
             temperature=temperature,
             query_type="proactive_content",
             conversation_type=chat_type
         )
         
-        content = response.content.strip()
+        # 去除可能存在的Markdown代码块标记
+        content = _JSON_FENCE_RE.sub("", response.content).strip()
+        result_content = ""
         if content:
-            try:
-                # 解析JSON响应
-                import json
-                result = json.loads(content)
-                proactive_content = result.get("content", "")
+            # 解析JSON响应；首字符不是括号时明显不是JSON，直接跳过解析，避免抛出和捕获异常
+            result = None
+            if content[0] in "{[":
+                try:
+                    result = json.loads(content)
+                except json.JSONDecodeError:
+                    pass
+            
+            if result is None:
+                # 如果不是JSON格式，直接使用内容
+                result_content = _ensure_alice_persona(content, intimacy)
+            else:
+                proactive_content = result.get("content", "") if isinstance(result, dict) else ""
                 if proactive_content:
                     # 确保内容符合Alice人设
-                    return _ensure_alice_persona(proactive_content, intimacy)
-            except json.JSONDecodeError:
-                # 如果不是JSON格式，直接使用内容
-                return _ensure_alice_persona(content, intimacy)
+                    result_content = _ensure_alice_persona(proactive_content, intimacy)
         
-        return ""
+        await cached_context_set(decision_key, result_content, ttl=PROACTIVE_DECISION_TTL)
+        return result_content
     except Exception as e:
         logger.error(f"生成主动内容失败: {e}")
         return ""
 
+# 最近读取到的用户亲密度，用于在查询数据库之前做廉价的拦截判断
+# user_id -> (亲密度, 过期时间)
+_INTIMACY_HINTS: "OrderedDict[str, tuple]" = OrderedDict()
+_INTIMACY_HINTS_MAX_SIZE = 4096
+INTIMACY_HINT_TTL = 60
+
+def _get_intimacy_hint(user_id: str, now: float) -> Optional[int]:
+    """获取未过期的亲密度记录，没有时返回None"""
+    entry = _INTIMACY_HINTS.get(user_id)
+    if entry is None or now > entry[1]:
+        return None
+    return entry[0]
+
+def _set_intimacy_hint(user_id: str, intimacy: int, now: float):
+    """记录从数据库读取到的亲密度"""
+    _INTIMACY_HINTS[user_id] = (intimacy, now + INTIMACY_HINT_TTL)
+    _INTIMACY_HINTS.move_to_end(user_id)
+    if len(_INTIMACY_HINTS) > _INTIMACY_HINTS_MAX_SIZE:
+        _INTIMACY_HINTS.popitem(last=False)
+
+# 待写入数据库的最后交互时间（user_id -> 时间戳），同一用户在写入前的多次更新只保留最新值
+_PENDING_INTERACTION_WRITES: Dict[str, float] = {}
+_interaction_write_task: Optional[asyncio.Task] = None
+INTERACTION_WRITE_DELAY = 2.0
+
+def _schedule_interaction_write(user_id: str, interaction_time: float):
+    """登记最后交互时间的写入，由后台任务延迟批量写入，不阻塞主动交互节点的返回"""
+    global _interaction_write_task
+    _PENDING_INTERACTION_WRITES[user_id] = interaction_time
+    if _interaction_write_task is None or _interaction_write_task.done():
+        _interaction_write_task = asyncio.create_task(_flush_interaction_writes())
+
+async def _flush_interaction_writes():
+    """定期将积累的最后交互时间批量写入数据库，直到没有待写入的数据"""
+    while _PENDING_INTERACTION_WRITES:
+        await asyncio.sleep(INTERACTION_WRITE_DELAY)
+        pending = dict(_PENDING_INTERACTION_WRITES)
+        _PENDING_INTERACTION_WRITES.clear()
+        try:
+            # 同步的数据库写入放到线程中执行，避免阻塞事件循环
+            await asyncio.to_thread(relation_db.update_last_interaction_times, pending)
+        except Exception as e:
+            logger.error(f"写入最后交互时间失败: {e}")
+
 async def proactive_node(state: AgentState):
     """主动交互节点 - 自然触发版本"""
-    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    # 本次判断统一使用同一时间快照，保证日志、沉默时长和提示词中的时间一致
+    now = time.time()
+    now_dt = datetime.fromtimestamp(now)
+    ts = now_dt.strftime("%Y-%m-%d %H:%M:%S")
     logger.info(f"[{ts}] --- [Proactive] Checking interaction opportunity... ---")
     
     # 1. 获取基本上下文
@@ -589,6 +786,19 @@ async def proactive_node(state: AgentState):
         logger.error(f"[{ts}] 获取上下文失败: {e}")
         return {"next_step": "silent"}
     
+    # 不在活跃时间窗口内时直接返回，无需查询数据库（只依赖当前时间的廉价检查）
+    if not interaction_manager.is_in_active_time_window(now_dt.hour):
+        logger.debug(f"[{ts}] 不在活跃时间窗口内，跳过主动交互")
+        return {"next_step": "silent"}
+    
+    # 低亲密度用户的随机拦截：先用最近记录的亲密度判断，命中时无需查询数据库；
+    # 同一次随机数在拿到最新亲密度后复用，触发概率与原先一致
+    low_intimacy_roll = _RNG.random()
+    hinted_intimacy = _get_intimacy_hint(user_id, now)
+    if hinted_intimacy is not None and hinted_intimacy < 20 and low_intimacy_roll > 0.3:
+        logger.debug(f"[{ts}] 用户亲密度较低 ({hinted_intimacy})，减少主动交互")
+        return {"next_step": "silent"}
+    
     # 2. 获取用户关系数据
     try:
         profile = await relation_db.get_user_profile(user_id)
@@ -597,20 +807,21 @@ async def proactive_node(state: AgentState):
         familiarity = rel.familiarity
         trust = rel.trust
         interest_match = rel.interest_match
+        _set_intimacy_hint(user_id, intimacy, now)
         
         # 3. 检查关系阶段 - 低亲密度用户减少主动交互
-        if intimacy < 20 and random.random() > 0.3:
+        if intimacy < 20 and low_intimacy_roll > 0.3:
             logger.debug(f"[{ts}] 用户亲密度较低 ({intimacy})，减少主动交互")
             return {"next_step": "silent"}
         
         # 4. 获取上次交互时间
-        last_interaction_time = getattr(rel, "last_interaction_time", time.time() - 3600 * 2)
+        last_interaction_time = rel.last_interaction_time
         
         # 5. 获取用户反馈分数
-        feedback_score = interaction_manager.get_user_feedback_score(user_id)
+        feedback_score = interaction_manager.get_user_feedback_score(user_id, now)
         
         # 6. 获取体力值
-        stamina = getattr(rel, "stamina", 80.0)  # 使用默认值80.0如果没有
+        stamina = rel.stamina  # Relationship模型中默认值为80.0
         
         # 7. 判断是否应该发起主动交互
         if not interaction_manager.should_initiate_interaction(
@@ -622,25 +833,32 @@ async def proactive_node(state: AgentState):
             trust, 
             interest_match, 
             stamina, 
-            rel.interaction_patterns
+            rel.interaction_patterns,
+            now=now
         ):
             return {"next_step": "silent"}
             
-        # 8. 获取个性化话题
-        topics = await interaction_manager.get_personalized_topics(user_id)
+        chat_type = "group" if is_group else "private"
+        current_mood = _get_current_mood(rel)
+        
+        # 8. 获取个性化话题，同时检索说话风格信息（两者互不依赖，并发执行）
+        topics, contextual_info = await asyncio.gather(
+            interaction_manager.get_personalized_topics(user_id, profile=profile),
+            retrieve_contextual_persona(chat_type, current_mood, f"好感度{intimacy}/100", 2)
+        )
         
         # 9. 生成主动内容
         # 准备SOCIAL_VOLITION_PROMPT所需的参数
-        current_time = datetime.now().strftime("%H:%M")
+        current_time = now_dt.strftime("%H:%M")
         # 计算沉默时长（小时）
-        silence_hours = (time.time() - last_interaction_time) / 3600
+        silence_hours = (now - last_interaction_time) / 3600
         silence_duration = f"{silence_hours:.1f}小时"
-        chat_type = "group" if is_group else "private"
         user_name = user_display_name
         
         content = await _generate_proactive_content(
             user_id, topics, intimacy, current_time, silence_duration, stamina, 
-            chat_type, user_name, familiarity, trust, interest_match, rel.communication_style
+            chat_type, user_name, familiarity, trust, interest_match, rel.communication_style,
+            profile=profile, current_mood=current_mood, contextual_info=contextual_info
         )
         
         if not content or len(content.strip()) < 5:
@@ -652,7 +870,8 @@ async def proactive_node(state: AgentState):
         
         # 10. 更新最后交互时间
         rel.last_interaction_time = time.time()
-        relation_db.update_relationship(user_id, user_id, rel)
+        _schedule_interaction_write(user_id, rel.last_interaction_time)
+        _invalidate_persona_suffix(user_id)
         
         # 11. 消耗体力
         stamina_cost = -1.5 if is_group else -2.0  # 减少体力消耗，避免频繁触发
@@ -1,7 +1,4 @@
-import json
-import re
 import logging
-from datetime import datetime
 
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import SystemMessage
@@ -9,8 +6,12 @@ from app.core.state import AgentState
 from app.core.config import config
 from app.core.prompts import PSYCHOLOGY_ANALYSIS_PROMPT
 from app.core.global_store import global_store
+from app.core.relation_desc import describe as describe_relation, PSYCHOLOGY_LOW_LABELS
 from app.memory.relation_db import relation_db
-from app.utils.cache import cached_llm_invoke
+from app.utils.cache import cached_llm_invoke, singleflight
+from app.utils.json_extract import find_json_object
+from app.utils import fastjson
+from app.utils.log_time import log_ts
 
 llm = ChatOpenAI(
     model=config.SMALL_MODEL,
@@ -24,7 +25,7 @@ logger = logging.getLogger("PsychologyNode")
 
 
 async def psychology_node(state: AgentState):
-    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    ts = log_ts()
     logger.info(f"[{ts}]--- [Psychology] Analyzing Subconscious... ---")
 
     # 1. 身份锚定：只认 QQ 号作为数据库主键
@@ -54,35 +55,7 @@ async def psychology_node(state: AgentState):
     rel = profile.relationship
 
     # 4. 丰富关系描述
-    def get_relation_desc(intimacy, familiarity, trust, interest_match):
-        if intimacy < 20:
-            return "讨厌的人"
-        elif intimacy < 40:
-            if trust < 30:
-                return "不怎么信任的人"
-            else:
-                return "普通路人"
-        elif intimacy < 60:
-            if familiarity > 70:
-                return "熟悉的朋友"
-            elif trust > 70:
-                return "值得信任的朋友"
-            else:
-                return "普通的朋友"
-        elif intimacy < 80:
-            if familiarity > 80 and trust > 80:
-                return "亲密的朋友"
-            elif interest_match > 80:
-                return "志同道合的朋友"
-            else:
-                return "值得信赖的朋友"
-        else:
-            if familiarity > 90 and trust > 90:
-                return "最亲密的朋友"
-            else:
-                return "非常要好的朋友"
-
-    rel_desc = get_relation_desc(rel.intimacy, rel.familiarity, rel.trust, rel.interest_match)
+    rel_desc = describe_relation(rel.intimacy, rel.familiarity, rel.trust, rel.interest_match, PSYCHOLOGY_LOW_LABELS)
 
     # 5. 构造 Prompt - 添加对话历史和用户关系的更多维度
     prompt = PSYCHOLOGY_ANALYSIS_PROMPT.format(
@@ -105,19 +78,23 @@ async def psychology_node(state: AgentState):
     )
 
     try:
-        response = await cached_llm_invoke(
-            llm, 
-            [SystemMessage(content=prompt)],
-            temperature=0.3,  # 保持原有温度设置
-            query_type="psychology_analysis"
+        # 同一用户同一条消息的并发分析只调用一次 LLM
+        response = await singleflight(
+            f"psychology:{user_id}:{hash(last_msg)}",
+            lambda: cached_llm_invoke(
+                llm, 
+                [SystemMessage(content=prompt)],
+                temperature=0.3,  # 保持原有温度设置
+                query_type="psychology_analysis"
+            )
         )
         raw_content = response.content.strip()
 
         data = {}
-        match = re.search(r"\{.*\}", raw_content, re.DOTALL)
-        if match:
+        json_text = find_json_object(raw_content)
+        if json_text:
             try:
-                data = json.loads(match.group())
+                data = fastjson.loads(json_text)
             except Exception as e:
                 logger.error(f"[{ts}]❌ [Psychology JSON Parse Error] {str(e)}")
                 logger.error(f"[{ts}]❌ Raw content: {raw_content[:100]}...")
@@ -138,6 +115,13 @@ async def psychology_node(state: AgentState):
         )
 
         # 6. 执行关系维度更新 (使用唯一 ID)
+        # 记录当前关系维度，更新后用返回的新值覆盖，无需再次查询数据库
+        current_dimensions = {
+            "intimacy": rel.intimacy,
+            "familiarity": rel.familiarity,
+            "trust": rel.trust,
+            "interest_match": rel.interest_match
+        }
         relation_deltas = data.get("relation_deltas", {})
         if relation_deltas:
             # 保存更新前的关系维度值
@@ -153,6 +137,7 @@ async def psychology_node(state: AgentState):
             
             # 记录日志
             if updated_dimensions:
+                current_dimensions.update(updated_dimensions)
                 log_msg = f"[{ts}]❤️ [Relation] {user_display_name}({user_id}):"
                 for dim, new_value in updated_dimensions.items():
                     # 使用更新前保存的旧值
@@ -167,12 +152,11 @@ async def psychology_node(state: AgentState):
                 # 保存更新前的好感度值
                 old_intimacy = getattr(rel, "intimacy", 50)
                 new_intimacy = relation_db.update_intimacy(user_id, i_delta)
+                current_dimensions["intimacy"] = new_intimacy
                 logger.info(f"[{ts}]❤️ [Relation] {user_display_name}({user_id}): {old_intimacy} -> {new_intimacy} (Delta: {i_delta})")
 
         # 7. 获取更新后的情绪和关系数据
         updated_emotion = global_store.get_emotion_snapshot()
-        updated_profile = await relation_db.get_user_profile(user_id)
-        updated_rel = updated_profile.relationship
 
         return {
             "psychological_context": {
@@ -180,12 +164,12 @@ async def psychology_node(state: AgentState):
                 "style_instruction": data.get("style_instruction", "Normal"),
                 "primary_emotion": updated_emotion.primary_emotion,
                 "secondary_emotion": updated_emotion.secondary_emotion,
-                "current_intimacy": updated_rel.intimacy,
-                "current_familiarity": updated_rel.familiarity,
-                "current_trust": updated_rel.trust,
-                "current_interest_match": updated_rel.interest_match
+                "current_intimacy": current_dimensions["intimacy"],
+                "current_familiarity": current_dimensions["familiarity"],
+                "current_trust": current_dimensions["trust"],
+                "current_interest_match": current_dimensions["interest_match"]
             },
-            "global_emotion_snapshot": updated_emotion.model_dump()
+            "global_emotion_snapshot": updated_emotion._asdict()
         }
 
     except Exception as e:
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
@@ -8,11 +9,18 @@ logger = logging.getLogger("Summarizer")
 from app.core.state import AgentState
 from app.core.config import config
 from app.memory.local_history import LocalHistoryManager
-from app.graph.nodes.memory_saver import extract_and_save_memories
+from app.graph.nodes.memory_saver import get_extraction_context, save_memory_operations, extract_and_save_memories
+from app.utils.cache import singleflight
+from app.utils.json_extract import find_json_object
+from app.utils import fastjson
 
 MAX_HISTORY_LEN = 15
 PRUNE_COUNT = 10
 
+# 剪枝消息的记忆提取门槛：有效文本消息（长度>8）不少于3条，且文本总长度不少于80字
+MIN_MEMORY_TEXT_MSGS = 3
+MIN_MEMORY_TOTAL_CHARS = 80
+
 SUMMARY_PROMPT = """
 You are a Conversation Summarizer.
 Update the running summary with new lines.
@@ -26,6 +34,55 @@ Update the running summary with new lines.
 Output ONLY the updated summary text.
 """
 
+# 总结与记忆提取合并为一次调用：两者读取的是同一批剪枝消息
+SUMMARY_WITH_MEMORY_PROMPT = """
+You are a Conversation Summarizer and the Memory Manager for an AI Agent.
+Do two tasks on the same conversation lines and answer with ONE JSON object.
+
+Task 1 - Summary: update the running summary with the new lines.
+
+【Current Summary】
+{current_summary}
+
+【New Lines】
+{new_lines}
+
+Task 2 - Memory: extract structured memory operations from the latest exchange.
+
+**Current Mode:** {mode}
+(Mode "INTERACTIVE": AI replied. Extract facts **only from the user's input**.)
+(Mode "OBSERVATION": AI stayed silent. Extract facts **only from the user's input**.)
+
+**Latest Exchange:**
+User: {user_name} (ID: {user_id})
+User Input: "{user_input}"
+AI Response: "{ai_output}"  (DO NOT extract facts from the AI's response!)
+
+**Extraction Rules:**
+1. **Unify Identity**: Always associate facts with User ID {user_id}.
+2. **Fact vs. Noise**: 
+   - "I bought a PS5" -> SAVE (Fact about the user).
+   - "Lol" / "Weather is nice" -> IGNORE (trivial).
+   - **NEVER** extract facts from the AI's response.
+   - Focus only on what the user has said about themselves, their life, preferences, etc.
+   - (In OBSERVATION mode): ONLY save if the user reveals permanent personal info or clear preferences.
+
+**Output JSON Format:**
+{{
+  "summary": "The updated summary text.",
+  "operations": [
+    {{
+      "action": "add",
+      "content": "User {user_name} bought a PS5.", 
+      "category": "fact", 
+      "importance": 4 
+    }}
+  ]
+}}
+If nothing worth saving, use "operations": [].
+Output ONLY the JSON object.
+"""
+
 llm = ChatOpenAI(
     model=config.SMALL_MODEL,
     temperature=0.1,
@@ -33,6 +90,30 @@ llm = ChatOpenAI(
     base_url=config.SMALL_MODEL_URL
 )
 
+# 总结 Prompt 模板只在模块加载时解析一次
+_SUMMARY_TEMPLATE = ChatPromptTemplate.from_template(SUMMARY_PROMPT)
+_SUMMARY_WITH_MEMORY_TEMPLATE = ChatPromptTemplate.from_template(SUMMARY_WITH_MEMORY_PROMPT)
+
+
+def _has_memory_signal(messages) -> bool:
+    """判断剪枝消息是否值得提取记忆（全是表情包、图片或“嗯”“ok”之类的短回应时跳过）"""
+    total_chars = 0
+    text_msgs = 0
+    for m in messages:
+        content = m.content
+        if isinstance(content, str):
+            total_chars += len(content)
+            if len(content) > 8:
+                text_msgs += 1
+    return text_msgs >= MIN_MEMORY_TEXT_MSGS and total_chars >= MIN_MEMORY_TOTAL_CHARS
+
+
+def _summary_line(m) -> str:
+    """将一条消息格式化为总结输入中的一行"""
+    content = m.content
+    if isinstance(content, list): content = "[MultiModal/Image]"
+    return f"{'User' if isinstance(m, HumanMessage) else 'AI'}: {content}"
+
 
 async def summarizer_node(state: AgentState):
     messages = state.get("messages", [])
@@ -47,34 +128,80 @@ async def summarizer_node(state: AgentState):
     user_nickname = state.get("sender_name", "User")
 
     # 1. 剪枝逻辑
+    memory_task = None
     if len(messages) > MAX_HISTORY_LEN:
         to_prune = messages[:PRUNE_COUNT]
         remaining = messages[PRUNE_COUNT:]
         
-        # 在总结前，先从要剪枝的消息中提取重要信息保存到长期记忆
-        logger.info(f"📝 [Summarizer] 正在从 {len(to_prune)} 条消息中提取重要信息到长期记忆")
-        
-        # 对整个剪枝消息集合只调用一次记忆提取函数，传入完整上下文
-        # 避免重复处理同一条消息（之前的实现会让每条消息作为当前消息和前一条消息被多次处理）
-        await extract_and_save_memories(to_prune, real_user_id, user_nickname)
-
-        text_lines = []
-        for m in to_prune:
-            role = "User" if isinstance(m, HumanMessage) else "AI"
-            content = m.content
-            if isinstance(content, list): content = "[MultiModal/Image]"
-            text_lines.append(f"{role}: {content}")
+        input_text = "\n".join(_summary_line(m) for m in to_prune)
+        previous_summary = current_summary if current_summary else "Start of log."
 
-        input_text = "\n".join(text_lines)
+        # 剪枝消息有足够信息量时，总结和记忆提取合并为一次 LLM 调用
+        memory_context = get_extraction_context(to_prune) if _has_memory_signal(to_prune) else None
+        if memory_context is None:
+            logger.info(f"📝 [Summarizer] {len(to_prune)} 条剪枝消息信息量过低，跳过记忆提取")
 
         try:
-            prompt = ChatPromptTemplate.from_template(SUMMARY_PROMPT)
-            chain = prompt | llm
-            response = await chain.ainvoke({
-                "current_summary": current_summary if current_summary else "Start of log.",
-                "new_lines": input_text
-            })
-            current_summary = response.content.strip()
+            updated_summary = None
+            if memory_context:
+                logger.info(f"📝 [Summarizer] 正在总结并从 {len(to_prune)} 条消息中提取重要信息到长期记忆")
+                mode, user_text, ai_output = memory_context
+                combined_messages = _SUMMARY_WITH_MEMORY_TEMPLATE.format_messages(
+                    current_summary=previous_summary,
+                    new_lines=input_text,
+                    mode=mode,
+                    user_id=real_user_id,
+                    user_name=user_nickname,
+                    user_input=user_text,
+                    ai_output=ai_output
+                )
+                # 同一会话对同一批消息的并发总结只调用一次 LLM
+                # 合并调用使用总结模型的温度（0.1），单独提取时 memory_saver 使用 0.0
+                response = await singleflight(
+                    f"summary_memory:{session_key}:{hash(input_text)}",
+                    lambda: llm.ainvoke(combined_messages)
+                )
+                data = None
+                json_text = find_json_object(response.content)
+                if json_text:
+                    try:
+                        data = fastjson.loads(json_text)
+                    except fastjson.JSONDecodeError:
+                        data = None
+                if isinstance(data, dict) and isinstance(data.get("summary"), str) and data["summary"].strip():
+                    updated_summary = data["summary"].strip()
+                    operations = data.get("operations") or []
+                    if operations:
+                        memory_task = save_memory_operations(
+                            operations, mode, user_text, ai_output, real_user_id, user_nickname
+                        )
+                else:
+                    logger.warning("⚠️ [Summarizer] 合并输出解析失败，回退为单独总结")
+
+            if updated_summary is None:
+                summary_messages = _SUMMARY_TEMPLATE.format_messages(
+                    current_summary=previous_summary,
+                    new_lines=input_text
+                )
+                # 同一会话对同一批消息的并发总结只调用一次 LLM
+                response = await singleflight(
+                    f"summary:{session_key}:{hash(input_text)}",
+                    lambda: llm.ainvoke(summary_messages)
+                )
+                updated_summary = response.content.strip()
+
+                # 合并输出不可用时记忆提取不能丢：已解析出的操作直接保存，否则单独提取一次
+                if memory_context:
+                    operations = data.get("operations") if isinstance(data, dict) else None
+                    if isinstance(operations, list):
+                        if operations:
+                            memory_task = save_memory_operations(
+                                operations, mode, user_text, ai_output, real_user_id, user_nickname
+                            )
+                    else:
+                        memory_task = extract_and_save_memories(to_prune, real_user_id, user_nickname)
+
+            current_summary = updated_summary
             messages = remaining
 
         except Exception as e:
@@ -83,10 +210,19 @@ async def summarizer_node(state: AgentState):
     # 2. 核心修复：调用异步保存方法，传入 session_key
     # 假设 LocalHistoryManager.save_state 签名支持 session_id 参数
     # 如果您的 LocalHistoryManager 是基于全局单例的，请务必修改它以接受 session_id 作为文件路径的一部分
+    # 历史保存与记忆写入互不依赖，并发执行
+    save_tasks = []
     if session_key:
-        await LocalHistoryManager.save_state(messages, current_summary, session_id=session_key)
+        save_tasks.append(LocalHistoryManager.save_state(messages, current_summary, session_id=session_key))
     else:
         logger.warning("⚠️ [Summarizer] No session_id found, history might not persist correctly.")
+    if memory_task is not None:
+        save_tasks.append(memory_task)
+    if save_tasks:
+        results = await asyncio.gather(*save_tasks, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f"❌ [Summarizer Save Error] {result}")
 
     return {
         "messages": messages,
@@ -1,31 +1,50 @@
+import itertools
 import logging
-from datetime import datetime
+import os
 
 from langchain_core.messages import ToolMessage  # 引入 ToolMessage
 from app.core.state import AgentState
+from app.core.config import config
 from app.tools.tool_registry import tool_registry
-from app.utils.cache import cached_tool_result_get, cached_tool_result_set
-import uuid
+from app.utils.cache import cached_tool_result_get, cached_tool_result_set, singleflight, tool_args_key
+from app.utils.log_time import log_ts
 
 # 配置日志
 logger = logging.getLogger("ToolHandler")
 
+# tool_call_id 只用于在对话历史中关联工具调用：导入时生成一次随机前缀区分每次启动
+# （容器里每次启动的进程号往往相同，不能用来区分），每次调用只需自增序号
+_CALL_ID_PREFIX = os.urandom(4).hex()
+_TOOL_CALL_SEQ = itertools.count(1)
+
+
+class _Truncate:
+    """日志参数的惰性截断：只有日志真正输出时才执行 str() 和切片"""
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value, limit: int):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        return str(self.value)[:self.limit]
+
 
 async def tool_node(state: AgentState):
     """
     执行工具调用，并将结果作为 ToolMessage 注入历史
     """
     current_messages = state.get("messages", [])
-    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    ts = log_ts()
     tool_data = state.get("tool_call", {})
     tool_name = tool_data.get("name")
     tool_args = tool_data.get("args") or {}
 
-    # 生成一个随机的 tool_call_id，这对于某些模型（如 GPT/Claude）保持对话结构很重要
+    # 生成唯一的 tool_call_id（启动前缀+自增序号），这对于某些模型（如 GPT/Claude）保持对话结构很重要
     # 虽然这里我们是通过 prompt 模拟的调用，但保持结构一致性有好处
-    tool_call_id = str(uuid.uuid4())
+    tool_call_id = f"call_{_CALL_ID_PREFIX}_{next(_TOOL_CALL_SEQ)}"
 
-    logger.info(f"[{ts}] --- [Tools] Executing: {tool_name} with {tool_args} --- ")
+    logger.info("[%s] --- [Tools] Executing: %s with %s --- ", ts, tool_name, tool_args)
 
     result = "Tool execution failed."
 
@@ -45,14 +64,16 @@ async def tool_node(state: AgentState):
                 else:
                     tool_args = {}
             
-            # 检查工具调用结果缓存
-            cache_key_args = tool_args.copy()
-            cached_result = await cached_tool_result_get(tool_name, cache_key_args)
-            
-            if cached_result:
-                logger.info(f"[{ts}] [Tools Cache Hit] {tool_name}: {str(tool_args)[:30]}... ")
-                result = cached_result
-            else:
+            # 规范化的参数键只计算一次，缓存读写和并发去重共用
+            args_key = tool_args_key(tool_args)
+
+            async def _run_tool():
+                cached_result = await cached_tool_result_get(tool_name, args_key)
+                
+                if cached_result:
+                    logger.info("[%s] [Tools Cache Hit] %s: %s... ", ts, tool_name, _Truncate(tool_args, 30))
+                    return cached_result
+                
                 # 缓存未命中，执行工具调用
                 tool_instance = tool_registry.get_tool_instance(tool_name)
                 if tool_instance:
@@ -61,18 +82,22 @@ async def tool_node(state: AgentState):
                     
                     if execute_result["success"]:
                         if tool_name == "generate_image":
-                            result = f"IMAGE_GENERATED: {execute_result['result']}"
+                            tool_result = f"IMAGE_GENERATED: {execute_result['result']}"
                         else:
-                            result = execute_result["result"]
+                            tool_result = execute_result["result"]
                     else:
-                        result = execute_result["error"]
-                        logger.error(f"[{ts}] [Tool Execution Error] {result}")
+                        tool_result = execute_result["error"]
+                        logger.error(f"[{ts}] [Tool Execution Error] {tool_result}")
                 else:
-                    result = f"Failed to create tool instance: {tool_name}"
+                    tool_result = f"Failed to create tool instance: {tool_name}"
                 
                 # 将结果存入缓存
-                await cached_tool_result_set(tool_name, cache_key_args, result)
-                logger.info(f"[{ts}] [Tools Cache Set] {tool_name}: {str(tool_args)[:30]}... ")
+                await cached_tool_result_set(tool_name, args_key, tool_result)
+                logger.info("[%s] [Tools Cache Set] %s: %s... ", ts, tool_name, _Truncate(tool_args, 30))
+                return tool_result
+
+            # 相同工具和参数的并发调用只执行一次，其余等待共享结果
+            result = await singleflight(f"tool:{tool_name}:{args_key}", _run_tool)
 
     except Exception as e:
         logger.error(f"[{ts}] [Tool Error] {e}")
@@ -80,8 +105,13 @@ async def tool_node(state: AgentState):
 
     # --- 改进点：使用 ToolMessage ---
     # content 前加上标识，帮助 LLM 识别
+    if not isinstance(result, str):
+        result = str(result)
+    # 过长的结果（如搜索、数据分析输出）截断后再注入历史，避免撑大每轮的上下文
+    if len(result) > config.MAX_TOOL_RESULT_CHARS:
+        result = result[:config.MAX_TOOL_RESULT_CHARS] + "\n...[truncated]"
     tool_msg = ToolMessage(
-        content=f"[System: Tool '{tool_name}' Result]\n{str(result)}",
+        content=f"[System: Tool '{tool_name}' Result]\n" + result,
         tool_call_id=tool_call_id,
         name=tool_name
     )
@@ -89,7 +119,11 @@ async def tool_node(state: AgentState):
     # 兼容性处理：如果你之前的 Agent Prompt 极度依赖 SystemMessage，可以保持 SystemMessage
     # 但 ToolMessage 是 LangChain 标准。这里我保留 SystemMessage 风格的内容但用 ToolMessage 类
 
+    # 浅拷贝后原地追加，不修改状态中的原列表
+    new_messages = current_messages.copy()
+    new_messages.append(tool_msg)
+
     return {
-        "messages": current_messages + [tool_msg],
+        "messages": new_messages,
         "tool_call": {}
     }
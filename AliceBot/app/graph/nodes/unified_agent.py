@@ -1,9 +1,11 @@
-import json
 import re
+import asyncio
 import time
 import random
 import logging
-from datetime import datetime
+from functools import lru_cache
+from itertools import islice
+from typing import Optional, Tuple
 from langchain_openai import ChatOpenAI
 
 # 配置日志
@@ -14,9 +16,14 @@ from app.core.config import config
 from app.memory.vector_store import vector_db
 from app.memory.relation_db import relation_db
 from app.memory import memory_manager
+from app.core.relation_desc import describe as describe_relation, persona_relation
 from app.core.prompts import ALICE_CORE_PERSONA, AGENT_SYSTEM_PROMPT, build_prompt_with_persona
 from app.utils.cache import cached_llm_invoke, cached_user_info_get, cached_user_info_set
+from app.utils.semantic_cache import semantic_prompt_cache
+from app.utils.json_extract import find_json_object
+from app.utils import fastjson
 from app.plugins.emoji_plugin.emoji_service import get_emoji_service
+from app.utils.log_time import log_ts, now_minute_str
 
 llm = ChatOpenAI(
     model=config.MODEL_NAME,
@@ -25,45 +32,247 @@ llm = ChatOpenAI(
     base_url=config.MODEL_URL
 )
 
+# 预编译的正则表达式
+_SYS_HINT_RE = re.compile(r"\[system hint:.*?\]", re.IGNORECASE)
+_MD_JSON_RE = re.compile(r"```(?:json)?\s*(\{.*?\})\s*```", re.DOTALL)
+_JSON_START_RE = re.compile(r"\{\s*\"")
+_TRAILING_COMMA_OBJ_RE = re.compile(r",\s*}")
+_TRAILING_COMMA_ARR_RE = re.compile(r",\s*]")
+_NON_ASCII_RE = re.compile(r"[^\x00-\x7F]+")
+_USER_PREFIX_RE = re.compile(r"^\[.*?\]:\s*")
+_STICKER_DESC_RE = re.compile(r"【表情包:.*?】")
+# 检索查询清洗：表情包描述和图片占位符一次替换完成
+_QUERY_CLEAN_RE = re.compile(r"【表情包:.*?】|\[图片\]")
+
+# 用户表达习惯分析：表情符号、标点、问句、感叹句、重复字符
+_PUNCT_SET = frozenset("!！?？。，、；：…")
+_Q_SET = frozenset("?？")
+_EX_SET = frozenset("!！")
+_EMOJI_LOW, _EMOJI_HIGH = 0x2600, 0x27BF
+
+# 重要信息的模式（命中任一即记录记忆点）
+_IMPORTANT_INFO_RES = tuple(re.compile(p, re.IGNORECASE) for p in (
+    # 个人信息（年龄、性别、职业等）
+    r'(?:我(?:今年|现在)?(?:是|有)?(?:\d+|多少)?岁)|(?:我的(?:名字|年龄|性别|职业|生日|爱好|喜欢)是?.*)',
+    # 事件信息（时间、地点、人物等）
+    r'(?:(?:今天|明天|后天|昨天|上周|下周|去年|今年)(?:\w+)?)|(?:在(?:哪里|哪个地方|什么位置))|(?:和(?:谁|什么人))',
+    # 情绪表达
+    r'(?:(?:我觉得|我感到|我认为)(?:很|非常|有点)(?:开心|高兴|难过|伤心|生气|愤怒|失望|期待|紧张))',
+    # 需求和请求
+    r'(?:请(?:帮我|给我|告诉我|教我)|(?:我想|我要|我需要)(?:\w+))',
+))
+# 记忆点类型判断
+_MEMORY_PERSONAL_RE = re.compile(r'我的(?:名字|年龄|性别|职业|生日|爱好|喜欢)', re.IGNORECASE)
+_MEMORY_EVENT_RE = re.compile(r'(?:今天|明天|后天|昨天|上周|下周|去年|今年)')
+_MEMORY_EMOTION_RE = re.compile(r'(?:我觉得|我感到|我认为)(?:很|非常|有点)(?:开心|高兴|难过|伤心|生气|愤怒|失望|期待|紧张)')
+_MEMORY_REQUEST_RE = re.compile(r'(?:请(?:帮我|给我|告诉我|教我)|(?:我想|我要|我需要))')
+
+# 只由占位符组成的消息内容，命中时直接判定为纯表情包
+_PURE_STICKER_LITERALS = frozenset({"[图片]", "[表情]", "[图片][表情]", "[表情][图片]"})
+# 表情包判定前要去掉的字面量（占位符和空格），都是固定字符串，用 str.replace 即可，不必走正则
+_STICKER_STRIP_TOKENS = ("[图片]", "[表情]", " ")
+
+# Agent 回复的 JSON 格式要求，拼接在系统提示词末尾
+_FORMAT_INSTRUCTION = """
+    # 强制响应格式要求 - 必须严格遵守
+    YOU MUST OUTPUT A VALID JSON OBJECT ONLY. NO OTHER TEXT OR EXPLANATION ALLOWED.
+    YOU WILL BE PUNISHED SEVERELY IF YOU FAIL TO FOLLOW THIS INSTRUCTION.
+    
+    Response Format:
+    {
+      "monologue": "你的内部思考过程",
+      "action": "reply",
+      "args": "",
+      "response": "要发送给用户的回复内容"
+    }
+    
+    # 重要说明：
+    1. 必须包含所有四个字段：monologue, action, args, response
+    2. action字段只能是"reply"
+    3. response字段不能为空
+    4. 所有字段值必须用双引号包围
+    5. 不能有任何多余的文本，包括Markdown格式、注释等
+    6. 必须是有效的JSON格式
+    
+    # 错误示例（会被惩罚）：
+    - 哦，这是一个很好的问题！{"response": "好的，我会帮助你"}
+    - ```json {"response": "你好"} ```
+    - {"response": "你好"} （缺少必要字段）
+    - {'response': '你好'} （使用单引号）
+    
+    # 正确示例（必须严格按照此格式）：
+    {"monologue": "用户问我喜欢什么颜色，我应该回答蓝色", "action": "reply", "args": "", "response": "我喜欢蓝色"}
+    """
 
-def robust_json_parse(text: str) -> dict:
+# 增强表达习惯指令：有用户表达习惯时插入到系统提示中用户表达习惯部分之后
+_EXPRESSION_HABITS_INSTRUCTION = """
+### 表达习惯模仿要求 (CRITICAL)
+仔细分析用户的表达习惯，在回复中自然地融入这些习惯：
+1. **用词模仿**: 使用用户常用的词汇、短语和表达方式
+2. **句式模仿**: 模仿用户的句子结构和长度
+3. **语气模仿**: 匹配用户的语气（比如用户喜欢用感叹号，你也可以适当使用）
+4. **习惯表达**: 自然地使用用户的习惯用语和口头禅
+5. **避免冲突**: 如果用户的表达习惯与Alice的核心性格有冲突，优先保持Alice的核心性格，但可以适当调整表达风格
+        """
+_HABITS_INSERT_POS = AGENT_SYSTEM_PROMPT.find("{user_expression_habits}") + len("{user_expression_habits}")
+_AGENT_PROMPT_WITH_HABITS = (
+    AGENT_SYSTEM_PROMPT[:_HABITS_INSERT_POS] + "\n" + _EXPRESSION_HABITS_INSTRUCTION
+    + AGENT_SYSTEM_PROMPT[_HABITS_INSERT_POS:]
+)
+
+# Sticker 兜底指令：防止 LLM 把表情包当成需要分析的图片
+_STICKER_SAFEGUARD_MSG = SystemMessage(content=(
+    "【系统强制指令】\n"
+    "用户最后发送的是一个【表情包/Sticker】（代码中可能显示为'[图片]'）。\n"
+    "1. 这是一个非信息性的表情符号，**绝对不要**询问'这是什么图片'或'图片里有什么'。\n"
+    "2. 请将其视为一种情绪表达，仅对用户的文字内容（若有）进行回复，或回以简单互动。\n"
+))
+
+# 情绪对应的 LLM 温度：情绪越强烈，温度越高，回复越有变化；情绪越平静，温度越低，回复越稳定
+_EMOTION_TO_TEMPERATURE = {
+    "兴高采烈": 0.9,
+    "开心": 0.8,
+    "愉快": 0.7,
+    "惬意": 0.6,
+    "放松": 0.5,
+    "平静": 0.4,
+    "困倦/发呆": 0.3,
+    "恍惚": 0.3,
+    "低落": 0.5,
+    "沮丧": 0.6,
+    "烦躁": 0.7,
+    "愤怒": 0.8,
+    "暴怒": 0.9,
+    "疲惫": 0.3,
+    "疲惫不堪": 0.2,
+    "压力山大": 0.7,
+    "焦虑不安": 0.8
+}
+
+# Agent 决策（是否回复表情包、是否附带表情包等）专用的随机数生成器，
+# 与其他模块的随机抽取相互独立，需要复现行为时可单独 seed
+_RNG = random.Random()
+
+# 纯表情包消息的短路回复：回复概率及无可用表情包时的默认表情符号
+_REPLY_PROB = 0.6
+_STICKER_REPLIES = ("🐶", "🐱", "💖", "💕", "💝", "🤗", "👻", "👽")
+
+
+def _decide_emoji_count(emotion_intensity: float, intimacy: float, response_length: int, is_group: bool) -> int:
+    """
+    决定回复是否附带表情包（不含“避免连续使用”的判断）
+    :return: 要附带的表情包数量（0 或 1）
+    """
+    # 亲密度不够且回复不长时，后续判断都不会产生表情包，不必抽随机数
+    if intimacy <= 50 and response_length <= 100:
+        return 0
+
+    emoji_count = 0
+    if intimacy > 50:  # 与用户有一定关系
+        if is_group:
+            # 群聊中更谨慎地使用表情包：情感强烈时才可能发送
+            if ((emotion_intensity > 0.6 and _RNG.random() < 0.3) or
+                    (emotion_intensity > 0.9 and _RNG.random() < 0.5)):
+                emoji_count = 1
+        else:
+            # 私聊中更自然地使用表情包，但降低频率
+            if ((emotion_intensity > 0.4 and _RNG.random() < 0.3) or
+                    (emotion_intensity > 0.8 and _RNG.random() < 0.6)):
+                emoji_count = 1
+
+    # 回复内容过短或过长时调整概率
+    if response_length < 10:
+        # 短回复时更谨慎发送表情
+        emoji_count = 0 if _RNG.random() < 0.7 else emoji_count
+    elif response_length > 100:
+        # 长回复时更可能发送表情来缓解阅读压力，但降低概率
+        emoji_count = 1 if _RNG.random() < 0.2 else emoji_count
+
+    return emoji_count
+
+
+# 检索到的记忆在系统提示中的标题
+_RELATED_MEMORY_HEADER = "【相关回忆】\n"
+
+
+def _filter_rag_docs(docs: list) -> list:
+    """移除检索结果中的表情包描述，丢弃清理后为空的文档"""
+    return [doc for doc in (_STICKER_DESC_RE.sub("", d).strip() for d in docs) if doc]
+
+
+@lru_cache(maxsize=1024)
+def _strip_sticker_desc(content: str) -> str:
+    """去掉消息中的表情包描述；同一条历史消息每轮都会被重新清理，按内容缓存结果"""
+    return _STICKER_DESC_RE.sub("", content).strip()
+
+
+@lru_cache(maxsize=1024)
+def _history_line(is_ai: bool, content: str) -> str:
+    """将一条历史消息格式化为记忆检索上下文中的一行"""
+    return f"[{'AI' if is_ai else 'User'}]: {content}\n"
+
+
+def _clean_history(msgs):
+    """
+    逐条清理历史消息中的表情包描述
+    内容无需改动的消息原样返回，只有被改写的用户消息才重新构造；清理后为空的消息直接跳过
+    """
+    for msg in msgs:
+        content = msg.content
+        if not isinstance(msg, HumanMessage) or not isinstance(content, str):
+            yield msg
+            continue
+        cleaned = _strip_sticker_desc(content)
+        if cleaned == content:
+            yield msg
+        elif cleaned:
+            cleaned_msg = HumanMessage(content=cleaned)
+            # 清理后的消息只用于本次 LLM 输入，直接共享原消息的 additional_kwargs，无需复制
+            cleaned_msg.additional_kwargs = msg.additional_kwargs
+            yield cleaned_msg
+
+
+def _wrap_plain_text(text: str) -> dict:
+    """将无法解析为JSON的纯文本响应包装为预期的回复格式"""
+    return {
+        "monologue": "LLM返回了纯文本响应，自动包装为JSON格式",
+        "action": "reply",
+        "args": "",
+        "response": text
+    }
+
+
+def robust_json_parse(text: str) -> Tuple[Optional[dict], bool]:
     """
     增强型 JSON 解析器 - 专门修复 API 注入的脏数据和处理纯文本响应
+    :return: (解析结果, 是否正常解析)；删掉非ASCII字符才解析成功或回退为纯文本包装时，第二项为 False
     """
-    if not text: return None
+    if not text: return None, False
 
     # 🚀 [核心修复] 移除 API 强行注入的 system hint 垃圾信息
-    text = re.sub(r"\[system hint:.*?\]", "", text, flags=re.IGNORECASE)
+    text = _SYS_HINT_RE.sub("", text)
     text = text.strip()
 
     # 检查是否可能包含JSON
     if "{" in text and "}" in text:
         # 提取 Markdown JSON
-        match = re.search(r"```(?:json)?\s*(\{.*?\})\s*```", text, re.DOTALL)
+        match = _MD_JSON_RE.search(text)
         if match:
             text = match.group(1)
         else:
-            # 找到所有可能的JSON片段
-            all_starts = [m.start() for m in re.finditer(r"\{\s*\"", text)]
-            all_ends = [m.start() for m in re.finditer(r"\}\s*", text)]
+            start_match = _JSON_START_RE.search(text)
+            if start_match:
+                # 常见情况下模型输出的是合法JSON，直接从第一个形如 {" 的位置解码，忽略其后的多余文本
+                try:
+                    return fastjson.raw_decode(text, start_match.start())[0], True
+                except fastjson.JSONDecodeError:
+                    pass
+
+            # 解码失败时再线性扫描出括号配平的JSON对象，交给下面的修复逻辑
+            json_text = find_json_object(text, start_match.start()) if start_match else None
             
-            if all_starts and all_ends:
-                # 找到最外层的JSON
-                start = all_starts[0]
-                # 找到与最外层start匹配的end
-                depth = 0
-                end = start
-                for i, c in enumerate(text[start:]):
-                    if c == "{":
-                        depth += 1
-                    elif c == "}":
-                        depth -= 1
-                        if depth == 0:
-                            end = start + i + 1
-                            break
-                
-                if end > start:
-                    text = text[start:end]
+            if json_text:
+                text = json_text
             else:
                 # 简单提取第一个{到最后一个}之间的内容
                 start = text.find("{")
@@ -72,42 +281,139 @@ def robust_json_parse(text: str) -> dict:
                     text = text[start: end + 1]
 
         try:
-            return json.loads(text)
-        except json.JSONDecodeError:
+            return fastjson.loads(text), True
+        except fastjson.JSONDecodeError:
             try:
                 # 修复JSON格式问题
-                fixed_text = re.sub(r",\s*}", "}", text)  # 移除末尾的逗号
-                fixed_text = re.sub(r",\s*]", "]", fixed_text)  # 移除数组末尾的逗号
-                return json.loads(fixed_text)
+                fixed_text = _TRAILING_COMMA_OBJ_RE.sub("}", text)  # 移除末尾的逗号
+                fixed_text = _TRAILING_COMMA_ARR_RE.sub("]", fixed_text)  # 移除数组末尾的逗号
+                return fastjson.loads(fixed_text), True
             except:
                 # 尝试更激进的修复
                 try:
                     # 移除所有非JSON字符
-                    clean_text = re.sub(r"[^\x00-\x7F]+|", "", text)  # 移除非ASCII字符
-                    return json.loads(clean_text)
+                    clean_text = _NON_ASCII_RE.sub("", text)  # 移除非ASCII字符
+                    # 这样得到的回复丢掉了中文内容，不算正常解析
+                    return fastjson.loads(clean_text), False
                 except:
                     # 如果仍然无法解析，将其视为纯文本响应
                     # 这种情况通常发生在LLM没有遵循格式要求时
-                    return {
-                        "monologue": "LLM返回了纯文本响应，自动包装为JSON格式",
-                        "action": "reply",
-                        "args": "",
-                        "response": text
-                    }
+                    return _wrap_plain_text(text), False
     
     # 如果不包含JSON，将纯文本包装为预期的JSON格式
     # 这可以减少不必要的JSON解析失败警告
-    return {
-        "monologue": "LLM返回了纯文本响应，自动包装为JSON格式",
-        "action": "reply",
-        "args": "",
-        "response": text
-    }
+    return _wrap_plain_text(text), False
+
+
+def _count_expression_features(text: str) -> tuple:
+    """
+    单次遍历统计用户消息的表达特征
+    :return: (表情符号数, 标点数, 问号数, 感叹号数, 重复字符段数)；
+             "[表情]" 占位符计为一个表情，连续3个及以上相同字符（换行除外）计为一段重复
+    """
+    emoji_count = text.count("[表情]")
+    punctuation_count = question_count = exclamation_count = repeat_count = 0
+    prev = None
+    run = 0
+    for ch in text:
+        if _EMOJI_LOW <= ord(ch) <= _EMOJI_HIGH:
+            emoji_count += 1
+        elif ch in _PUNCT_SET:
+            punctuation_count += 1
+            if ch in _Q_SET:
+                question_count += 1
+            elif ch in _EX_SET:
+                exclamation_count += 1
+
+        if ch == prev and ch != "\n":
+            run += 1
+            if run == 3:
+                repeat_count += 1
+        else:
+            prev = ch
+            run = 1
+    return emoji_count, punctuation_count, question_count, exclamation_count, repeat_count
+
+
+def _sticker_short_circuit(msgs: list, recent5_msgs: list, last_human_content: str, ts: str) -> Optional[dict]:
+    """
+    纯表情包消息的短路处理：清洗后没有实质文字时直接回复表情包/表情符号或保持沉默，不调用 LLM
+    :return: 短路时返回节点输出，消息带有实质文字时返回 None，继续走完整的 LLM 流程
+    """
+    # 🚀 [核心修复 1] 增强清洗逻辑
+    # 1. 移除可能存在的 [用户名]: 前缀 (非贪婪匹配)
+    # 2. 移除 [图片], [表情] 占位符
+    # 3. 移除空格
+
+    if len(last_human_content) < 2 or last_human_content in _PURE_STICKER_LITERALS:
+        # 纯占位符或极短内容，清洗后必然为空或不足2个字符，无需走正则
+        temp_text = last_human_content
+        clean_text = ""
+    else:
+        # 临时变量，先去掉用户名开头
+        # 匹配模式：行首 + [任意字符] + 冒号 + 可选空格
+        temp_text = _USER_PREFIX_RE.sub("", last_human_content)
+
+        clean_text = temp_text
+        for tok in _STICKER_STRIP_TOKENS:
+            clean_text = clean_text.replace(tok, "")
+        clean_text = clean_text.strip()
+
+    logger.debug("[%s]🕵️ [Debug] Sticker Check -> Raw: '%s' | Removed Prefix: '%s' | Final Cleaned: '%s'", ts, last_human_content, temp_text, clean_text)
+
+    if len(clean_text) < 2:
+        logger.info("[%s] 🛑 [Alice Core] Detected PURE STICKER. Skipping LLM.", ts)
+
+        # 使用用户存储的表情包回复
+        # 只抽一次随机数：r < _REPLY_PROB 决定是否回复，r / _REPLY_PROB 在 [0, 1) 内均匀，复用来挑默认表情
+        r = _RNG.random()
+        if r < _REPLY_PROB:
+            try:
+                emoji_service = get_emoji_service()
+                if emoji_service:
+                    # 使用emoji_service选择匹配的表情包
+                    context = {
+                        "last_message": last_human_content,
+                        "message_history": recent5_msgs
+                    }
+                    selected_emojis = emoji_service.get_emoji_for_context(context, count=1)
+                    if selected_emojis:
+                        selected_emoji = selected_emojis[0]
+                        logger.info("[%s]🎲 [Short-Circuit] Reply with saved emoji: %s", ts, selected_emoji.emoji_hash)
+                        return {
+                            "internal_monologue": "Sticker acknowledged with saved emoji.",
+                            "messages": msgs + [AIMessage(content=""), AIMessage(content=f"[CQ:image,file=file:///{selected_emoji.file_path}]")],
+                            "last_interaction_ts": time.time(),
+                            "next_step": "save",
+                            "emoji_reply": selected_emoji.file_path
+                        }
+            except Exception as e:
+                logger.error(f"[{ts}]❌ [Emoji Reply Error] {e}")
+            
+            # 如果没有可用的表情包，使用默认表情符号
+            reply = _STICKER_REPLIES[int(r / _REPLY_PROB * len(_STICKER_REPLIES))]
+            logger.info("[%s]🎲 [Short-Circuit] Reply: %s", ts, reply)
+            return {
+                "internal_monologue": "Sticker acknowledged.",
+                "messages": msgs + [AIMessage(content=reply)],
+                "last_interaction_ts": time.time(),
+                "next_step": "save"
+            }
+        else:
+            logger.info("[%s] 🤐 [Short-Circuit] Silent.", ts)
+            return {
+                "internal_monologue": "Sticker ignored.",
+                "messages": msgs,
+                "last_interaction_ts": time.time(),
+                "next_step": "save"
+            }
+
+    return None
 
 
 async def agent_node(state: AgentState):
-    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    logger.info(f"[{ts}]--- [Alice Core] Processing... ---")
+    ts = log_ts()
+    logger.info("[%s]--- [Alice Core] Processing... ---", ts)
 
     # 检查是否有短路回复信息
     short_circuit_emoji = state.get("short_circuit_emoji")
@@ -115,7 +421,7 @@ async def agent_node(state: AgentState):
     
     # 处理短路回复表情包
     if short_circuit_emoji:
-        logger.info(f"[{ts}]🚀 [Alice Core] 收到短路回复指令，直接回复表情包")
+        logger.info("[%s]🚀 [Alice Core] 收到短路回复指令，直接回复表情包", ts)
         return {
             "internal_monologue": "Short circuit: reply with emoji",
             "messages": state.get("messages", []) + [AIMessage(content=""), AIMessage(content=f"[CQ:image,file=file:///{short_circuit_emoji}]")],
@@ -126,7 +432,7 @@ async def agent_node(state: AgentState):
     
     # 处理短路回复默认表情符号
     if short_circuit_text:
-        logger.info(f"[{ts}]🚀 [Alice Core] 收到短路回复指令，直接回复表情符号")
+        logger.info("[%s]🚀 [Alice Core] 收到短路回复指令，直接回复表情符号", ts)
         return {
             "internal_monologue": "Short circuit: reply with emoji",
             "messages": state.get("messages", []) + [AIMessage(content=short_circuit_text)],
@@ -137,81 +443,29 @@ async def agent_node(state: AgentState):
     msgs = state.get("messages", [])
     image_data = state.get("current_image_artifact")
     visual_type = state.get("visual_type", "none")
+    # 最近的历史只切片一次：最近10条用于构造 LLM 输入，最近5条用于检索和表情包上下文
+    recent_msgs = msgs[-10:]
+    recent5_msgs = recent_msgs[-5:]
 
-    # 提取最近一条消息文本
+    # 提取最近一条消息文本（先在最近10条中找，找不到再回溯更早的历史）
     last_human_content = ""
-    if msgs:
-        for m in reversed(msgs):
-            if isinstance(m, HumanMessage):
-                content = m.content
-                if isinstance(content, list):
-                    content = next((x['text'] for x in content if x['type'] == 'text'), "")
-                last_human_content = str(content).strip()
-                break
+    last_human = next((m for m in reversed(recent_msgs) if isinstance(m, HumanMessage)), None)
+    if last_human is None and len(msgs) > len(recent_msgs):
+        last_human = next((m for m in islice(reversed(msgs), len(recent_msgs), None) if isinstance(m, HumanMessage)), None)
+    if last_human is not None:
+        content = last_human.content
+        if isinstance(content, list):
+            content = next((x['text'] for x in content if x['type'] == 'text'), "")
+        last_human_content = str(content).strip()
 
     # =========================================================================
     # 🛡️ 第一道防线：短路拦截 (Short-Circuit)
     # =========================================================================
-    # 如果已经有短路回复指令，则跳过内部短路拦截逻辑
-    if visual_type == "sticker" and not (short_circuit_emoji or short_circuit_text):
-        # 🚀 [核心修复 1] 增强清洗逻辑
-        # 1. 移除可能存在的 [用户名]: 前缀 (非贪婪匹配)
-        # 2. 移除 [图片], [表情] 占位符
-        # 3. 移除空格
-
-        # 临时变量，先去掉用户名开头
-        # 匹配模式：行首 + [任意字符] + 冒号 + 可选空格
-        temp_text = re.sub(r"^\[.*?\]:\s*", "", last_human_content)
-
-        clean_text = temp_text.replace("[图片]", "").replace("[表情]", "").replace(" ", "").strip()
-
-        logger.debug(f"[{ts}]🕵️ [Debug] Sticker Check -> Raw: '{last_human_content}' | Removed Prefix: '{temp_text}' | Final Cleaned: '{clean_text}'")
-
-        if len(clean_text) < 2:
-            logger.info(f"[{ts}] 🛑 [Alice Core] Detected PURE STICKER. Skipping LLM.")
-
-            # 使用用户存储的表情包回复
-            if random.random() < 0.6:
-                try:
-                    emoji_service = get_emoji_service()
-                    if emoji_service:
-                        # 使用emoji_service选择匹配的表情包
-                        context = {
-                            "last_message": last_human_content,
-                            "message_history": msgs[-5:]
-                        }
-                        selected_emojis = emoji_service.get_emoji_for_context(context, count=1)
-                        if selected_emojis:
-                            selected_emoji = selected_emojis[0]
-                            logger.info(f"[{ts}]🎲 [Short-Circuit] Reply with saved emoji: {selected_emoji.emoji_hash}")
-                            return {
-                                "internal_monologue": "Sticker acknowledged with saved emoji.",
-                                "messages": msgs + [AIMessage(content=""), AIMessage(content=f"[CQ:image,file=file:///{selected_emoji.file_path}]")],
-                                "last_interaction_ts": time.time(),
-                                "next_step": "save",
-                                "emoji_reply": selected_emoji.file_path
-                            }
-                except Exception as e:
-                    logger.error(f"[{ts}]❌ [Emoji Reply Error] {e}")
-                
-                # 如果没有可用的表情包，使用默认表情符号
-                replies = ["🐶", "🐱", "💖", "💕", "💝", "🤗", "👻", "👽"]
-                reply = random.choice(replies)
-                logger.info(f"[{ts}]🎲 [Short-Circuit] Reply: {reply}")
-                return {
-                    "internal_monologue": "Sticker acknowledged.",
-                    "messages": msgs + [AIMessage(content=reply)],
-                    "last_interaction_ts": time.time(),
-                    "next_step": "save"
-                }
-            else:
-                logger.info(f"[{ts}] 🤐 [Short-Circuit] Silent.")
-                return {
-                    "internal_monologue": "Sticker ignored.",
-                    "messages": msgs,
-                    "last_interaction_ts": time.time(),
-                    "next_step": "save"
-                }
+    # 纯表情包只需最近一条用户消息即可判定，命中时直接返回，跳过记忆检索和 Prompt 构造
+    if visual_type == "sticker":
+        short_circuit_result = _sticker_short_circuit(msgs, recent5_msgs, last_human_content, ts)
+        if short_circuit_result is not None:
+            return short_circuit_result
 
     # =========================================================================
     # 🧠 LLM 处理 (Photo 或 带有文字的 Sticker)
@@ -220,27 +474,32 @@ async def agent_node(state: AgentState):
     psych_ctx = state.get("psychological_context", {})
     real_user_id = state.get("sender_qq", "unknown")
     user_display_name = state.get("sender_name", "User")
-    now_str = datetime.now().strftime("%Y-%m-%d %H:%M")
+    now_str = now_minute_str()
+
+    # 用户档案查询、记忆点查询与记忆检索互不依赖，提前发起，在读取记忆点和表达习惯时再等待结果
+    # get_random_memory_points 是同步的数据库查询，放到线程中执行，避免阻塞事件循环
+    profile_task = asyncio.create_task(relation_db.get_user_profile(real_user_id))
+    points_task = asyncio.create_task(asyncio.to_thread(relation_db.get_random_memory_points, real_user_id, num=3))
 
     # 智能记忆检索 (替换传统RAG)
     memory_context = ""
+    query_text = ""
+    # 清洗后用户消息的嵌入向量，按需生成一次，回退检索与语义缓存共用
+    query_embedding = None
     try:
         # 清洗文本，移除表情包描述和其他无关信息
-        query_text = re.sub(r"^\[.*?\]:\s*", "", last_human_content)
-        query_text = re.sub(r"【表情包:.*?】", "", query_text)
-        query_text = query_text.replace("[图片]", "").strip()
+        query_text = _QUERY_CLEAN_RE.sub("", _USER_PREFIX_RE.sub("", last_human_content)).strip()
         if len(query_text) > 4:
 
             
             # 使用全局记忆管理器实例
             
             # 构建聊天历史字符串
-            chat_history_str = ""
-            for msg in msgs[-5:]:  # 使用最近5条消息作为上下文
-                if hasattr(msg, 'content'):
-                    if isinstance(msg.content, str):
-                        role = "AI" if hasattr(msg, 'type') and msg.type == "ai" else "User"
-                        chat_history_str += f"[{role}]: {msg.content}\n"
+            chat_history_str = "".join(
+                _history_line(getattr(msg, 'type', None) == 'ai', msg.content)
+                for msg in recent5_msgs  # 使用最近5条消息作为上下文
+                if isinstance(getattr(msg, 'content', None), str)
+            )
             
             # 执行智能记忆检索
             retrieval_result = await memory_manager.smart_retrieve(
@@ -251,11 +510,11 @@ async def agent_node(state: AgentState):
             )
             
             if retrieval_result["has_relevant_memory"]:
-                logger.info(f"[{ts}] 📖 [Smart RAG] Found relevant memories")
-                logger.info(f"[{ts}] 📖 [Smart RAG] Retrieved memory content: {retrieval_result['memory_content']}")
-                memory_context = f"【相关回忆】\n" + retrieval_result["memory_content"]
+                logger.info("[%s] 📖 [Smart RAG] Found relevant memories", ts)
+                logger.info("[%s] 📖 [Smart RAG] Retrieved memory content: %s", ts, retrieval_result['memory_content'])
+                memory_context = _RELATED_MEMORY_HEADER + retrieval_result["memory_content"]
             else:
-                logger.info(f"[{ts}] 📖 [Smart RAG] No relevant memories found, skipping Fallback RAG to reduce API calls")
+                logger.info("[%s] 📖 [Smart RAG] No relevant memories found, skipping Fallback RAG to reduce API calls", ts)
                 # 优化：不再回退到传统RAG检索，减少API调用次数
                 # 这样可以避免额外的3次API调用（智能记忆检索已经使用了综合查询）
                 memory_context = ""
@@ -263,20 +522,17 @@ async def agent_node(state: AgentState):
         logger.error(f"[{ts}] [Smart RAG Error] {e}")
         # 异常情况下回退到传统RAG检索
         try:
-            logger.info(f"[{ts}] 📖 [Exception RAG] Falling back to traditional retrieval due to Smart RAG error")
-            docs = await vector_db.search(query_text, k=3)
-            logger.info(f"[{ts}] 📖 [Exception RAG] Retrieved {len(docs) if docs else 0} documents")
+            logger.info("[%s] 📖 [Exception RAG] Falling back to traditional retrieval due to Smart RAG error", ts)
+            query_embedding = await vector_db.embed_query(query_text)
+            docs = await vector_db.search(query_text, k=3, query_embedding=query_embedding)
+            logger.info("[%s] 📖 [Exception RAG] Retrieved %s documents", ts, len(docs) if docs else 0)
             if docs:
-                logger.info(f"[{ts}] 📖 [Exception RAG] Raw documents: {docs}")
-                filtered_docs = []
-                for doc in docs:
-                    filtered_doc = re.sub(r"【表情包:.*?】", "", doc)
-                    if filtered_doc.strip():
-                        filtered_docs.append(filtered_doc.strip())
-                logger.info(f"[{ts}] 📖 [Exception RAG] Filtered to {len(filtered_docs)} documents")
+                logger.info("[%s] 📖 [Exception RAG] Raw documents: %s", ts, docs)
+                filtered_docs = _filter_rag_docs(docs)
+                logger.info("[%s] 📖 [Exception RAG] Filtered to %s documents", ts, len(filtered_docs))
                 if filtered_docs:
-                    logger.info(f"[{ts}] 📖 [Exception RAG] Final filtered documents: {filtered_docs}")
-                    memory_context = f"【相关回忆】\n" + "\n".join(filtered_docs)
+                    logger.info("[%s] 📖 [Exception RAG] Final filtered documents: %s", ts, filtered_docs)
+                    memory_context = _RELATED_MEMORY_HEADER + "\n".join(filtered_docs)
         except Exception as fallback_e:
             logger.error(f"[{ts}] [Fallback RAG Error] {fallback_e}")
         pass
@@ -284,29 +540,37 @@ async def agent_node(state: AgentState):
     # 获取用户记忆点和表达习惯
     user_memory_points = ""
     user_expression_habits = ""
+    # 两个查询一起等待，任一失败都不影响另一个的结果，也不会留下未读取的任务异常
+    random_memory_points, db_profile = await asyncio.gather(points_task, profile_task, return_exceptions=True)
+    
+    # 获取用户随机记忆点
     try:
-        # 获取用户随机记忆点
-        random_memory_points = relation_db.get_random_memory_points(real_user_id, num=3)
+        if isinstance(random_memory_points, BaseException):
+            raise random_memory_points
         if random_memory_points:
             memory_content = []
             for mp in random_memory_points:
-                parts = mp.split(":")
+                # 只需要前两段，限制切分次数
+                parts = mp.split(":", 2)
                 if len(parts) >= 3:
                     category = parts[0]
                     content = parts[1]
                     memory_content.append(f"{category}: {content}")
             if memory_content:
                 user_memory_points = f"【用户记忆点】\n" + "\n".join(memory_content)
-        
-        # 获取用户表达习惯
-        db_profile = await relation_db.get_user_profile(real_user_id)
+    except Exception as e:
+        logger.error(f"[{ts}] [User Memory Error] {e}")
+    
+    # 获取用户表达习惯
+    try:
+        if isinstance(db_profile, BaseException):
+            raise db_profile
         if db_profile and db_profile.relationship.expression_habits:
             expression_habits = db_profile.relationship.expression_habits[:5]  # 最多取5个习惯
             if expression_habits:
                 user_expression_habits = f"【用户表达习惯】\n" + "\n".join(expression_habits)
     except Exception as e:
-        logger.error(f"[{ts}] [User Memory Error] {e}")
-        pass
+        logger.error(f"[{ts}] [User Profile Error] {e}")
     
     # 合并记忆上下文
     if user_memory_points:
@@ -321,51 +585,6 @@ async def agent_node(state: AgentState):
     elif visual_type == "sticker":
         vision_summary_text = "【视觉信号：用户发送了一个表情包/Sticker】"
 
-    # 构造 Prompt
-    format_instruction = """
-    # 强制响应格式要求 - 必须严格遵守
-    YOU MUST OUTPUT A VALID JSON OBJECT ONLY. NO OTHER TEXT OR EXPLANATION ALLOWED.
-    YOU WILL BE PUNISHED SEVERELY IF YOU FAIL TO FOLLOW THIS INSTRUCTION.
-    
-    Response Format:
-    {
-      "monologue": "你的内部思考过程",
-      "action": "reply",
-      "args": "",
-      "response": "要发送给用户的回复内容"
-    }
-    
-    # 重要说明：
-    1. 必须包含所有四个字段：monologue, action, args, response
-    2. action字段只能是"reply"
-    3. response字段不能为空
-    4. 所有字段值必须用双引号包围
-    5. 不能有任何多余的文本，包括Markdown格式、注释等
-    6. 必须是有效的JSON格式
-    
-    # 错误示例（会被惩罚）：
-    - 哦，这是一个很好的问题！{"response": "好的，我会帮助你"}
-    - ```json {"response": "你好"} ```
-    - {"response": "你好"} （缺少必要字段）
-    - {'response': '你好'} （使用单引号）
-    
-    # 正确示例（必须严格按照此格式）：
-    {"monologue": "用户问我喜欢什么颜色，我应该回答蓝色", "action": "reply", "args": "", "response": "我喜欢蓝色"}
-    """
-
-    # 增强表达习惯指令
-    expression_habits_instruction = ""
-    if user_expression_habits:
-        expression_habits_instruction = """
-### 表达习惯模仿要求 (CRITICAL)
-仔细分析用户的表达习惯，在回复中自然地融入这些习惯：
-1. **用词模仿**: 使用用户常用的词汇、短语和表达方式
-2. **句式模仿**: 模仿用户的句子结构和长度
-3. **语气模仿**: 匹配用户的语气（比如用户喜欢用感叹号，你也可以适当使用）
-4. **习惯表达**: 自然地使用用户的习惯用语和口头禅
-5. **避免冲突**: 如果用户的表达习惯与Alice的核心性格有冲突，优先保持Alice的核心性格，但可以适当调整表达风格
-        """
-
     # 获取情绪和关系数据
     emotion_snapshot = state.get("global_emotion_snapshot", {})
     primary_emotion = psych_ctx.get("primary_emotion", emotion_snapshot.get("primary_emotion", "平淡"))
@@ -380,29 +599,7 @@ async def agent_node(state: AgentState):
     interest_match = psych_ctx.get("current_interest_match", 50)
     
     # 生成关系描述
-    if intimacy < 20:
-        relation_desc = "陌生人"
-    elif intimacy < 40:
-        relation_desc = "认识的人"
-    elif intimacy < 60:
-        if familiarity > 70:
-            relation_desc = "熟悉的朋友"
-        elif trust > 70:
-            relation_desc = "值得信任的朋友"
-        else:
-            relation_desc = "普通的朋友"
-    elif intimacy < 80:
-        if familiarity > 80 and trust > 80:
-            relation_desc = "亲密的朋友"
-        elif interest_match > 80:
-            relation_desc = "志同道合的朋友"
-        else:
-            relation_desc = "值得信赖的朋友"
-    else:
-        if familiarity > 90 and trust > 90:
-            relation_desc = "最亲密的朋友"
-        else:
-            relation_desc = "非常要好的朋友"
+    relation_desc = describe_relation(intimacy, familiarity, trust, interest_match)
 
     # 计算次要心情显示内容
     secondary_emotion_message = f" + 次要心情: {secondary_emotion}" if secondary_emotion else ""
@@ -417,12 +614,8 @@ async def agent_node(state: AgentState):
             memory_context = parts[0].strip()
             expression_habits_text = "【用户表达习惯】" + parts[1].strip()
     
-    # 将增强的表达习惯指令插入到系统提示中
-    modified_agent_prompt = AGENT_SYSTEM_PROMPT
-    if expression_habits_instruction:
-        # 找到插入位置（在用户表达习惯部分之后）
-        insert_pos = modified_agent_prompt.find("{user_expression_habits}") + len("{user_expression_habits}")
-        modified_agent_prompt = modified_agent_prompt[:insert_pos] + "\n" + expression_habits_instruction + modified_agent_prompt[insert_pos:]
+    # 有用户表达习惯时使用插入了表达习惯模仿要求的系统提示
+    modified_agent_prompt = _AGENT_PROMPT_WITH_HABITS if user_expression_habits else AGENT_SYSTEM_PROMPT
     
     # 获取情绪和关系信息
     primary_emotion = state.get("primary_emotion", "平静")
@@ -430,14 +623,7 @@ async def agent_node(state: AgentState):
     familiarity = state.get("familiarity", 0)
     
     # 根据亲密度和熟悉度确定关系类型
-    if intimacy > 70 and familiarity > 70:
-        relation = "好朋友"
-    elif intimacy > 40 and familiarity > 40:
-        relation = "普通朋友"
-    elif intimacy > 10 and familiarity > 10:
-        relation = "熟人"
-    else:
-        relation = "陌生人"
+    relation = persona_relation(intimacy, familiarity)
     
     # 构建包含扩展人设和说话风格的完整core_persona
     scene = "private" if "private" in str(state.get("session_id", "")) else "group"
@@ -463,29 +649,11 @@ async def agent_node(state: AgentState):
         relation_desc=relation_desc,
         memories=memory_context,
         user_expression_habits=expression_habits_text
-    ) + "\n\n" + format_instruction
+    ) + "\n\n" + _FORMAT_INSTRUCTION
 
     input_messages = [SystemMessage(content=final_system_prompt)]
-    if len(msgs) > 0:
-        # 过滤并清理历史消息，忽略表情包信息的影响
-        cleaned_msgs = []
-        for msg in msgs[-10:]:
-            if isinstance(msg, HumanMessage):
-                # 清理用户消息中的表情包描述
-                content = msg.content
-                if isinstance(content, str):
-                    # 移除表情包描述
-                    content = re.sub(r"【表情包:.*?】", "", content)
-                    # 如果清理后内容为空，跳过这条消息
-                    if content.strip():
-                        cleaned_msg = HumanMessage(content=content.strip())
-                        cleaned_msg.additional_kwargs = msg.additional_kwargs.copy()
-                        cleaned_msgs.append(cleaned_msg)
-                else:
-                    cleaned_msgs.append(msg)
-            else:
-                cleaned_msgs.append(msg)
-        input_messages.extend(cleaned_msgs)
+    # 过滤并清理历史消息，忽略表情包信息的影响（只取最近10条）
+    input_messages.extend(_clean_history(recent_msgs))
 
     # 注入图片数据 (仅限 photo)
     all_image_artifacts = state.get("all_image_artifacts", [])
@@ -493,35 +661,41 @@ async def agent_node(state: AgentState):
         if all_image_artifacts:
             # 处理多张图片
             image_content = []
-            for i, image_artifact in enumerate(all_image_artifacts):
+            for image_artifact in all_image_artifacts:
                 if image_artifact["type"] == "photo" and image_artifact["data"]:
-                    image_content.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_artifact['data']}"}})
+                    data_url = image_artifact.get("data_url") or f"data:image/jpeg;base64,{image_artifact['data']}"
+                    image_content.append({"type": "image_url", "image_url": {"url": data_url}})
             
             if image_content:
                 # 添加图片附言
                 image_content.append({"type": "text", "text": "（系统附言：这是用户发的图片，请结合回答。）"})
                 input_messages.append(HumanMessage(content=image_content))
         elif image_data:
-            # 兼容旧的单张图片逻辑
+            # 兼容旧的单张图片逻辑，优先使用感知阶段生成的 data URL
+            data_url = state.get("current_image_data_url") or f"data:image/jpeg;base64,{image_data}"
             input_messages.append(HumanMessage(content=[
-                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_data}"}},
+                {"type": "image_url", "image_url": {"url": data_url}},
                 {"type": "text", "text": "（系统附言：这是用户发的图片，请结合回答。）"}
             ]))
 
     # 🚀 [核心修复 2] Sticker 兜底指令
     # 即使短路逻辑被绕过（比如用户说了"哈哈" + 表情包），也要防止 LLM 幻视分析图片
     if visual_type == "sticker":
-        logger.info(f"[{ts}] 🎭 [Alice Core] Injecting STICKER SAFEGUARD.")
-        safeguard = (
-            "【系统强制指令】\n"
-            "用户最后发送的是一个【表情包/Sticker】（代码中可能显示为'[图片]'）。\n"
-            "1. 这是一个非信息性的表情符号，**绝对不要**询问'这是什么图片'或'图片里有什么'。\n"
-            "2. 请将其视为一种情绪表达，仅对用户的文字内容（若有）进行回复，或回以简单互动。\n"
-        )
-        input_messages.append(SystemMessage(content=safeguard))
+        logger.info("[%s] 🎭 [Alice Core] Injecting STICKER SAFEGUARD.", ts)
+        input_messages.append(_STICKER_SAFEGUARD_MSG)
 
     # 调用 LLM
     parsed = {"action": "reply", "response": "..."}
+    # 表情包选择只依赖用户消息和近期历史，与 LLM 调用并行进行
+    # 亲密度>50 时才大概率需要表情包，其余情况仍在需要时再同步选择
+    emoji_context = {
+        "last_message": last_human_content,
+        "message_history": recent5_msgs
+    }
+    emoji_task = None
+    emoji_service = get_emoji_service()
+    if emoji_service and intimacy > 50:
+        emoji_task = asyncio.create_task(asyncio.to_thread(emoji_service.get_emoji_for_context, emoji_context, 1))
     try:
         # 自动判断对话类型
         conversation_type = "group" if "group" in str(state.get("session_id", "")) else "private"
@@ -532,28 +706,9 @@ async def agent_node(state: AgentState):
         
         # 根据情绪调整温度参数
         # 情绪越强烈，温度越高，回复越有变化；情绪越平静，温度越低，回复越稳定
-        emotion_to_temperature = {
-            "兴高采烈": 0.9,
-            "开心": 0.8,
-            "愉快": 0.7,
-            "惬意": 0.6,
-            "放松": 0.5,
-            "平静": 0.4,
-            "困倦/发呆": 0.3,
-            "恍惚": 0.3,
-            "低落": 0.5,
-            "沮丧": 0.6,
-            "烦躁": 0.7,
-            "愤怒": 0.8,
-            "暴怒": 0.9,
-            "疲惫": 0.3,
-            "疲惫不堪": 0.2,
-            "压力山大": 0.7,
-            "焦虑不安": 0.8
-        }
         
         # 获取情绪对应的温度，默认使用原来的温度
-        adjusted_temperature = emotion_to_temperature.get(current_emotion, llm.temperature)
+        adjusted_temperature = _EMOTION_TO_TEMPERATURE.get(current_emotion, llm.temperature)
         
         # 根据疲劳和压力调整回复长度倾向
         # 越疲惫/压力越大，越倾向于短回复
@@ -582,33 +737,58 @@ async def agent_node(state: AgentState):
                     input_messages[i] = SystemMessage(content=msg.content + response_length_instruction)
                     break
         
-        response = await cached_llm_invoke(
-            llm, 
-            input_messages, 
-            temperature=adjusted_temperature,
-            conversation_type=conversation_type
-        )
-        # 处理response可能是字符串的情况
-        if isinstance(response, str):
-            content = response.strip()
+        # 语义缓存：同一用户在相同情绪下发来语义相近的消息时，直接复用上次的回复
+        # 图片内容不在嵌入里，带图片的消息不参与
+        semantic_key = None
+        cached_parsed = None
+        if config.SEMANTIC_CACHE_ENABLED and query_text and not (image_data and visual_type == "photo"):
+            semantic_key = (conversation_type, real_user_id, current_emotion)
+            try:
+                if not query_embedding:
+                    query_embedding = await vector_db.embed_query(query_text)
+                cached_parsed = semantic_prompt_cache.get(semantic_key, query_embedding)
+            except Exception as e:
+                logger.warning(f"[{ts}] ⚠️ [Semantic Cache] Lookup failed: {e}")
+                semantic_key = None
+
+        if cached_parsed is not None:
+            logger.info("[%s] ♻️ [Semantic Cache] Hit, reusing cached reply", ts)
+            # 下游会改写 response 字段，复制一份避免污染缓存
+            parsed = dict(cached_parsed)
         else:
-            content = response.content.strip()
+            response = await cached_llm_invoke(
+                llm, 
+                input_messages, 
+                temperature=adjusted_temperature,
+                conversation_type=conversation_type
+            )
+            # 处理response可能是字符串的情况
+            if isinstance(response, str):
+                content = response.strip()
+            else:
+                content = response.content.strip()
 
-        parsed_result = robust_json_parse(content)
+            parsed_result, parsed_ok = robust_json_parse(content)
 
-        if parsed_result:
-            parsed = parsed_result
-        else:
-            # 这种情况理论上不应该发生，因为robust_json_parse现在总是返回一个有效的JSON对象
-            logger.error(f"[{ts}] ❌ [Agent JSON Parse Fatal Error] Raw: {content[:50]}...")
-            parsed = {"monologue": "JSON Parse Fatal Error", "action": "reply", "response": "Someone tells Aslishyi there is a problem with his Alice."}
+            if parsed_result:
+                parsed = parsed_result
+            else:
+                # 这种情况理论上不应该发生，因为robust_json_parse现在总是返回一个有效的JSON对象
+                logger.error(f"[{ts}] ❌ [Agent JSON Parse Fatal Error] Raw: {content[:50]}...")
+                parsed = {"monologue": "JSON Parse Fatal Error", "action": "reply", "response": "Someone tells Aslishyi there is a problem with his Alice."}
+
+            # 只缓存正常解析出的普通回复（纯文本包装或删字修复的结果不缓存）；工具调用依赖实时状态，出现时清空该键下的缓存
+            if semantic_key is not None and query_embedding and parsed_ok:
+                if parsed.get("action") == "reply":
+                    semantic_prompt_cache.add(semantic_key, query_embedding, dict(parsed))
+                else:
+                    semantic_prompt_cache.invalidate(semantic_key)
         
         # 智能添加表情包到回复中
         if parsed.get("action") == "reply":
             response_content = parsed.get("response", "")
             if response_content and len(response_content.strip()) > 0:
                 try:
-                    emoji_service = get_emoji_service()
                     if emoji_service:
                         # 基于心理分析和对话情感来选择表情包
                         # 使用主要情感作为搜索关键词
@@ -618,58 +798,28 @@ async def agent_node(state: AgentState):
                         
                         # 根据对话类型和亲密程度调整表情包使用策略
                         conversation_type = "group" if "group" in str(state.get("session_id", "")) else "private"
-                        emoji_count = 0
-                        
                         # 根据不同场景决定是否使用表情包
                         # 结合对话类型、情感强度、亲密程度和回复长度综合判断
-                        emotion_intensity = abs(valence) + abs(arousal)
-                        response_length = len(response_content)
+                        emoji_count = _decide_emoji_count(
+                            abs(valence) + abs(arousal), intimacy, len(response_content), conversation_type == "group"
+                        )
                         
-                        # 检查是否连续使用了表情包
-                        consecutive_emoji = False
-                        if msgs and len(msgs) > 1:
+                        # 避免连续使用表情包（只在准备发送表情包时才回溯历史）
+                        if emoji_count > 0 and len(msgs) > 1:
                             # 检查上一条机器人回复是否包含表情包
-                            last_bot_msg = next((msg for msg in reversed(msgs[:-1]) if hasattr(msg, "role") and msg.role == "assistant"), None)
+                            last_bot_msg = next((msg for msg in islice(reversed(msgs), 1, None) if hasattr(msg, "role") and msg.role == "assistant"), None)
                             if last_bot_msg and hasattr(last_bot_msg, "content") and "[表情:" in last_bot_msg.content:
-                                consecutive_emoji = True
-                        
-                        if conversation_type == "group":
-                            # 群聊中更谨慎地使用表情包
-                            if intimacy > 50:  # 与用户有一定关系
-                                # 情感强烈或回复较短时更可能发送表情
-                                if ((emotion_intensity > 0.6 and random.random() < 0.3) or \
-                                   (emotion_intensity > 0.9 and random.random() < 0.5)):
-                                    emoji_count = 1
-                        else:
-                            # 私聊中更自然地使用表情包，但降低频率
-                            if intimacy > 50:  # 提高亲密程度阈值
-                                # 情感适中以上且随机概率，降低概率值
-                                if ((emotion_intensity > 0.4 and random.random() < 0.3) or \
-                                   (emotion_intensity > 0.8 and random.random() < 0.6)):
-                                    emoji_count = 1
-                        
-                        # 回复内容过短或过长时调整概率
-                        if response_length < 10:
-                            # 短回复时更谨慎发送表情
-                            emoji_count = 0 if random.random() < 0.7 else emoji_count
-                        elif response_length > 100:
-                            # 长回复时更可能发送表情来缓解阅读压力，但降低概率
-                            emoji_count = 1 if random.random() < 0.2 else emoji_count
-                        
-                        # 避免连续使用表情包
-                        if consecutive_emoji and emoji_count > 0:
-                            emoji_count = 0 if random.random() < 0.8 else emoji_count
+                                emoji_count = 0 if _RNG.random() < 0.8 else emoji_count
                         
                         if emoji_count > 0:
-                            # 从对话历史中提取上下文信息
-                            context = {
-                                "last_message": last_human_content,
-                                "message_history": msgs[-5:]
-                            }
-                            # 使用emoji_service根据上下文选择表情包
-                            matching_emojis = emoji_service.get_emoji_for_context(context, count=1)
+                            # 使用emoji_service根据上下文选择表情包（已提前发起的直接取结果）
+                            if emoji_task is not None:
+                                matching_emojis = await emoji_task
+                                emoji_task = None
+                            else:
+                                matching_emojis = emoji_service.get_emoji_for_context(emoji_context, count=1)
                             if matching_emojis:
-                                logger.info(f"[{ts}] 😊 [Emoji] 为回复添加匹配表情包: {text_emotion} -> {matching_emojis[0].emotions}")
+                                logger.info("[%s] 😊 [Emoji] 为回复添加匹配表情包: %s -> %s", ts, text_emotion, matching_emojis[0].emotions)
                                 # 在回复内容末尾添加表情包引用
                                 # 同时保存表情包信息，供后续分开发送使用
                                 parsed["response"] = f"{response_content} [表情: {matching_emojis[0].emoji_hash}]"
@@ -678,6 +828,10 @@ async def agent_node(state: AgentState):
                     logger.error(f"[{ts}] ❌ [Emoji] 添加表情包失败: {e}")
     except Exception as e:
         logger.error(f"[{ts}]❌ [Agent LLM Error] {e}")
+    finally:
+        # 最终没有用到的表情包选择结果直接丢弃
+        if emoji_task is not None:
+            emoji_task.cancel()
 
     # 记录用户表达习惯和重要信息
     try:
@@ -686,30 +840,9 @@ async def agent_node(state: AgentState):
             # 计算消息长度特征
             msg_length = len(last_human_content)
             
-            # 表情符号分析
-            emoji_pattern = re.compile(r'[\u2600-\u27BF]|\[表情\]')
-            emojis = emoji_pattern.findall(last_human_content)
-            emoji_count = len(emojis)
-            
-            # 标点符号分析
-            punctuation_pattern = re.compile(r'[!！?？。，、；：…]')
-            punctuations = punctuation_pattern.findall(last_human_content)
-            punctuation_count = len(punctuations)
-            
-            # 问句分析
-            question_pattern = re.compile(r'[?？]')
-            questions = question_pattern.findall(last_human_content)
-            question_count = len(questions)
-            
-            # 感叹句分析
-            exclamation_pattern = re.compile(r'[!！]')
-            exclamations = exclamation_pattern.findall(last_human_content)
-            exclamation_count = len(exclamations)
-            
-            # 重复字符分析
-            repeat_pattern = re.compile(r'(.)\1{2,}')
-            repeats = repeat_pattern.findall(last_human_content)
-            repeat_count = len(repeats)
+            # 表情符号、标点、问句、感叹句、重复字符统计
+            emoji_count, punctuation_count, question_count, exclamation_count, repeat_count = \
+                _count_expression_features(last_human_content)
             
             # 记录表达习惯（基于使用频率和上下文）
             # 表情符号使用习惯
@@ -753,36 +886,20 @@ async def agent_node(state: AgentState):
         
         # 记录重要记忆点（更智能的判断逻辑）
         if query_text and len(query_text) > 5:
-            # 定义重要信息的模式
-            important_patterns = [
-                # 个人信息（年龄、性别、职业等）
-                r'(?:我(?:今年|现在)?(?:是|有)?(?:\d+|多少)?岁)|(?:我的(?:名字|年龄|性别|职业|生日|爱好|喜欢)是?.*)',
-                # 事件信息（时间、地点、人物等）
-                r'(?:(?:今天|明天|后天|昨天|上周|下周|去年|今年)(?:\w+)?)|(?:在(?:哪里|哪个地方|什么位置))|(?:和(?:谁|什么人))',
-                # 情绪表达
-                r'(?:(?:我觉得|我感到|我认为)(?:很|非常|有点)(?:开心|高兴|难过|伤心|生气|愤怒|失望|期待|紧张))',
-                # 需求和请求
-                r'(?:请(?:帮我|给我|告诉我|教我)|(?:我想|我要|我需要)(?:\w+))'
-            ]
-            
             # 检查是否包含重要信息
-            has_important_info = False
-            for pattern in important_patterns:
-                if re.search(pattern, query_text, re.IGNORECASE):
-                    has_important_info = True
-                    break
+            has_important_info = any(p.search(query_text) for p in _IMPORTANT_INFO_RES)
             
             # 记录重要记忆点
             if has_important_info:
                 # 尝试提取记忆点的类型
                 memory_type = "普通对话"
-                if re.search(r'我的(?:名字|年龄|性别|职业|生日|爱好|喜欢)', query_text, re.IGNORECASE):
+                if _MEMORY_PERSONAL_RE.search(query_text):
                     memory_type = "个人信息"
-                elif re.search(r'(?:今天|明天|后天|昨天|上周|下周|去年|今年)', query_text):
+                elif _MEMORY_EVENT_RE.search(query_text):
                     memory_type = "事件信息"
-                elif re.search(r'(?:我觉得|我感到|我认为)(?:很|非常|有点)(?:开心|高兴|难过|伤心|生气|愤怒|失望|期待|紧张)', query_text):
+                elif _MEMORY_EMOTION_RE.search(query_text):
                     memory_type = "情绪表达"
-                elif re.search(r'(?:请(?:帮我|给我|告诉我|教我)|(?:我想|我要|我需要))', query_text):
+                elif _MEMORY_REQUEST_RE.search(query_text):
                     memory_type = "需求请求"
                 
                 # 根据信息重要性设置权重
@@ -811,7 +928,7 @@ async def agent_node(state: AgentState):
                 user_id=real_user_id,
                 user_name=user_display_name
             )
-            logger.info(f"[{ts}] 📝 [Memory] Saved conversation to memory")
+            logger.info("[%s] 📝 [Memory] Saved conversation to memory", ts)
         except Exception as e:
             logger.error(f"[{ts}] ❌ [Memory] Failed to save conversation: {e}")
     
@@ -515,25 +515,23 @@ class GlobalRelationDB:
                     # 继续执行后续逻辑，从数据库获取
             
             if cached_profile:
-                # 如果用户名有更新，需要同步到数据库和缓存
-                if current_name and cached_profile.name != current_name:
+                # 只有用户名有更新时才需要同步到数据库和缓存，否则直接返回缓存，不访问数据库
+                if current_name is not None and current_name.strip() and cached_profile.name != current_name:
                     cached_profile.name = current_name
-                db = SessionLocal()
-                try:
-                    db_profile = db.query(UserProfileModel).filter(UserProfileModel.qq_id == user_qq).first()
-                    if db_profile:
-                        # 只有当current_name不为None且不为空字符串时才更新用户名
-                        if current_name is not None and current_name.strip():
+                    db = SessionLocal()
+                    try:
+                        db_profile = db.query(UserProfileModel).filter(UserProfileModel.qq_id == user_qq).first()
+                        if db_profile:
                             db_profile.name = current_name
                             db_profile.updated_at = str(time.time())
                             db.commit()
                             await cached_user_info_set(user_qq, cached_profile)
-                except SQLAlchemyError as e:
-                    db.rollback()
-                    logger.error(f"[RelationDB] 更新用户名失败: {str(e)}")
-                finally:
-                    db.close()
-            return cached_profile
+                    except SQLAlchemyError as e:
+                        db.rollback()
+                        logger.error(f"[RelationDB] 更新用户名失败: {str(e)}")
+                    finally:
+                        db.close()
+                return cached_profile
         
         db = SessionLocal()
         
@@ -624,10 +622,8 @@ class GlobalRelationDB:
                 profile.updated_at = str(time.time())
                 db.commit()
                 
-                # 更新后清除缓存
-                import asyncio
-                from app.utils.cache import cached_user_info_set
-                asyncio.create_task(cached_user_info_set(user_qq, None))
+                # 更新后同步写入缓存
+                asyncio.create_task(self._write_through_dimensions(user_qq, {"intimacy": new_intimacy}))
                 
                 return new_intimacy
             else:
@@ -651,6 +647,22 @@ class GlobalRelationDB:
         finally:
             db.close()
 
+    async def _write_through_dimensions(self, user_qq: str, dimensions: Dict[str, Any]):
+        """
+        将数据库中已提交的关系维度同步到缓存中的用户资料（原地更新）
+        缓存中没有可更新的资料对象时清除缓存，由下次读取从数据库重建
+        :param user_qq: 用户QQ号
+        :param dimensions: 更新后的维度值，例如：{"intimacy": 62}
+        """
+        from app.utils.cache import cached_user_info_get, cached_user_info_set
+        
+        cached_profile = await cached_user_info_get(user_qq)
+        if isinstance(cached_profile, UserProfile):
+            for dimension, value in dimensions.items():
+                setattr(cached_profile.relationship, dimension, value)
+        else:
+            await cached_user_info_set(user_qq, None)
+
     async def update_relationship_dimensions(self, user_qq: str, deltas: Dict[str, int]):
         """
         更新关系的多个维度（好感度、熟悉度、信任度、兴趣匹配等）
@@ -658,8 +670,6 @@ class GlobalRelationDB:
         :param deltas: 包含各个维度变化值的字典，例如：{"intimacy": 2, "familiarity": 1}
         :return: 更新后的关系维度字典
         """
-        from app.utils.cache import cached_user_info_set
-        
         user_qq = str(user_qq)
         db = SessionLocal()
         
@@ -704,8 +714,8 @@ class GlobalRelationDB:
                 # 提交更改
                 db.commit()
                 
-                # 更新后清除缓存
-                await cached_user_info_set(user_qq, None)
+                # 更新后同步写入缓存，下次读取无需访问数据库
+                await self._write_through_dimensions(user_qq, updated_dimensions)
                 
                 return updated_dimensions
             else:
@@ -775,6 +785,41 @@ class GlobalRelationDB:
         finally:
             db.close()
 
+    def update_last_interaction_times(self, updates: Dict[str, float]) -> int:
+        """
+        批量更新多个用户的最后交互时间，只修改该字段，不覆盖关系中的其他数据
+        
+        Args:
+            updates: 用户QQ号 -> 最后交互时间戳
+            
+        Returns:
+            int: 实际更新的用户数量
+        """
+        if not updates:
+            return 0
+        
+        db = SessionLocal()
+        
+        try:
+            profiles = db.query(UserProfileModel).filter(UserProfileModel.qq_id.in_(list(updates))).all()
+            
+            for profile in profiles:
+                # 创建一个全新的字典来确保SQLAlchemy检测到变化
+                relationship_data = dict(profile.relationship_data or {})
+                relationship_data["last_interaction_time"] = updates[profile.qq_id]
+                profile.relationship_data = relationship_data
+                profile.updated_at = str(time.time())
+            
+            db.commit()
+            return len(profiles)
+            
+        except SQLAlchemyError as e:
+            db.rollback()
+            logger.error(f"[RelationDB] 批量更新最后交互时间失败: {str(e)}")
+            return 0
+        finally:
+            db.close()
+
     def add_memory_point(self, user_qq: str, category: str, content: str, weight: float = 1.0) -> bool:
         """
         添加记忆点到用户关系中
@@ -5,16 +5,28 @@ from typing import List, Dict, Any, Optional
 from datetime import datetime
 import math
 import threading
+import time
+from functools import lru_cache
 from openai import OpenAI
 from langchain_core.vectorstores import VectorStore
 from langchain_core.documents import Document
 from app.core.config import config
 from app.utils.cache import cached_embedding_get, cached_embedding_set
+from app.utils.log_time import log_ts
 
 # 配置日志
 logger = logging.getLogger("VectorStore")
 
 
+@lru_cache(maxsize=4096)
+def _parse_created_at(created_at_str: str) -> Optional[float]:
+    """将记忆的创建时间解析为时间戳，相同的时间字符串只解析一次，格式错误时返回None"""
+    try:
+        return datetime.strptime(created_at_str, "%Y-%m-%d %H:%M:%S").timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
 class VectorMemory(VectorStore):
     """
     向量存储器，实现了LangChain的VectorStore接口
@@ -116,10 +128,15 @@ class VectorMemory(VectorStore):
         
         return embeddings
 
+    async def embed_query(self, text: str) -> List[float]:
+        """生成单条文本的嵌入向量（带缓存）"""
+        embeddings = await self._generate_embeddings([text])
+        return embeddings[0] if embeddings else []
+
     async def add_texts(self, texts: List[str], metadatas: Optional[List[dict]] = None,
                   ids: Optional[List[str]] = None, **kwargs) -> List[str]:
         """添加文本到向量存储"""
-        ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        ts = log_ts()
         if not texts: return []
 
         # 如果没有提供ID，生成唯一ID
@@ -228,8 +245,10 @@ class VectorMemory(VectorStore):
         计算时间衰减因子，优化的衰减算法
         """
         try:
-            mem_time = datetime.strptime(created_at_str, "%Y-%m-%d %H:%M:%S")
-            delta_hours = (datetime.now() - mem_time).total_seconds() / 3600.0
+            mem_ts = _parse_created_at(created_at_str)
+            if mem_ts is None:
+                return 1.0
+            delta_hours = (time.time() - mem_ts) / 3600.0
             
             # 优化的衰减算法：前24小时衰减较慢，之后加速衰减
             if delta_hours < 24:
@@ -243,7 +262,8 @@ class VectorMemory(VectorStore):
         except:
             return 1.0
 
-    async def search(self, query: str, k: int = 3, categories: List[str] = None, source_boosts: Dict[str, float] = None, importance_threshold: float = 0.5) -> List[str]:
+    async def search(self, query: str, k: int = 3, categories: List[str] = None, source_boosts: Dict[str, float] = None, importance_threshold: float = 0.5,
+                     query_embedding: Optional[List[float]] = None) -> List[str]:
         """
         自定义搜索，考虑时间衰减和重要性，带缓存，支持分类筛选和自定义来源权重
         
@@ -253,6 +273,7 @@ class VectorMemory(VectorStore):
             categories: 可选，指定要搜索的分类
             source_boosts: 可选，自定义来源权重
             importance_threshold: 可选，重要性阈值，过滤低于此阈值的记忆
+            query_embedding: 可选，调用方已生成的 query 嵌入向量，传入时不再重复生成
             
         Returns:
             List[str]: 搜索结果列表
@@ -275,14 +296,19 @@ class VectorMemory(VectorStore):
             return cached_results
         
         # 生成查询嵌入向量（在锁外进行，提高并发性能）
-        query_embedding = await self._generate_embeddings([query])
-        query_embedding = query_embedding[0] if query_embedding else []
+        if not query_embedding:
+            query_embedding = await self.embed_query(query)
+        
+        # 指定分类时直接在向量库中按分类过滤，只在这些分类的记忆中检索，
+        # 避免候选被其他分类占满后再丢弃
+        where = {"category": {"$in": list(categories)}} if categories else None
         
         with self._lock:
             try:
                 results = self.collection.query(
                     query_embeddings=[query_embedding],
                     n_results=k * 5,  # 增加候选数量，提高选择质量
+                    where=where,
                     include=["documents", "metadatas", "distances"]
                 )
             except Exception as e:
@@ -318,12 +344,6 @@ class VectorMemory(VectorStore):
                 continue
             seen_docs.add(doc)
             
-            # 分类筛选
-            if categories:
-                doc_category = meta.get("category", "")
-                if doc_category not in categories:
-                    continue
-            
             # 重要性阈值过滤
             importance = float(meta.get("importance", 1))
             if importance < importance_threshold:
@@ -381,7 +401,7 @@ class VectorMemory(VectorStore):
 
     async def delete_by_semantic(self, query: str, threshold: float = 0.3):
         """通过语义删除相似项"""
-        ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        ts = log_ts()
         with self._lock:
             try:
                 # 手动生成查询嵌入向量（异步）
@@ -581,21 +601,17 @@ class VectorMemory(VectorStore):
                 logger.info("[VectorStore] 没有需要清理的文档")
                 return
             
-            from datetime import datetime, timedelta
-            current_time = datetime.now()
+            expire_before = time.time() - 30 * 86400
             old_doc_ids = []
             
             # 找出超过30天的文档
             for i, metadata in enumerate(all_docs["metadatas"]):
                 created_at = metadata.get("created_at")
                 if created_at:
-                    try:
-                        doc_time = datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S")
-                        if current_time - doc_time > timedelta(days=30):
-                            old_doc_ids.append(all_docs["ids"][i])
-                    except Exception:
-                        # 如果日期格式不正确，跳过
-                        continue
+                    doc_ts = _parse_created_at(created_at)
+                    # 如果日期格式不正确，跳过
+                    if doc_ts is not None and doc_ts < expire_before:
+                        old_doc_ids.append(all_docs["ids"][i])
             
             # 删除过时的文档
             if old_doc_ids:
@@ -2,6 +2,7 @@ from langchain_experimental.utilities import PythonREPL
 from app.tools.base_tool import BaseTool, ToolParam
 import asyncio
 
+# 所有调用共享同一个 repl，变量在多次分析之间保留
 repl = PythonREPL()
 
 
@@ -33,8 +34,11 @@ class DataAnalysisTool(BaseTool):
                         "error": "Security Alert: System modules are restricted."
                     }
             
-            # 在单独的执行器中运行同步代码，避免阻塞事件循环
-            loop = asyncio.get_event_loop()
+            # 在线程池中运行同步代码，避免阻塞事件循环
+            # 不用进程池：Windows/macOS 以 spawn 方式启动子进程，每个子进程都会重新导入
+            # qq_server 并重复执行其模块级初始化（日志、QQBotManager、FastAPI 等），
+            # 而且各子进程的 repl 互不相通，多次分析之间的变量会丢失
+            loop = asyncio.get_running_loop()
             result = await loop.run_in_executor(None, repl.run, code)
             
             return {
@@ -1,13 +1,14 @@
 import asyncio
 import hashlib
-import json
 import logging
 import msgpack
 import os
 from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional, Tuple, Union, Deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union, Deque
 from collections import deque, OrderedDict
+from functools import lru_cache
 from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage, AIMessage
+from app.utils import fastjson
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -18,6 +19,47 @@ cache_dir = os.path.join(BASE_DIR, "cache")
 os.makedirs(cache_dir, exist_ok=True)
 
 
+@lru_cache(maxsize=1024)
+def _message_digest(message_type: str, content: str) -> bytes:
+    """
+    计算单条纯文本消息的摘要
+    同一次调用中缓存读取、请求合并、缓存写入会对同一批消息各生成一次键，
+    静态的系统提示词也会在每轮重复出现，按消息缓存摘要后重复的部分无需再次哈希
+    """
+    return hashlib.blake2b(f"{message_type}\x00{content}".encode("utf-8"), digest_size=16).digest()
+
+
+def generate_llm_cache_key(messages: List[BaseMessage], model: str, temperature: float, query_type: str = "default") -> str:
+    """
+    根据输入消息生成唯一的缓存键
+    
+    Args:
+        messages: LLM调用的输入消息列表
+        model: 使用的模型名称
+        temperature: 模型的温度参数
+        query_type: 查询类型，用于区分不同的缓存策略
+        
+    Returns:
+        唯一的缓存键字符串
+    """
+    hasher = hashlib.blake2b(digest_size=32)
+    hasher.update(msgpack.packb([model, temperature, query_type], use_bin_type=True))
+    
+    for msg in messages:
+        content = msg.content
+        if isinstance(content, str) and not msg.additional_kwargs:
+            hasher.update(_message_digest(msg.__class__.__name__, content))
+        else:
+            # 多模态内容或带附加参数的消息，完整序列化后参与哈希
+            hasher.update(msgpack.packb({
+                "type": msg.__class__.__name__,  # 消息类型
+                "content": content,  # 消息内容
+                "additional_kwargs": msg.additional_kwargs,  # 附加参数
+            }, use_bin_type=True, default=str))
+    
+    return hasher.hexdigest()
+
+
 class LLMCache:
     """
     LLM调用缓存系统
@@ -117,27 +159,7 @@ class LLMCache:
         Returns:
             唯一的缓存键字符串
         """
-        # 简化消息转换，只保留必要信息
-        message_data = []
-        for msg in messages:
-            msg_data = {
-                "type": msg.__class__.__name__,  # 消息类型
-                "content": msg.content,  # 消息内容
-                "additional_kwargs": msg.additional_kwargs,  # 附加参数
-            }
-            message_data.append(msg_data)
-        
-        # 添加模型、温度参数和查询类型
-        cache_key_data = {
-            "messages": message_data,
-            "model": model,
-            "temperature": temperature,
-            "query_type": query_type
-        }
-        
-        # 使用msgpack替代json序列化，提高性能
-        cache_key_bytes = msgpack.packb(cache_key_data, use_bin_type=True)
-        return hashlib.sha256(cache_key_bytes).hexdigest()
+        return generate_llm_cache_key(messages, model, temperature, query_type)
     
     async def get(self, messages: List[BaseMessage], model: str, temperature: float, query_type: str = "default") -> Optional[Any]:
         """
@@ -378,8 +400,7 @@ class LLMRequestQueue:
         model = getattr(llm, "model", "unknown")
         
         # 使用与LLMCache相同的键生成逻辑
-        llm_cache_instance = LLMCache()  # 创建临时实例来复用键生成逻辑
-        return llm_cache_instance._generate_key(messages, model, temperature)
+        return generate_llm_cache_key(messages, model, temperature)
     
     async def add_request(self, llm: Any, messages: List[BaseMessage], temperature: float = 0.7) -> Any:
         """
@@ -653,6 +674,59 @@ async def cached_llm_invoke(llm: Any, messages: List[BaseMessage], temperature:
     raise last_exception
 
 
+class _Flight:
+    """一次进行中的共享请求：执行 func 的独立任务和仍在等待结果的调用方数量"""
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+# 正在执行中的请求（键 -> 共享请求）
+_inflight_calls: Dict[str, _Flight] = {}
+
+
+def _finish_flight(key: str, flight: _Flight, task: asyncio.Future) -> None:
+    """共享请求结束后移除键；标记异常已被读取，避免没有等待方时输出未读取异常的警告"""
+    if _inflight_calls.get(key) is flight:
+        del _inflight_calls[key]
+    if not task.cancelled():
+        task.exception()
+
+
+async def singleflight(key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    同键请求去重：同一时刻相同键只执行一次 func，其余调用者等待并共享同一结果
+    
+    func 在独立的任务中执行，所有调用者（包括发起者）都通过 shield 等待它，
+    任何一个调用者被取消都不会影响其他调用者；所有调用者都放弃后才取消共享请求
+    
+    Args:
+        key: 请求键
+        func: 实际执行请求的无参协程函数
+        
+    Returns:
+        func 的执行结果（可能来自其他调用者正在执行的请求）
+    """
+    flight = _inflight_calls.get(key)
+    if flight is None:
+        flight = _Flight(asyncio.ensure_future(func()))
+        _inflight_calls[key] = flight
+        flight.task.add_done_callback(lambda task: _finish_flight(key, flight, task))
+    else:
+        logger.debug(f"合并进行中的请求: {key[:60]}")
+    
+    flight.waiters += 1
+    try:
+        return await asyncio.shield(flight.task)
+    finally:
+        flight.waiters -= 1
+        # 结果已无人等待时取消共享请求，避免白白占用资源
+        if flight.waiters == 0 and not flight.task.done():
+            flight.task.cancel()
+
+
 async def cached_user_info_get(user_qq: str) -> Optional[Any]:
     """
     从缓存获取用户信息
@@ -705,43 +779,54 @@ async def cached_context_set(context_key: str, context_data: Any, ttl: Optional[
     await context_cache.set([HumanMessage(content=f"context:{context_key}")], "context", 0.0, context_data, ttl)
 
 
-async def cached_tool_result_get(tool_name: str, tool_args: dict) -> Optional[Any]:
+def tool_args_key(tool_args: dict) -> str:
+    """
+    生成工具参数的规范化缓存键（按键排序），参数顺序不同的调用命中同一缓存
+    
+    Args:
+        tool_args: 工具调用参数
+        
+    Returns:
+        规范化的参数键字符串
+    """
+    return fastjson.dumps_sorted(tool_args)
+
+
+async def cached_tool_result_get(tool_name: str, tool_args: Union[dict, str]) -> Optional[Any]:
     """
     从缓存获取工具调用结果
     
     Args:
         tool_name: 工具名称
-        tool_args: 工具调用参数
+        tool_args: 工具调用参数，或 tool_args_key 预先生成的参数键
         
     Returns:
         工具调用结果，如果缓存未命中则返回None
     """
-    from langchain_core.messages import SystemMessage, HumanMessage
-    
+    args_key = tool_args if isinstance(tool_args, str) else tool_args_key(tool_args)
     cache_key_messages = [
         SystemMessage(content=f"tool:{tool_name}"),
-        HumanMessage(content=json.dumps(tool_args, sort_keys=True))
+        HumanMessage(content=args_key)
     ]
     
     result = await tool_cache.get(cache_key_messages, "tool", 0.0)
     return result
 
 
-async def cached_tool_result_set(tool_name: str, tool_args: dict, result: Any, ttl: Optional[int] = None) -> None:
+async def cached_tool_result_set(tool_name: str, tool_args: Union[dict, str], result: Any, ttl: Optional[int] = None) -> None:
     """
     将工具调用结果存入缓存
     
     Args:
         tool_name: 工具名称
-        tool_args: 工具调用参数
+        tool_args: 工具调用参数，或 tool_args_key 预先生成的参数键
         result: 工具调用结果
         ttl: 缓存过期时间（秒），如果为None则使用默认值
     """
-    from langchain_core.messages import SystemMessage, HumanMessage
-    
+    args_key = tool_args if isinstance(tool_args, str) else tool_args_key(tool_args)
     cache_key_messages = [
         SystemMessage(content=f"tool:{tool_name}"),
-        HumanMessage(content=json.dumps(tool_args, sort_keys=True))
+        HumanMessage(content=args_key)
     ]
     
     await tool_cache.set(cache_key_messages, "tool", 0.0, result, ttl)
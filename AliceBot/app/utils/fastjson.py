@@ -0,0 +1,49 @@
+import json
+from typing import Any, Tuple
+
+try:
+    import orjson
+except ImportError:  # orjson 不可用时回退到标准库
+    orjson = None
+
+# orjson.JSONDecodeError 是 json.JSONDecodeError 的子类，调用方统一捕获这个即可
+JSONDecodeError = json.JSONDecodeError
+
+# orjson 没有增量解码接口，raw_decode 统一使用标准库的解码器
+_DECODER = json.JSONDecoder()
+
+
+if orjson is not None:
+    def loads(text: str) -> Any:
+        """解析 JSON 文本"""
+        return orjson.loads(text)
+
+    def dumps(obj: Any) -> str:
+        """序列化为 JSON 字符串"""
+        return orjson.dumps(obj, default=str).decode()
+
+    def dumps_sorted(obj: Any) -> str:
+        """按键排序序列化，用于生成确定性的缓存键"""
+        return orjson.dumps(obj, default=str, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS).decode()
+else:
+    def loads(text: str) -> Any:
+        """解析 JSON 文本"""
+        return json.loads(text)
+
+    def dumps(obj: Any) -> str:
+        """序列化为 JSON 字符串"""
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str)
+
+    def dumps_sorted(obj: Any) -> str:
+        """按键排序序列化，用于生成确定性的缓存键"""
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), sort_keys=True, default=str)
+
+
+def raw_decode(text: str, idx: int = 0) -> Tuple[Any, int]:
+    """
+    从 idx 处解析一个完整的 JSON 值，忽略其后的多余文本
+
+    Returns:
+        (解析结果, 该值结束的位置)
+    """
+    return _DECODER.raw_decode(text, idx)
@@ -0,0 +1,77 @@
+from typing import Optional
+
+
+def _find_balanced(text: str, start: int, open_ch: str, close_ch: str) -> Optional[str]:
+    """
+    从 start 之后第一个 open_ch 开始线性扫描，返回括号配平的子串
+
+    只统计 open_ch / close_ch 的深度（合法 JSON 中另一种括号总是成对嵌套在内部）；
+    字符串内容用 str.find 整段跳过，字符串内部的括号不计入深度
+    """
+    start = text.find(open_ch, start)
+    if start == -1:
+        return None
+
+    depth = 0
+    i = start
+    n = len(text)
+
+    while i < n:
+        c = text[i]
+        if c == '"':
+            # 字符串内容直接用 str.find 跳到下一个未转义的引号，不逐字符遍历
+            end = i
+            while True:
+                end = text.find('"', end + 1)
+                if end == -1:
+                    return None
+                # 引号前连续反斜杠为偶数个时，引号未被转义
+                k = end - 1
+                while text[k] == "\\":
+                    k -= 1
+                if (end - 1 - k) % 2 == 0:
+                    break
+            i = end
+        elif c == open_ch:
+            depth += 1
+        elif c == close_ch:
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+        i += 1
+
+    return None
+
+
+def find_json_object(text: str, start: int = 0) -> Optional[str]:
+    """
+    线性扫描文本，返回第一个括号配平的顶层 JSON 对象子串
+
+    跟踪字符串状态（含转义），字符串内部的花括号不计入深度；
+    字符串内容用 str.find 整段跳过，整个过程只遍历一次文本，不依赖正则回溯
+
+    Args:
+        text: 可能包含 JSON 对象的文本（如 LLM 输出）
+        start: 开始查找的位置
+
+    Returns:
+        第一个完整的 JSON 对象子串，找不到配平的对象时返回 None
+    """
+    return _find_balanced(text, start, "{", "}")
+
+
+def find_json_array(text: str, start: int = 0) -> Optional[str]:
+    """
+    线性扫描文本，返回从 start 之后第一个 "[" 开始、方括号配平的子串
+
+    扫描规则与 find_json_object 相同；返回的子串不一定是合法 JSON
+    （例如正文中的 "[图片1]"），调用方解析失败时可从下一个 "[" 继续查找
+
+    Args:
+        text: 可能包含 JSON 数组的文本（如 LLM 输出）
+        start: 开始查找的位置
+
+    Returns:
+        第一个方括号配平的子串，找不到时返回 None
+    """
+    return _find_balanced(text, start, "[", "]")
@@ -0,0 +1,34 @@
+import time
+from functools import lru_cache
+
+
+@lru_cache(maxsize=1)
+def _format_second(second: int) -> str:
+    """格式化某一秒的时间戳，同一秒内的重复调用直接命中缓存"""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(second))
+
+
+def log_ts() -> str:
+    """
+    获取日志前缀使用的当前时间字符串（精确到秒）
+
+    Returns:
+        形如 "2024-01-01 12:00:00" 的时间字符串
+    """
+    return _format_second(int(time.time()))
+
+
+@lru_cache(maxsize=1)
+def _format_minute(minute_start: int) -> str:
+    """格式化某一分钟的时间，同一分钟内的重复调用直接命中缓存"""
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(minute_start))
+
+
+def now_minute_str() -> str:
+    """
+    获取当前时间字符串（精确到分钟），用于提示词中的当前时间
+
+    Returns:
+        形如 "2024-01-01 12:00" 的时间字符串
+    """
+    return _format_minute(int(time.time()) // 60 * 60)
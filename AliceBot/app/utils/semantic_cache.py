@@ -0,0 +1,152 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, List, Optional
+
+import numpy as np
+
+from app.core.config import config
+
+logger = logging.getLogger(__name__)
+
+
+class _Bucket:
+    """同一缓存键下的条目：归一化后的嵌入矩阵、对应结果和写入时间"""
+    __slots__ = ("vectors", "values", "timestamps")
+
+    def __init__(self):
+        self.vectors: Optional[np.ndarray] = None
+        self.values: List[Any] = []
+        self.timestamps: List[float] = []
+
+
+class SemanticPromptCache:
+    """
+    语义缓存：用户消息的嵌入与同一键下近期缓存的消息足够相似时，直接复用当时的结果
+
+    键通常是 (对话类型, 用户ID, 情绪)，保证只在相同场景下复用；
+    键之间按 LRU 淘汰，每个键内按写入顺序淘汰最旧的条目
+    """
+
+    def __init__(self, threshold: float = 0.92, max_keys: int = 256, max_entries_per_key: int = 32,
+                 ttl: int = 600):
+        """
+        初始化语义缓存
+
+        Args:
+            threshold: 余弦相似度阈值，达到该值才视为命中
+            max_keys: 最多保留的缓存键数量
+            max_entries_per_key: 每个键最多保留的条目数
+            ttl: 条目过期时间（秒）
+        """
+        self.threshold = threshold
+        self.max_keys = max_keys
+        self.max_entries_per_key = max_entries_per_key
+        self.ttl = ttl
+        self._buckets: "OrderedDict[Hashable, _Bucket]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> Optional[np.ndarray]:
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        if norm == 0:
+            return None
+        return vec / norm
+
+    def _expire(self, bucket: _Bucket) -> None:
+        """丢弃桶内已过期的条目（条目按写入时间有序，过期的都在前面）"""
+        cutoff = time.time() - self.ttl
+        expired = 0
+        for ts in bucket.timestamps:
+            if ts >= cutoff:
+                break
+            expired += 1
+        if expired:
+            del bucket.values[:expired]
+            del bucket.timestamps[:expired]
+            bucket.vectors = bucket.vectors[expired:] if bucket.values else None
+
+    def get(self, key: Hashable, embedding: List[float]) -> Optional[Any]:
+        """
+        查找与给定嵌入最相似的缓存结果
+
+        Args:
+            key: 缓存键
+            embedding: 当前消息的嵌入向量
+
+        Returns:
+            相似度达到阈值时返回缓存结果，否则返回 None
+        """
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            self._expire(bucket)
+        vec = self._normalize(embedding)
+        if bucket is None or bucket.vectors is None or vec is None or bucket.vectors.shape[1] != vec.shape[0]:
+            self.stats["misses"] += 1
+            return None
+
+        similarities = bucket.vectors @ vec
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            self.stats["misses"] += 1
+            return None
+
+        self._buckets.move_to_end(key)
+        self.stats["hits"] += 1
+        logger.debug(f"语义缓存命中，相似度: {similarities[best]:.4f}")
+        return bucket.values[best]
+
+    def add(self, key: Hashable, embedding: List[float], value: Any) -> None:
+        """
+        写入一条缓存
+
+        Args:
+            key: 缓存键
+            embedding: 消息的嵌入向量
+            value: 要缓存的结果
+        """
+        vec = self._normalize(embedding)
+        if vec is None:
+            return
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = _Bucket()
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            self._expire(bucket)
+            # 嵌入模型更换导致维度不一致时，旧条目已无法比较
+            if bucket.vectors is not None and bucket.vectors.shape[1] != vec.shape[0]:
+                bucket.vectors = None
+                bucket.values.clear()
+                bucket.timestamps.clear()
+
+        row = vec[np.newaxis, :]
+        bucket.vectors = row if bucket.vectors is None else np.vstack((bucket.vectors, row))
+        bucket.values.append(value)
+        bucket.timestamps.append(time.time())
+
+        overflow = len(bucket.values) - self.max_entries_per_key
+        if overflow > 0:
+            bucket.vectors = bucket.vectors[overflow:]
+            del bucket.values[:overflow]
+            del bucket.timestamps[:overflow]
+
+    def invalidate(self, key: Hashable) -> None:
+        """清空某个键下的全部缓存"""
+        self._buckets.pop(key, None)
+
+    def clear(self) -> None:
+        """清空全部缓存"""
+        self._buckets.clear()
+
+
+# 全局语义缓存实例（用于 agent_node 的回复）
+semantic_prompt_cache = SemanticPromptCache(
+    threshold=config.SEMANTIC_CACHE_THRESHOLD,
+    ttl=config.SEMANTIC_CACHE_TTL
+)
@@ -834,7 +834,7 @@ class QQBotManager:
             "user_profile": profile.model_dump(),
             "should_reply": False,
             "is_proactive_mode": False,
-            "global_emotion_snapshot": global_store.get_emotion_snapshot().model_dump(),
+            "global_emotion_snapshot": global_store.get_emotion_snapshot()._asdict(),
             "psychological_context": {},
             "current_image_artifact": None,
             "tool_call": {},
@@ -959,7 +959,7 @@ class QQBotManager:
                             # 🚀 开启 Proactive Mode
                             "is_proactive_mode": True,
 
-                            "global_emotion_snapshot": global_store.get_emotion_snapshot().model_dump(),
+                            "global_emotion_snapshot": global_store.get_emotion_snapshot()._asdict(),
                             "psychological_context": {},
                             "current_image_artifact": None,
                             "tool_call": {},